@@ -0,0 +1,39 @@
+"""Per-file attach_tree vs set-based attach_tree_many."""
+
+import argparse
+
+from benchmarks.common import add_files, make_vault, timed
+from tagumori import service
+from tagumori.query import parse_for_storage
+
+TREE = "genre[rock[classic]],artist[Led Zeppelin],year[1971]"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-n", "--files", type=int, default=50_000)
+    args = parser.parse_args()
+
+    node = parse_for_storage(TREE)
+    print(f"{args.files} files, tree: {TREE}")
+
+    conn = make_vault()
+    file_ids = add_files(conn, args.files)
+    with timed("attach_tree (per file)"):
+        for file_id in file_ids:
+            service.attach_tree(conn, file_id, node)
+        conn.commit()
+
+    conn = make_vault()
+    file_ids = add_files(conn, args.files)
+    with timed("attach_tree_many (set-based)"):
+        service.attach_tree_many(conn, file_ids, node)
+        conn.commit()
+
+    with timed("attach_tree_many (already attached)"):
+        service.attach_tree_many(conn, file_ids, node)
+        conn.commit()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+"""Per-row deletes vs set-based bulk deletes of files and tags."""
+
+import argparse
+
+from benchmarks.common import add_files, make_vault, timed
+from tagumori import crud, service
+from tagumori.query import parse_for_storage
+
+TREE = "genre[rock[classic]],artist[Led Zeppelin],year[1971]"
+
+
+def tagged_vault(n: int):
+    conn = make_vault()
+    file_ids = add_files(conn, n)
+    service.attach_tree_many(conn, file_ids, parse_for_storage(TREE))
+    conn.commit()
+    return conn, file_ids
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-n", "--files", type=int, default=50_000)
+    args = parser.parse_args()
+
+    print(f"{args.files} files, tree: {TREE}")
+
+    conn, file_ids = tagged_vault(args.files)
+    with timed("file delete (per row)"):
+        for file_id in file_ids:
+            crud.file.delete(conn, file_id)
+        conn.commit()
+
+    conn, file_ids = tagged_vault(args.files)
+    with timed("iter_drop_file_tags (batched)"):
+        for _ in service.iter_drop_file_tags(conn, file_ids):
+            conn.commit()
+
+    conn, _ = tagged_vault(args.files)
+    genre = crud.tag.get_by_name(conn, "genre")
+    with timed("tag delete (single cascade)"):
+        crud.tag.delete(conn, genre["id"])
+        conn.commit()
+
+    conn, _ = tagged_vault(args.files)
+    genre = crud.tag.get_by_name(conn, "genre")
+    with timed("iter_delete_tags (batched)"):
+        for _ in service.iter_delete_tags(conn, [genre["id"]]):
+            conn.commit()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,41 @@
+"""Fingerprinting throughput with one process vs a process pool.
+
+Writes a set of random files to a temp dir and hashes them with
+service.iter_hash_files. Files are in the page cache after being written, so
+this measures hashing itself; on cold media the disk is the limit.
+"""
+
+import argparse
+import os
+import tempfile
+from pathlib import Path
+
+from benchmarks.common import make_vault, timed
+from tagumori import crud, service
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-n", "--files", type=int, default=200)
+    parser.add_argument("--size-mb", type=float, default=8)
+    args = parser.parse_args()
+
+    size = int(args.size_mb * (1 << 20))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        files = [Path(tmp) / f"{i}.bin" for i in range(args.files)]
+        for f in files:
+            f.write_bytes(os.urandom(size))
+
+        conn = make_vault()
+        crud.file.get_or_create_many(conn, files)
+        total_mb = args.files * size / (1 << 20)
+        print(f"{args.files} files, {total_mb:.0f} MB")
+
+        for workers in sorted({1, os.cpu_count() or 1}):
+            with timed(f"{workers} process(es)"):
+                sum(service.iter_hash_files(conn, rehash=True, workers=workers))
+
+
+if __name__ == "__main__":
+    main()
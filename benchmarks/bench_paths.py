@@ -0,0 +1,74 @@
+"""Vault size and path operations for a music-library-like tree.
+
+Files live a few directories deep under a long common prefix, as they would
+on a NAS. Only goes through crud.file, so it runs against any schema.
+"""
+
+import argparse
+import os
+import tempfile
+from pathlib import Path
+
+from benchmarks.common import make_vault, timed
+from tagumori import crud, service
+
+PREFIX = "/mnt/storage/media/music/library"
+
+
+def library(n: int) -> list[Path]:
+    """n tracks, 12 per album, 5 albums per artist, 20 artists per letter."""
+    return [
+        Path(
+            f"{PREFIX}/{chr(65 + i // 1200 % 26)}/artist {i // 60:05}"
+            f"/album {i // 12:06} (remastered edition)/{i % 12:02} - track {i}.flac"
+        )
+        for i in range(n)
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-n", "--files", type=int, default=200_000)
+    args = parser.parse_args()
+
+    files = library(args.files)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Path(tmp) / "vault.db"
+        conn = make_vault(db)
+
+        with timed(f"add {args.files} files"):
+            service.add_tags_to_files(conn, files, ["genre[rock]"])
+            conn.commit()
+
+        conn.execute("VACUUM")
+        print(f"{'vault size':<40} {os.path.getsize(db) / 1024:8.0f} KB")
+
+        with timed("look up all by path"):
+            paths = map(str, files)
+            found = sum(1 for _ in crud.file.iter_many_by_unique_col(conn, paths))
+        assert found == args.files
+
+        with timed("list all paths, ordered"):
+            for _ in service.iter_query(conn, [], []):
+                pass
+
+        artist = files[len(files) // 2].parent.parent
+        with timed("search one artist, by regex"):
+            pattern = f"^{artist}/"
+            found = sum(
+                1 for _ in service.iter_query(conn, ["rock"], [], False, pattern)
+            )
+
+        with timed("search one artist, --under"):
+            scoped = service.iter_query(conn, ["rock"], [], under=artist)
+            assert sum(1 for _ in scoped) == found
+
+        with timed("rename top-level directory"):
+            moved = crud.file.move_prefix(conn, PREFIX, PREFIX + " (old)")
+            conn.commit()
+        assert moved == args.files
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""Relocating many moved files: one walk per file vs a single shared walk.
+
+Builds a real directory tree in a temp dir, tracks some of its files, moves
+them into another subdirectory and relocates them from the tree's root.
+"""
+
+import argparse
+import tempfile
+from pathlib import Path
+
+from benchmarks.common import make_vault, timed
+from tagumori import crud, service
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--dirs", type=int, default=100)
+    parser.add_argument("--files-per-dir", type=int, default=100)
+    parser.add_argument("-n", "--moved", type=int, default=50)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp)
+        for d in range(args.dirs):
+            (root / f"d{d}").mkdir()
+            for i in range(args.files_per_dir):
+                (root / f"d{d}" / f"{i}.txt").touch()
+
+        # the last files of the last dirs, so a walk has to go far to find them
+        moved = [root / f"d{args.dirs - 1 - i}" / "0.txt" for i in range(args.moved)]
+
+        conn = make_vault()
+        crud.file.get_or_create_many(conn, moved)
+        conn.commit()
+
+        dest = root / "moved"
+        dest.mkdir()
+        for i, path in enumerate(moved):
+            path.rename(dest / f"{i}.txt")
+
+        total = args.dirs * args.files_per_dir
+        print(f"{total} files, {args.moved} moved")
+
+        records = crud.file.get_all(conn)
+
+        with timed("one walk per file"):
+            for record in records:
+                service.relocate_files(conn, [record], root)
+        conn.rollback()
+
+        with timed("single walk"):
+            service.relocate_files(conn, records, root)
+        conn.rollback()
+
+
+if __name__ == "__main__":
+    main()
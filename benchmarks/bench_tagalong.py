@@ -0,0 +1,70 @@
+"""Full tagalong apply vs delta apply after adding a single rule.
+
+The vault has many files, each tagged with a handful of tags drawn from a
+large vocabulary, and a tagalong graph where every tag implies a few others.
+"""
+
+import argparse
+import random
+
+from benchmarks.common import add_files, make_vault, timed
+from tagumori import crud
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-n", "--files", type=int, default=50_000)
+    parser.add_argument("--tags", type=int, default=2_000)
+    parser.add_argument("--rules", type=int, default=4_000)
+    parser.add_argument("--tags-per-file", type=int, default=5)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+
+    conn = make_vault()
+    file_ids = add_files(conn, args.files)
+    tags = [
+        t["id"]
+        for t in crud.tag.get_or_create_many(
+            conn, (f"tag{i}" for i in range(args.tags))
+        )
+    ]
+
+    conn.executemany(
+        "INSERT OR IGNORE INTO file_tag (file_id, tag_id) VALUES (?, ?)",
+        (
+            (file_id, tag_id)
+            for file_id in file_ids
+            for tag_id in rng.sample(tags, args.tags_per_file)
+        ),
+    )
+
+    # edges only go "forward", so the graph is a DAG with long chains
+    with timed(f"create {args.rules} rules (closure upkeep)"):
+        for _ in range(args.rules):
+            source, target = sorted(rng.sample(tags, 2))
+            crud.tagalong.create(conn, source, target)
+
+    (pairs,) = conn.execute("SELECT COUNT(*) FROM tagalong_closure").fetchone()
+    print(f"{args.files} files, {args.tags} tags, {pairs} implied pairs")
+
+    with timed("apply (all files, all tags)"):
+        crud.tagalong.apply(conn)
+    conn.commit()
+
+    source, target = tags[-2], tags[-1]
+    crud.tagalong.create(conn, source, target)
+
+    with timed("apply after new rule (full)"):
+        crud.tagalong.apply(conn)
+    conn.rollback()
+
+    crud.tagalong.create(conn, source, target)
+    with timed("apply after new rule (delta)"):
+        affected = crud.tagalong.implying(conn, [source])
+        crud.tagalong.apply(conn, tag_ids=affected)
+    conn.rollback()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""Materialized vs virtual tagalongs: storage and query latency.
+
+Every file gets one artist tag, and every artist implies a few genres. With
+materialized tagalongs the genres are stored on each file; with virtual ones
+they're resolved when querying.
+"""
+
+import argparse
+import random
+
+from benchmarks.common import add_files, make_vault, timed
+from tagumori import crud
+from tagumori.query import plan
+from tagumori.query.executor import execute
+
+
+def db_size(conn) -> int:
+    (pages,) = conn.execute("PRAGMA page_count").fetchone()
+    (page_size,) = conn.execute("PRAGMA page_size").fetchone()
+    return pages * page_size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-n", "--files", type=int, default=50_000)
+    parser.add_argument("--artists", type=int, default=500)
+    parser.add_argument("--genres", type=int, default=40)
+    parser.add_argument("--genres-per-artist", type=int, default=4)
+    parser.add_argument("--queries", type=int, default=20)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+
+    conn = make_vault()
+    file_ids = add_files(conn, args.files)
+
+    artists = crud.tag.get_or_create_many(
+        conn, (f"artist{i}" for i in range(args.artists))
+    )
+    genres = crud.tag.get_or_create_many(
+        conn, (f"genre{i}" for i in range(args.genres))
+    )
+
+    for artist in artists:
+        for genre in rng.sample(genres, args.genres_per_artist):
+            crud.tagalong.create(conn, artist["id"], genre["id"])
+
+    conn.executemany(
+        "INSERT INTO file_tag (file_id, tag_id) VALUES (?, ?)",
+        ((file_id, rng.choice(artists)["id"]) for file_id in file_ids),
+    )
+    conn.commit()
+
+    queries = [plan(f"genre{rng.randrange(args.genres)}") for _ in range(args.queries)]
+
+    for mode in ("materialized", "virtual"):
+        virtual = mode == "virtual"
+        crud.tagalong.set_virtual(conn, virtual)
+
+        if virtual:
+            crud.tagalong.drop_implied(conn)
+        else:
+            crud.tagalong.apply(conn)
+        conn.commit()
+        conn.execute("VACUUM")
+
+        (rows,) = conn.execute("SELECT COUNT(*) FROM file_tag").fetchone()
+        print(f"{mode}: {rows} file_tag rows, {db_size(conn) / 1024:.0f} KB")
+
+        with timed(f"{mode}: {args.queries} genre queries"):
+            for qp in queries:
+                execute(conn, qp)
+
+
+if __name__ == "__main__":
+    main()
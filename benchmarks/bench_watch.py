@@ -0,0 +1,61 @@
+"""Syncing the vault after a big directory move, with each watcher.
+
+A directory of tracked files is moved inside a watched tree. Inotify pairs
+the move events, polling recognizes the directory by inode; either way the
+vault gets a single prefix update.
+"""
+
+import argparse
+import sys
+import tempfile
+from pathlib import Path
+
+from benchmarks.common import make_vault, timed
+from tagumori import crud, service
+from tagumori.watch import InotifyWatcher, PollingWatcher
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-n", "--files", type=int, default=100_000)
+    args = parser.parse_args()
+
+    watchers = [PollingWatcher]
+    if sys.platform.startswith("linux"):
+        watchers.append(InotifyWatcher)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp).resolve()
+        src = root / "src"
+        src.mkdir()
+        files = [src / f"{i}.txt" for i in range(args.files)]
+        for f in files:
+            f.touch()
+
+        conn = make_vault()
+        crud.file.get_or_create_many(conn, files)
+        conn.commit()
+        print(f"{args.files} tracked files")
+
+        for cls in watchers:
+            dst = root / "dst"
+            w = cls([root])
+            src.rename(dst)
+
+            with timed(f"{cls.__name__}: detect"):
+                if cls is PollingWatcher:
+                    changes = w.poll()
+                else:
+                    changes = w.to_changes(w._read(1.0))
+
+            with timed(f"{cls.__name__}: sync"):
+                moved, _, _ = service.sync_changes(conn, changes)
+            conn.rollback()
+
+            assert moved == args.files, moved
+            w.close()
+            dst.rename(src)
+
+
+if __name__ == "__main__":
+    main()
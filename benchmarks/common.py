@@ -0,0 +1,43 @@
+"""Shared helpers for the benchmark scripts.
+
+Run a benchmark from the repo root, e.g. `python -m benchmarks.bench_attach`.
+"""
+
+import sqlite3
+import time
+from contextlib import contextmanager
+
+from tagumori import crud
+from tagumori.db.init import SCHEMA_PATH
+from tagumori.db.migrations import migrate
+
+
+def make_vault(path=":memory:") -> sqlite3.Connection:
+    conn = sqlite3.connect(path)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA foreign_keys = ON")
+    conn.executescript(SCHEMA_PATH.read_text())
+    migrate(conn)
+    return conn
+
+
+def add_files(conn: sqlite3.Connection, n: int, prefix: str = "/bench") -> list[int]:
+    """Inserts n fake file records directly and returns their ids."""
+    dir_id = crud.directory.get_id(conn, prefix, create=True)
+    conn.executemany(
+        "INSERT INTO file (directory_id, name) VALUES (?, ?)",
+        ((dir_id, str(i)) for i in range(n)),
+    )
+    return [
+        id_
+        for (id_,) in conn.execute(
+            "SELECT id FROM file WHERE directory_id = ? ORDER BY id", (dir_id,)
+        )
+    ]
+
+
+@contextmanager
+def timed(label: str):
+    start = time.perf_counter()
+    yield
+    print(f"{label:<40} {time.perf_counter() - start:8.3f} s")
@@ -0,0 +1 @@
+from tagumori.vault import PreparedQuery, Vault  # noqa: F401
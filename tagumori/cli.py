@@ -1,14 +1,19 @@
+from collections.abc import Iterator
+from itertools import chain
 from pathlib import Path
 
 import click
 
-from tagumori import service
-from tagumori.commands import db, file, query, tag, tagalong
+from tagumori import crud, service
+from tagumori.commands import db, file, query, tag, tagalong, transfer, watch
 from tagumori.commands.context import LazyVault
-from tagumori.utils import format_file_output
+from tagumori.utils import format_file_output, iter_tree
 
 DEFAULT_VAULT_PATH = Path("./vault.db")
 
+# files SQLite keeps next to a vault while it's open
+VAULT_SIDECARS = ("", "-journal", "-wal", "-shm")
+
 
 @click.group()
 @click.option(
@@ -27,16 +32,76 @@ cli.add_command(tagalong.tagalong)
 cli.add_command(db.db)
 cli.add_command(file.file)
 cli.add_command(query.query)
+cli.add_command(transfer.import_)
+cli.add_command(transfer.export)
+cli.add_command(watch.watch)
+
+
+def _file_sources(fn):
+    """Options for giving files explicitly (-f) and/or as directory trees (-r)."""
+    options = [
+        click.option(
+            "-f",
+            "files",
+            type=click.Path(path_type=Path, exists=True),
+            multiple=True,
+        ),
+        click.option(
+            "-r",
+            "--recursive",
+            "dirs",
+            type=click.Path(path_type=Path, exists=True, file_okay=False),
+            multiple=True,
+            help="Every file under a directory.",
+        ),
+        click.option(
+            "--include",
+            multiple=True,
+            metavar="GLOB",
+            help="With -r, only files matching a glob.",
+        ),
+        click.option(
+            "--exclude",
+            multiple=True,
+            metavar="GLOB",
+            help="With -r, skip files and directories matching a glob.",
+        ),
+        click.option(
+            "--batch-size",
+            type=click.IntRange(min=1),
+            default=service.CHUNK_SIZE,
+            show_default=True,
+            help="Files per transaction.",
+        ),
+    ]
+    for option in reversed(options):
+        fn = option(fn)
+    return fn
+
+
+def _iter_sources(
+    files: tuple[Path, ...],
+    dirs: tuple[Path, ...],
+    include: tuple[str, ...],
+    exclude: tuple[str, ...],
+    vault: Path,
+) -> Iterator[Path]:
+    """Explicit files, then those found under dirs, streamed as found.
+
+    The vault and its sidecar files are left out of directory walks, so
+    tagging the directory it lives in doesn't track the database.
+    """
+    if not files and not dirs:
+        raise click.UsageError("Provide files with -f or directories with -r")
+
+    skip = {f"{vault.resolve()}{suffix}" for suffix in VAULT_SIDECARS}
+    found = chain.from_iterable(iter_tree(d.resolve(), include, exclude) for d in dirs)
+
+    return chain(files, (p for p in found if str(p) not in skip))
 
 
 @cli.command(help="Add tags to files")
-@click.option(
-    "-f",
-    "files",
-    required=True,
-    type=click.Path(path_type=Path, exists=True),
-    multiple=True,
-)
+@_file_sources
 @click.option("-t", "tags", required=True, type=click.STRING, multiple=True)
 @click.option(
     "--tagalongs/--no-tagalongs",
@@ -48,36 +113,46 @@ cli.add_command(query.query)
 def add(
     vault: LazyVault,
     files: tuple[Path, ...],
+    dirs: tuple[Path, ...],
+    include: tuple[str, ...],
+    exclude: tuple[str, ...],
+    batch_size: int,
     tags: tuple[str, ...],
     tagalongs: bool,
 ):
+    paths = _iter_sources(files, dirs, include, exclude, vault.path)
+
     with vault as conn:
-        service.add_tags_to_files(conn, files, tags, tagalongs)
+        for _ in service.iter_add_tags(conn, paths, tags, tagalongs, batch_size):
+            conn.commit()
 
 
 @cli.command(help="Remove tags from files")
-@click.option(
-    "-f",
-    "files",
-    required=True,
-    type=click.Path(path_type=Path, exists=True),
-    multiple=True,
-)
+@_file_sources
 @click.option("-t", "tags", required=True, type=click.STRING, multiple=True)
 @click.pass_obj
-def remove(vault: LazyVault, files: tuple[Path, ...], tags: tuple[str, ...]):
+def remove(
+    vault: LazyVault,
+    files: tuple[Path, ...],
+    dirs: tuple[Path, ...],
+    include: tuple[str, ...],
+    exclude: tuple[str, ...],
+    batch_size: int,
+    tags: tuple[str, ...],
+):
+    paths = _iter_sources(files, dirs, include, exclude, vault.path)
+    removed = 0
+
     with vault as conn:
-        service.remove_tags_from_files(conn, files, tags)
+        for count in service.iter_remove_tags(conn, paths, tags, batch_size):
+            conn.commit()
+            removed += count
+
+    click.echo(f"Removed {removed} tag(s).")
 
 
 @cli.command(help="Replace tags on files", name="set")
-@click.option(
-    "-f",
-    "files",
-    required=True,
-    type=click.Path(path_type=Path, exists=True),
-    multiple=True,
-)
+@_file_sources
 @click.option("-t", "tags", required=True, type=click.STRING, multiple=True)
 @click.option(
     "--tagalongs/--no-tagalongs",
@@ -87,11 +162,20 @@ def remove(vault: LazyVault, files: tuple[Path, ...], tags: tuple[str, ...]):
 )
 @click.pass_obj
 def set_(
-    vault: LazyVault, files: tuple[Path, ...], tags: tuple[str, ...], tagalongs: bool
+    vault: LazyVault,
+    files: tuple[Path, ...],
+    dirs: tuple[Path, ...],
+    include: tuple[str, ...],
+    exclude: tuple[str, ...],
+    batch_size: int,
+    tags: tuple[str, ...],
+    tagalongs: bool,
 ):
+    paths = _iter_sources(files, dirs, include, exclude, vault.path)
 
     with vault as conn:
-        service.set_tags_on_files(conn, files, tags, tagalongs)
+        for _ in service.iter_set_tags(conn, paths, tags, tagalongs, batch_size):
+            conn.commit()
 
 
 @cli.command(help="Drop files' tags")
@@ -104,9 +188,12 @@ def set_(
 )
 @click.option("--retain-file", type=click.BOOL, is_flag=True)
 @click.pass_obj
-def drop(vault: LazyVault, files: tuple[int, ...], retain_file: bool):
+def drop(vault: LazyVault, files: tuple[Path, ...], retain_file: bool):
     with vault as conn:
-        service.drop_file_tags(conn, files, retain_file)
+        file_ids = [x["id"] for x in crud.file.iter_many_by_path(conn, files)]
+
+        for _ in service.iter_drop_file_tags(conn, file_ids, retain_file):
+            conn.commit()
 
 
 @cli.command(help="List files (with optional filters).")
@@ -124,6 +211,11 @@ def drop(vault: LazyVault, files: tuple[int, ...], retain_file: bool):
     is_flag=True,
     help="Inverts the regex match (not select/exclude).",
 )
+@click.option(
+    "--under",
+    type=click.Path(path_type=Path, file_okay=False),
+    help="Only list files in and under this directory.",
+)
 @click.option(
     "--relative-to",
     type=click.Path(path_type=Path, file_okay=False, dir_okay=True),
@@ -141,22 +233,31 @@ def ls(
     pattern: str,
     ignore_case: bool,
     invert_match: bool,
+    under: Path | None,
     relative_to: Path,
     prefix: str,
 ):
     # TODO: could potentially fetch tags already in service
     with vault as conn:
-        paths = service.execute_query(
-            conn, select, exclude, ignore_tag_case, pattern, ignore_case, invert_match
+        paths = service.iter_query(
+            conn,
+            select,
+            exclude,
+            ignore_tag_case,
+            pattern,
+            ignore_case,
+            invert_match,
+            under,
         )
 
         if long:
-            files_with_tags = service.get_files_with_tags(conn, paths)
+            files_with_tags = service.iter_files_with_tags(conn, paths)
         else:
-            files_with_tags = {f: {} for f in paths}
+            files_with_tags = ((f, {}) for f in paths)
 
-    for msg in format_file_output(files_with_tags, long, relative_to, prefix):
-        click.echo(msg)
+        # results are streamed, so output happens while the vault is open
+        for msg in format_file_output(files_with_tags, long, relative_to, prefix):
+            click.echo(msg)
 
 
 def main():
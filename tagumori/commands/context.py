@@ -14,6 +14,10 @@ class LazyVault:
         self._ctx = ctx
         self._conn: Connection | None = None
 
+    @property
+    def path(self) -> Path:
+        return self._path
+
     def _get_conn(self) -> Connection:
         if self._conn is None:
             if not self._path.exists():
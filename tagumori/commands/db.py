@@ -1,4 +1,5 @@
 import sqlite3
+import time
 from datetime import datetime
 from pathlib import Path
 
@@ -61,41 +62,71 @@ def backup(vault: LazyVault, dest: Path, directory: Path):
     click.echo(f"Backup created: {backup_path}")
 
 
+def _legacy_to_expr(tag: dict) -> str:
+    name = tag["name"]
+    children = tag.get("children", [])
+    if not children:
+        return name
+    inner = ",".join(_legacy_to_expr(c) for c in children)
+    return f"{name}[{inner}]"
+
+
 @db.command(help="Migrate legacy json vault into SQLite.")
 @click.argument("json-vault", type=click.Path(path_type=Path, exists=True))
+@click.option(
+    "--batch-size",
+    type=click.IntRange(min=1),
+    default=service.CHUNK_SIZE,
+    show_default=True,
+    help="Entries per transaction.",
+)
 @click.pass_obj
-def migrate_json(vault: LazyVault, json_vault: Path):
-    import json
-
+def migrate_json(vault: LazyVault, json_vault: Path, batch_size: int):
     from tagumori import crud
-
-    with open(json_vault) as f:
-        data = json.load(f)
-
-    def to_expr(tag: dict) -> str:
-        name = tag["name"]
-        children = tag.get("children", [])
-        if not children:
-            return name
-        inner = ",".join(to_expr(c) for c in children)
-        return f"{name}[{inner}]"
-
-    with vault as conn:
-        for entry in data["entries"]:
-            path = Path(entry["name"])
-            tags = [to_expr(c) for c in entry["children"]]
-
-            service.add_tags_to_files(conn, [path], tags, False)
-
-        sources, targets = zip(*data["tagalongs"])
-        source_rows = crud.tag.get_or_create_many(conn, sources)
-        target_rows = crud.tag.get_or_create_many(conn, targets)
-
-        for source, target in zip(source_rows, target_rows):
-            crud.tagalong.create(conn, source["id"], target["id"])
+    from tagumori.utils import iter_json_members
+
+    size = json_vault.stat().st_size
+    tagalongs = []
+
+    with open(json_vault, "rb") as f, vault as conn:
+        # entries are streamed; tagalongs are few, so they're collected and
+        # applied once all files are in
+        def entries():
+            for key, item in iter_json_members(f):
+                if key == "entries":
+                    tags = [_legacy_to_expr(c) for c in item["children"]]
+                    yield Path(item["name"]), tags
+                elif key == "tagalongs":
+                    tagalongs.append(item)
+
+        total = 0
+        start = time.perf_counter()
+
+        for count in service.import_records(conn, entries(), False, batch_size):
+            conn.commit()
+            total += count
+
+            elapsed = time.perf_counter() - start
+            done = f.tell()
+            eta = elapsed * (size - done) / done if done else 0
+            click.echo(
+                f"{done / size:.0%} {total} entries ({total / elapsed:.0f}/s), "
+                f"ETA {eta:.0f}s",
+                err=True,
+            )
+
+        # import_records drains the generator, so trailing tagalongs are in too
+        names = dict.fromkeys(name for pair in tagalongs for name in pair)
+        rows = crud.tag.get_or_create_many(conn, names)
+        ids = {row["name"]: row["id"] for row in rows}
+
+        for source, target in tagalongs:
+            crud.tagalong.create(conn, ids[source], ids[target])
 
         crud.tagalong.apply(conn)
 
+    click.echo(f"Migrated {total} entries.")
+
 
 @db.command(help="Database info")
 @click.pass_obj
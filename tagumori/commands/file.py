@@ -1,5 +1,9 @@
+import os
+import shutil
+import time
 from enum import Enum
 from pathlib import Path
+from sqlite3 import Connection, Row
 from typing import Sequence
 
 import click
@@ -15,21 +19,28 @@ class FileStatus(Enum):
     INODE_MISSING = "inode_missing"
 
 
-def get_file_status(path: Path, record: dict):
-    if not path.exists():
+def status_from_stat(record: Row | dict, stat: os.stat_result | None) -> FileStatus:
+    if stat is None:
         return FileStatus.NOT_FOUND
 
     if not record["inode"]:
         return FileStatus.INODE_MISSING
 
-    stat = path.stat()
-
     if not (record["inode"] == stat.st_ino and record["device"] == stat.st_dev):
         return FileStatus.INODE_MISMATCH
 
     return FileStatus.OK
 
 
+def get_file_status(path: Path, record: dict):
+    try:
+        stat = path.stat()
+    except OSError:
+        stat = None
+
+    return status_from_stat(record, stat)
+
+
 @click.group(help="File management")
 @click.pass_obj
 def file(vault: LazyVault):
@@ -125,8 +136,10 @@ def drop(vault: LazyVault, files: Sequence[Path]):
             f"Going do drop {len(records)} file(s) from database (file itself will remain on disk). You sure about this?",
             abort=True,
         )
-        for file in records:
-            crud.file.delete(conn, file["id"])
+        file_ids = [r["id"] for r in records]
+
+        for _ in service.iter_drop_file_tags(conn, file_ids):
+            conn.commit()
 
 
 @file.command(help="Edit file record.")
@@ -137,7 +150,7 @@ def drop(vault: LazyVault, files: Sequence[Path]):
     type=click.Path(path_type=Path),
     is_flag=False,
     flag_value=Path("."),
-    help="Searches for file by inode/device (default: current dir)",
+    help="Searches for file by inode/device or content hash (default: current dir)",
 )
 @click.option("--path", type=click.Path(path_type=Path, dir_okay=False, exists=True))
 @click.pass_obj
@@ -172,57 +185,156 @@ def edit(
                 crud.file.update(conn, record["id"], p, stat.st_ino, stat.st_dev)
 
         elif relocate:
-            for record in records:
-                service.relocate_file(conn, record, relocate)
+            for record in service.relocate_files(conn, records, relocate):
+                click.echo(f"Not found: {record['path']}", err=True)
 
 
 @file.command(help="Check file health.")
 @click.option("--fix", is_flag=True, help="Fix missing inodes by refreshing from path")
+@click.option(
+    "--incremental",
+    is_flag=True,
+    help="Only check files in directories changed since the last check.",
+)
+@click.option(
+    "-j",
+    "--jobs",
+    type=click.IntRange(min=1),
+    default=16,
+    show_default=True,
+    help="Files to stat in parallel.",
+)
+@click.option(
+    "--batch-size",
+    type=click.IntRange(min=1),
+    default=service.CHUNK_SIZE,
+    show_default=True,
+    help="Updates per transaction.",
+)
 @click.pass_obj
-def check(vault: LazyVault, fix: bool):
-    issues = []
+def check(vault: LazyVault, fix: bool, incremental: bool, jobs: int, batch_size: int):
+    labels = {
+        FileStatus.NOT_FOUND: click.style("NOT FOUND", fg="red"),
+        FileStatus.INODE_MISMATCH: click.style("MISMATCH", fg="red"),
+        FileStatus.INODE_MISSING: click.style("INODE MISSING", fg="yellow"),
+    }
+
+    checked = issues = 0
+    fixes: list[tuple[int, Path, int, int]] = []
+    stats: list[tuple[int, int, int, int]] = []
+    # directories with unfixed issues stay unchecked, so they're reported again
+    issue_dirs: set[str] = set()
+    start = time.perf_counter()
+
+    def flush():
+        crud.file.update_many(conn, fixes)
+        crud.file.update_stats(conn, stats)
+        conn.commit()
+        fixes.clear()
+        stats.clear()
 
     with vault as conn:
-        all_files = crud.file.get_all(conn)
+        changed_dirs = service.forget_changed_dirs(conn, jobs)
 
-        for record in all_files:
-            p = Path(record["path"])
-            status = get_file_status(p, record)
+        for record, stat in service.iter_file_stats(conn, jobs, incremental):
+            checked += 1
+            status = status_from_stat(record, stat)
 
-            if status == FileStatus.OK:
-                continue
+            last_seen = (record["size"], record["mtime_ns"], record["ctime_ns"])
+            if stat and last_seen != (stat.st_size, stat.st_mtime_ns, stat.st_ctime_ns):
+                stats.append(
+                    (record["id"], stat.st_size, stat.st_mtime_ns, stat.st_ctime_ns)
+                )
 
-            # Auto-fix missing inodes (file exists, just needs stat)
-            if status == FileStatus.INODE_MISSING and fix:
-                stat = p.stat()
-                crud.file.update(conn, record["id"], p, stat.st_ino, stat.st_dev)
-                issues.append((p, status, True))
-            else:
-                issues.append((p, status, False))
+            if status != FileStatus.OK:
+                issues += 1
+                p = Path(record["path"])
+
+                # Auto-fix missing inodes (file exists, just needs stat)
+                fixed = status == FileStatus.INODE_MISSING and fix
+                if fixed and stat is not None:
+                    fixes.append((record["id"], p, stat.st_ino, stat.st_dev))
+                else:
+                    issue_dirs.add(crud.dir_state.dir_of(record["path"]))
+
+                suffix = click.style(" (fixed)", fg="green") if fixed else ""
+                click.echo(f"{p}  [{labels[status]}]{suffix}")
+
+            if len(fixes) + len(stats) >= batch_size:
+                flush()
+
+        flush()
+        crud.dir_state.set_many(
+            conn, ((d, m) for d, m in changed_dirs.items() if d not in issue_dirs)
+        )
+        crud.dir_state.forget(conn, issue_dirs)
 
     if not issues:
         click.echo("No issues found.")
-        return
 
-    for path, status, fixed in issues:
-        label = {
-            FileStatus.NOT_FOUND: click.style("NOT FOUND", fg="red"),
-            FileStatus.INODE_MISMATCH: click.style("MISMATCH", fg="red"),
-            FileStatus.INODE_MISSING: click.style("INODE MISSING", fg="yellow"),
-        }[status]
+    elapsed = time.perf_counter() - start
+    click.echo(
+        f"Checked {checked} files in {elapsed:.1f}s "
+        f"({checked / elapsed:.0f} files/s), "
+        f"{len(changed_dirs)} changed directories.",
+        err=True,
+    )
+
+
+@file.command("hash", help="Fingerprint file contents.")
+@click.option("--rehash", is_flag=True, help="Also redo files hashed before.")
+@click.option(
+    "-j", "--jobs", type=click.IntRange(min=1), help="Processes  [default: CPUs]"
+)
+@click.option(
+    "--batch-size",
+    type=click.IntRange(min=1),
+    default=service.CHUNK_SIZE,
+    show_default=True,
+    help="Files per transaction.",
+)
+@click.pass_obj
+def hash_(vault: LazyVault, rehash: bool, jobs: int | None, batch_size: int):
+    total = 0
+    start = time.perf_counter()
+
+    with vault as conn:
+        for count in service.iter_hash_files(conn, rehash, jobs, batch_size):
+            conn.commit()
+            total += count
+
+    elapsed = time.perf_counter() - start
+    click.echo(f"Hashed {total} file(s) in {elapsed:.1f}s.")
+
 
-        suffix = click.style(" (fixed)", fg="green") if fixed else ""
-        click.echo(f"{path}  [{label}]{suffix}")
+@file.command(help="List tracked files with identical content.")
+@click.option(
+    "-j", "--jobs", type=click.IntRange(min=1), help="Processes  [default: CPUs]"
+)
+@click.pass_obj
+def dupes(vault: LazyVault, jobs: int | None):
+    with vault as conn:
+        for i, group in enumerate(service.iter_dupes(conn, jobs)):
+            if i:
+                click.echo()
+            for path in group:
+                click.echo(path)
 
 
-@file.command(help="Move tracked file(s) to a new location.")
+@file.command(help="Move tracked files or directories to a new location.")
 @click.argument("sources", nargs=-1, type=click.Path(path_type=Path, exists=True))
 @click.option("-t", "--to", "dst", required=True, type=click.Path(path_type=Path))
 @click.option("-f", "--force", is_flag=True, help="Overwrite without confirmation")
+@click.option(
+    "-j",
+    "--jobs",
+    type=click.IntRange(min=1),
+    default=16,
+    show_default=True,
+    help="Files to stat in parallel, if a directory changes filesystem.",
+)
 @click.pass_obj
-def mv(vault: LazyVault, sources: Sequence[Path], dst: Path, force: bool):
-    import shutil
-
+def mv(vault: LazyVault, sources: Sequence[Path], dst: Path, force: bool, jobs: int):
     if not sources:
         raise click.UsageError("No source files provided")
 
@@ -234,17 +346,22 @@ def mv(vault: LazyVault, sources: Sequence[Path], dst: Path, force: bool):
 
     with vault as conn:
         for src in sources:
-            record = crud.file.get_by_path(conn, src)
-
-            if not record:
-                raise click.ClickException(f"{src} is not tracked in the vault")
-
             # Determine actual destination path
             if dst.is_dir():
                 actual_dst = dst / src.name
             else:
                 actual_dst = dst
 
+            if src.is_dir():
+                moved = _mv_dir(conn, src, actual_dst, jobs)
+                click.echo(f"Moved {src} -> {actual_dst} ({moved} tracked files)")
+                continue
+
+            record = crud.file.get_by_path(conn, src)
+
+            if not record:
+                raise click.ClickException(f"{src} is not tracked in the vault")
+
             if actual_dst.exists() and not force:
                 click.confirm(f"{actual_dst} already exists. Overwrite?", abort=True)
 
@@ -253,3 +370,28 @@ def mv(vault: LazyVault, sources: Sequence[Path], dst: Path, force: bool):
             crud.file.update(conn, record["id"], actual_dst, stat.st_ino, stat.st_dev)
 
             click.echo(f"Moved {src} -> {actual_dst}")
+
+
+def _mv_dir(conn: Connection, src: Path, dst: Path, jobs: int) -> int:
+    """Moves a directory once and its tracked files with it, by moving its
+    record. Inodes survive a rename, so files are only re-stat'ed if the
+    directory changed filesystem. Returns number of tracked files moved."""
+    old, new = src.resolve(), dst.resolve()
+
+    if crud.directory.get_id(conn, str(old)) is None:
+        raise click.ClickException(f"{src} has no files tracked in the vault")
+
+    if new.is_relative_to(old):
+        raise click.ClickException(f"Can't move {src} into itself")
+
+    if dst.exists():
+        raise click.ClickException(f"{dst} already exists")
+
+    device = old.stat().st_dev
+    shutil.move(old, new)
+    moved = crud.file.move_prefix(conn, str(old), str(new))
+
+    if new.stat().st_dev != device:
+        service.refresh_inodes_under(conn, new, jobs)
+
+    return moved
@@ -1,6 +1,7 @@
 import re
 from pathlib import Path
 from random import random
+from typing import Any
 
 import click
 
@@ -28,6 +29,11 @@ def query(vault: LazyVault):
     is_flag=True,
     help="Inverts the regex match (not select/exclude).",
 )
+@click.option(
+    "--under",
+    type=click.Path(path_type=Path, file_okay=False),
+    help="Only match files in and under this directory.",
+)
 @click.option(
     "-f",
     "--force",
@@ -44,11 +50,12 @@ def save(
     pattern: str,
     ignore_case: bool,
     invert_match: bool,
+    under: Path | None,
     force: bool,
 ):
     import json
 
-    data = {
+    data: dict[str, Any] = {
         "name": name,
         "select_tags": json.dumps(list(select)),
         "exclude_tags": json.dumps(list(exclude)),
@@ -56,6 +63,7 @@ def save(
         "pattern": pattern,
         "ignore_case": ignore_case,
         "invert_match": invert_match,
+        "under": str(under.resolve()) if under else None,
     }
 
     with vault as conn:
@@ -114,7 +122,7 @@ def run(
             select_strs = json.loads(query["select_tags"])
             exclude_strs = json.loads(query["exclude_tags"])
 
-            paths = service.execute_query(
+            paths = service.iter_query(
                 conn,
                 select_strs,
                 exclude_strs,
@@ -122,13 +130,14 @@ def run(
                 query["pattern"],
                 bool(query["ignore_case"]),
                 bool(query["invert_match"]),
+                Path(query["under"]) if query["under"] else None,
             )
 
             if long:
-                files_with_tags = service.get_files_with_tags(conn, paths)
+                files_with_tags = service.iter_files_with_tags(conn, paths)
 
             else:
-                files_with_tags = {f: {} for f in paths}
+                files_with_tags = ((f, {}) for f in paths)
 
             output_lines = format_file_output(
                 files_with_tags, long, relative_to, prefix
@@ -165,8 +174,9 @@ def ls_long_format(data: dict):
         ("-v", data["invert_match"]),
     ]
     flags = " ".join(f for f, v in flag_map if v)
+    under = f"--under {data['under']}" if data["under"] else ""
 
-    return f"{selects} {excludes} -p {data['pattern']} {flags}".strip()
+    return f"{selects} {excludes} -p {data['pattern']} {flags} {under}".strip()
 
 
 @query.command(help="List all saved queries.")
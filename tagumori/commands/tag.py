@@ -2,7 +2,7 @@ from typing import Optional
 
 import click
 
-from tagumori import crud
+from tagumori import crud, service
 from tagumori.commands.context import LazyVault
 from tagumori.utils import compile_pattern
 
@@ -56,8 +56,10 @@ def edit_tag(vault: LazyVault, tag: list[str], clear_category: bool, **kwargs):
 
 
 @tag.command(help="Replace all instances of a tag.", name="replace")
-@click.argument("old", nargs=-1, type=click.STRING, required=True)
+@click.argument("old", nargs=-1, type=click.STRING)
 @click.option("-n", "--new", type=click.STRING, required=True)
+@click.option("-p", "--pattern", help="Also replace tags matching regex pattern.")
+@click.option("-i", "--ignore-case", is_flag=True)
 @click.option(
     "--remove",
     type=click.BOOL,
@@ -65,15 +67,30 @@ def edit_tag(vault: LazyVault, tag: list[str], clear_category: bool, **kwargs):
     help="Remove the replaced tags entirely.",
 )
 @click.pass_obj
-def replace_tag(vault: LazyVault, old: tuple[str, ...], new: str, remove: bool):
+def replace_tag(
+    vault: LazyVault,
+    old: tuple[str, ...],
+    new: str,
+    pattern: str | None,
+    ignore_case: bool,
+    remove: bool,
+):
+    if not (old or pattern):
+        raise click.UsageError("Provide tags to replace or --pattern")
+
     with vault as conn:
-        new_record = crud.tag.get_or_create(conn, new)
-        olds = crud.tag.get_many_by_name(conn, old)
-        for old_record in olds:
-            crud.file_tag.replace(conn, old_record["id"], new_record["id"])
+        olds = list(old)
+
+        if pattern:
+            regex = compile_pattern(pattern, ignore_case)
+            olds += [
+                t["name"] for t in crud.tag.iter_all(conn) if regex.search(t["name"])
+            ]
 
-            if remove:
-                crud.tag.delete(conn, old_record["id"])
+        merged = service.replace_tags(conn, olds, new, remove)
+
+    if merged:
+        click.echo(f"Merged {merged} colliding tag(s).")
 
 
 @tag.command(help="Removes all instances of a tag.", name="delete")
@@ -86,9 +103,10 @@ def remove_tag(vault: LazyVault, tags: tuple[str, ...]):
     )
 
     with vault as conn:
-        for tag in tags:
-            tag_id = crud.tag.get_by_name(conn, tag)[0]
-            crud.tag.delete(conn, tag_id)
+        tag_ids = [t["id"] for t in crud.tag.get_many_by_name(conn, tags)]
+
+        for _ in service.iter_delete_tags(conn, tag_ids):
+            conn.commit()
 
 
 @tag.command(help="List tags", name="ls")
@@ -16,8 +16,13 @@ def tagalong(vault: LazyVault):
 @tagalong.command(help="Register new tagalongs.")
 @click.option("-t", "--tag", required=True, multiple=True)
 @click.option("-ta", "--tagalong", required=True, multiple=True)
+@click.option(
+    "--apply/--no-apply",
+    default=True,
+    help="Apply / don't apply the new tagalongs to files already tagged.",
+)
 @click.pass_obj
-def add(vault: LazyVault, tag: tuple[str, ...], tagalong: tuple[str, ...]):
+def add(vault: LazyVault, tag: tuple[str, ...], tagalong: tuple[str, ...], apply: bool):
     with vault as conn:
         sources = crud.tag.get_or_create_many(conn, tag)
         targets = crud.tag.get_or_create_many(conn, tagalong)
@@ -25,23 +30,41 @@ def add(vault: LazyVault, tag: tuple[str, ...], tagalong: tuple[str, ...]):
         for source, target in product(sources, targets):
             crud.tagalong.create(conn, source["id"], target["id"])
 
+        # only nodes with the sources, or tags implying them, can gain tags
+        if apply:
+            source_ids = [s["id"] for s in sources]
+            crud.tagalong.apply(conn, tag_ids=crud.tagalong.implying(conn, source_ids))
+
 
 @tagalong.command(help="Remove tagalongs.")
 @click.option("-t", "--tag", required=True, multiple=True)
 @click.option("-ta", "--tagalong", required=True, multiple=True)
+@click.option(
+    "--retract/--keep",
+    default=True,
+    help="Remove / keep tags the tagalongs have added to files.",
+)
 @click.pass_obj
-def remove(vault: LazyVault, tag: tuple[str, ...], tagalong: tuple[str, ...]):
+def remove(
+    vault: LazyVault, tag: tuple[str, ...], tagalong: tuple[str, ...], retract: bool
+):
+    retracted = 0
+
     with vault as conn:
         sources = crud.tag.get_many_by_name(conn, tag)
         targets = crud.tag.get_many_by_name(conn, tagalong)
 
         for source, target in product(sources, targets):
-            crud.tagalong.delete(conn, source["id"], target["id"])
+            retracted += crud.tagalong.delete(conn, source["id"], target["id"], retract)
+
+    if retracted:
+        click.echo(f"Retracted {retracted} implied tag(s).")
 
 
 @tagalong.command(help="Show all tagalongs.")
+@click.option("--stats", is_flag=True, help="Show size of the implied tag graph.")
 @click.pass_obj
-def ls(vault: LazyVault):
+def ls(vault: LazyVault, stats: bool):
     # TODO: Consider adding a grep-like filter if such would prove to be useful
     with vault as conn:
         for tag, tagalong in sorted(
@@ -49,16 +72,70 @@ def ls(vault: LazyVault):
         ):
             click.echo(f"{tag} -> {tagalong}")
 
+        if stats:
+            row = crud.tagalong.closure_stats(conn)
+            click.echo()
+            click.echo(f"Rules: {row['rules']}")
+            click.echo(f"Implied pairs: {row['pairs']}")
+            click.echo(f"Tags with tagalongs: {row['sources']}")
+            click.echo(f"Most implied by one tag: {row['max_implied'] or 0}")
+            click.echo(f"Tags in cycles: {row['cyclic']}")
+
 
 @tagalong.command(help="Apply all tagalongs (to all files by default).")
 @click.option(
     "-f", "--file", type=click.Path(path_type=Path, exists=True), multiple=True
 )
+@click.option("-t", "--tag", multiple=True, help="Only apply tagalongs of given tags.")
 @click.pass_obj
-def apply(vault: LazyVault, file: tuple[Path, ...]):
-    # TODO: consider filtering by tag
+def apply(vault: LazyVault, file: tuple[Path, ...], tag: tuple[str, ...]):
     with vault as conn:
         files = crud.file.get_many_by_path(conn, file)
         file_ids = [f["id"] for f in files]
 
-        crud.tagalong.apply(conn, file_ids)
+        tag_ids = None
+        if tag:
+            tags = crud.tag.get_many_by_name(conn, tag)
+            tag_ids = crud.tagalong.implying(conn, [t["id"] for t in tags])
+
+        crud.tagalong.apply(conn, file_ids, tag_ids)
+
+
+@tagalong.command(help="Apply tagalongs automatically whenever tags are added.")
+@click.option("--on/--off", "enabled", default=None, help="Enable / disable.")
+@click.pass_obj
+def auto(vault: LazyVault, enabled: bool | None):
+    with vault as conn:
+        if enabled and crud.tagalong.is_virtual(conn):
+            raise click.ClickException("Tagalongs are virtual, nothing to apply.")
+
+        if enabled is not None:
+            crud.tagalong.set_auto_apply(conn, enabled)
+
+            # catch up, so existing tags are in the same state as new ones
+            if enabled:
+                crud.tagalong.apply(conn)
+
+        state = "on" if crud.tagalong.is_auto_apply(conn) else "off"
+
+    click.echo(f"Automatic tagalongs: {state}")
+
+
+@tagalong.command(help="Resolve tagalongs at query time instead of storing them.")
+@click.option("--on/--off", "enabled", default=None, help="Enable / disable.")
+@click.pass_obj
+def virtual(vault: LazyVault, enabled: bool | None):
+    with vault as conn:
+        if enabled:
+            crud.tagalong.set_auto_apply(conn, False)
+            crud.tagalong.set_virtual(conn, True)
+            n = crud.tagalong.drop_implied(conn)
+            click.echo(f"Dropped {n} stored implied tag(s).")
+
+        elif enabled is not None:
+            crud.tagalong.set_virtual(conn, False)
+            crud.tagalong.apply(conn)
+
+        state = "on" if crud.tagalong.is_virtual(conn) else "off"
+
+    click.echo(f"Virtual tagalongs: {state}")
@@ -0,0 +1,145 @@
+import csv
+import json
+import time
+from collections.abc import Generator
+from pathlib import Path
+
+import click
+
+from tagumori import crud, service
+from tagumori.commands.context import LazyVault
+
+# read buffer for manifests; large sequential reads are much cheaper than many
+# small ones on network storage
+BUFFER_SIZE = 1 << 20
+
+# keys the tagalong and query records of an export can't do without
+RULE_KEYS = {"tagalong": ("tag", "tagalong"), "query": ("name",)}
+
+
+def read_jsonl(
+    manifest: Path, rules: list[dict] | None = None
+) -> Generator[tuple[Path, list[str]]]:
+    """Yields (path, tags) from lines like {"path": "a.mp3", "tags": ["rock"]}.
+
+    `tags` may also be a single tag expression string. Tagalong and query
+    records of an export are collected into `rules`, if given.
+    """
+    with open(manifest, "rb", buffering=BUFFER_SIZE) as f:
+        for line_no, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+
+            try:
+                record = json.loads(line)
+
+                # exports also carry tagalongs, queries and checkpoints
+                kind = record.get("type", "file")
+                if kind in RULE_KEYS and rules is not None:
+                    if missing := set(RULE_KEYS[kind]) - record.keys():
+                        raise KeyError(", ".join(sorted(missing)))
+                    rules.append(record)
+                if kind != "file":
+                    continue
+
+                tags = record.get("tags", [])
+                yield Path(record["path"]), [tags] if isinstance(tags, str) else tags
+
+            except (ValueError, KeyError, AttributeError) as e:
+                raise click.ClickException(f"{manifest}:{line_no}: bad record ({e})")
+
+
+def read_csv(manifest: Path) -> Generator[tuple[Path, list[str]]]:
+    """Yields (path, tags) from a CSV with `path` and `tags` columns, where
+    `tags` holds a tag expression."""
+    with open(manifest, newline="", encoding="utf-8", buffering=BUFFER_SIZE) as f:
+        reader = csv.DictReader(f)
+
+        if not {"path", "tags"} <= set(reader.fieldnames or []):
+            raise click.ClickException(f"{manifest}: needs 'path' and 'tags' columns")
+
+        for row in reader:
+            yield Path(row["path"]), [row["tags"]] if row["tags"] else []
+
+
+@click.command(name="import", help="Import tags from a JSONL or CSV manifest.")
+@click.argument("manifest", type=click.Path(path_type=Path, exists=True))
+@click.option(
+    "--format",
+    "format_",
+    type=click.Choice(["jsonl", "csv"]),
+    help="Manifest format (default: by file extension).",
+)
+@click.option(
+    "--batch-size",
+    type=click.IntRange(min=1),
+    default=service.CHUNK_SIZE,
+    show_default=True,
+    help="Records per transaction.",
+)
+@click.option(
+    "--tagalongs/--no-tagalongs",
+    type=click.BOOL,
+    default=True,
+    help="Apply / don't apply tagalongs.",
+)
+@click.pass_obj
+def import_(
+    vault: LazyVault,
+    manifest: Path,
+    format_: str | None,
+    batch_size: int,
+    tagalongs: bool,
+):
+    format_ = format_ or ("csv" if manifest.suffix.lower() == ".csv" else "jsonl")
+    rules: list[dict] = []
+    records = read_csv(manifest) if format_ == "csv" else read_jsonl(manifest, rules)
+
+    total = 0
+    start = time.perf_counter()
+
+    with vault as conn:
+        for count in service.import_records(conn, records, tagalongs, batch_size):
+            conn.commit()
+            total += count
+            rate = total / (time.perf_counter() - start)
+            click.echo(f"{total} records ({rate:.0f}/s)", err=True)
+
+        # exports list these after the files, so they're applied last, too
+        service.import_rules(conn, rules, tagalongs)
+
+    click.echo(f"Imported {total} records.")
+    if rules:
+        click.echo(f"Imported {len(rules)} tagalongs and queries.")
+
+
+@click.command(help="Export files, tags, tagalongs and queries as JSONL.")
+@click.argument("output", type=click.File("w", encoding="utf-8"), default="-")
+@click.option(
+    "--since",
+    type=click.IntRange(min=0),
+    default=0,
+    help="Only export files added or changed since this checkpoint "
+    "(deleted files aren't included).",
+)
+@click.pass_obj
+def export(vault: LazyVault, output, since: int):
+    total = 0
+    start = time.perf_counter()
+
+    with vault as conn:
+        # committed right away, so changes made during the export get the new
+        # value and are picked up by the next incremental export
+        checkpoint = crud.change.advance(conn)
+        conn.commit()
+
+        for record in service.iter_export(conn, since):
+            output.write(json.dumps(record) + "\n")
+            total += record["type"] == "file"
+
+    output.write(json.dumps({"type": "checkpoint", "since": checkpoint}) + "\n")
+
+    rate = total / (time.perf_counter() - start)
+    click.echo(
+        f"Exported {total} files ({rate:.0f}/s), checkpoint {checkpoint}.", err=True
+    )
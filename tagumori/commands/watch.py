@@ -0,0 +1,51 @@
+from pathlib import Path
+from typing import Sequence
+
+import click
+
+from tagumori import service
+from tagumori.commands.context import LazyVault
+
+
+@click.command(help="Keep paths of tracked files in sync with moves on disk.")
+@click.argument(
+    "dirs",
+    nargs=-1,
+    required=True,
+    type=click.Path(path_type=Path, exists=True, file_okay=False),
+)
+@click.option("--poll", is_flag=True, help="Poll instead of using inotify.")
+@click.option(
+    "--interval",
+    type=click.FloatRange(min=0, min_open=True),
+    default=2.0,
+    show_default=True,
+    help="Seconds between polls / most seconds to gather events into a batch.",
+)
+@click.pass_obj
+def watch(vault: LazyVault, dirs: Sequence[Path], poll: bool, interval: float):
+    from tagumori.watch import PollingWatcher, watcher
+
+    w = watcher([d.resolve() for d in dirs], poll, interval)
+    kind = "polling" if isinstance(w, PollingWatcher) else "inotify"
+    click.echo(f"Watching {len(dirs)} dir(s) using {kind}.", err=True)
+
+    try:
+        with vault as conn:
+            for changes in w.batches():
+                # one bad event shouldn't stop the watcher
+                errors: list[str] = []
+                moved, refreshed, missing = service.sync_changes(conn, changes, errors)
+                conn.commit()
+
+                for error in errors:
+                    click.echo(f"Skipped move {error}", err=True)
+
+                if moved or refreshed or missing:
+                    click.echo(
+                        f"{moved} moved, {refreshed} refreshed, {missing} missing"
+                    )
+    except KeyboardInterrupt:
+        pass
+    finally:
+        w.close()
@@ -1,5 +1,9 @@
 from tagumori.crud import (
+    change,  # noqa: F401
+    dir_state,  # noqa: F401
+    directory,  # noqa: F401
     file_tag,  # noqa: F401
+    setting,  # noqa: F401
     tagalong,  # noqa: F401
 )
 from tagumori.crud.file import file  # noqa: F401
@@ -1,12 +1,43 @@
-from collections.abc import Sequence
+import json
+from collections.abc import Generator, Iterable
 from sqlite3 import Connection, Row
 from typing import Any
 
+from tagumori.utils import chunked
+
+# SQLITE_MAX_VARIABLE_NUMBER defaults to 999 on SQLite versions before 3.32,
+# so statements binding one parameter per value are split to stay under it.
+MAX_VARIABLES = 999
+
+# values per json_each array; only bounds memory, there's no hard limit
+JSON_CHUNK_SIZE = 10_000
+
 
 def _placeholders(count: int, placeholder: str = "?"):
     return ",".join(placeholder for _ in range(count))
 
 
+def _json_chunks(values: Iterable[Any]) -> Generator[str]:
+    """Encodes values as JSON arrays, each meant to be bound as a single
+    parameter and unpacked with json_each."""
+    for chunk in chunked(values, JSON_CHUNK_SIZE):
+        yield json.dumps(chunk)
+
+
+def _temp_ids(conn: Connection, table: str, ids: Iterable[int]) -> str:
+    """(Re)fills a connection-local temp table with ids and returns its name.
+
+    Lets set-based statements join against an arbitrarily large id set
+    instead of binding one parameter per id.
+    """
+    conn.execute(f"CREATE TEMP TABLE IF NOT EXISTS {table} (id INTEGER PRIMARY KEY)")
+    conn.execute(f"DELETE FROM {table}")
+    conn.executemany(
+        f"INSERT OR IGNORE INTO {table}(id) VALUES (?)", ((id_,) for id_ in ids)
+    )
+    return table
+
+
 class BaseCRUD:
     """A Baseclass with implementations of the most common shared logic."""
 
@@ -17,32 +48,56 @@ class BaseCRUD:
     def get_all(self, conn: Connection) -> list[Row]:
         return conn.execute(f"SELECT * FROM {self.table}").fetchall()
 
+    def iter_all(self, conn: Connection, order_by: str = "id") -> Generator[Row]:
+        """Streams all rows from a cursor instead of fetching them at once."""
+        yield from conn.execute(f"SELECT * FROM {self.table} ORDER BY {order_by}")
+
     def get(self, conn: Connection, id: int) -> Row:
         return conn.execute(
             f"SELECT * FROM {self.table} WHERE id = ?", (id,)
         ).fetchone()
 
-    def get_many(self, conn: Connection, ids: Sequence[int]) -> list[Row]:
-        phs = _placeholders(len(ids))
+    def iter_many(self, conn: Connection, ids: Iterable[int]) -> Generator[Row]:
+        return self._iter_many_by_col(conn, "id", ids)
 
-        return conn.execute(
-            f"SELECT * FROM {self.table} WHERE id IN ({phs})", ids
-        ).fetchall()
+    def get_many(self, conn: Connection, ids: Iterable[int]) -> list[Row]:
+        return list(self.iter_many(conn, ids))
 
-    def get_by_unique_col(self, conn: Connection, value: Any) -> Row:
+    def get_by_unique_col(self, conn: Connection, value: Any) -> Row | None:
         # TODO: should change to a generic type var here instead of Any
 
         return conn.execute(
             f"SELECT * FROM {self.table} WHERE {self.unique_col} = ?", (value,)
         ).fetchone()
 
+    def iter_many_by_unique_col(
+        self, conn: Connection, values: Iterable[Any]
+    ) -> Generator[Row]:
+        return self._iter_many_by_col(conn, self.unique_col, values)
+
     def get_many_by_unique_col(
-        self, conn: Connection, values: Sequence[Any]
+        self, conn: Connection, values: Iterable[Any]
     ) -> list[Row]:
-        phs = _placeholders(len(values))
-        return conn.execute(
-            f"SELECT * FROM {self.table} WHERE {self.unique_col} IN ({phs})", values
-        ).fetchall()
+        return list(self.iter_many_by_unique_col(conn, values))
+
+    def _iter_many_by_col(
+        self, conn: Connection, col: str, values: Iterable[Any]
+    ) -> Generator[Row]:
+        q = f"""
+            SELECT * FROM {self.table}
+            WHERE {col} IN (SELECT value FROM json_each(?))
+        """
+        for chunk in _json_chunks(values):
+            # fetch the whole chunk so callers may run statements in between
+            yield from conn.execute(q, (chunk,)).fetchall()
 
     def delete(self, conn: Connection, id: int) -> None:
         conn.execute(f"DELETE FROM {self.table} WHERE id = ?", (id,))
+
+    def delete_many(self, conn: Connection, ids: Iterable[int]) -> int:
+        """Deletes all given ids with one statement. Returns number deleted."""
+        _temp_ids(conn, "_delete_ids", ids)
+        cursor = conn.execute(
+            f"DELETE FROM {self.table} WHERE id IN (SELECT id FROM _delete_ids)"
+        )
+        return cursor.rowcount
@@ -0,0 +1,15 @@
+from sqlite3 import Connection
+
+
+def current(conn: Connection) -> int:
+    (value,) = conn.execute("SELECT value FROM change_counter").fetchone()
+    return value
+
+
+def advance(conn: Connection) -> int:
+    """Bumps the change counter and returns the new value. Changes made from now
+    on are stamped with it, so it works as a checkpoint for later exports."""
+    (value,) = conn.execute(
+        "UPDATE change_counter SET value = value + 1 RETURNING value"
+    ).fetchone()
+    return value
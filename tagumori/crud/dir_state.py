@@ -0,0 +1,27 @@
+from collections.abc import Iterable
+from sqlite3 import Connection
+
+
+def dir_of(path: str) -> str:
+    """A file's directory, with trailing slash: everything up to the last "/"."""
+    return path[: path.rfind("/") + 1]
+
+
+def get_all(conn: Connection) -> dict[str, int]:
+    """Last seen mtime (ns) of each directory checked."""
+    return dict(conn.execute("SELECT path, mtime_ns FROM dir_state").fetchall())
+
+
+def set_many(conn: Connection, rows: Iterable[tuple[str, int]]) -> None:
+    conn.executemany(
+        """
+        INSERT INTO dir_state (path, mtime_ns) VALUES (?, ?)
+        ON CONFLICT (path) DO UPDATE SET mtime_ns = excluded.mtime_ns
+        """,
+        rows,
+    )
+
+
+def forget(conn: Connection, paths: Iterable[str]) -> None:
+    """Marks directories as unchecked, so their files are stat'ed next time."""
+    conn.executemany("DELETE FROM dir_state WHERE path = ?", ((p,) for p in paths))
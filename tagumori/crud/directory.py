@@ -0,0 +1,218 @@
+"""The directory tree files live in.
+
+A directory is a (parent, name) pair, so its path is stored once however many
+files it holds, and moving it, with everything under it, is a single-row
+update. Paths are "/"-separated and directories are given without a trailing
+slash; the root ("/") is the directory named "" without a parent.
+"""
+
+import json
+from collections.abc import Generator, Iterable
+from sqlite3 import Connection
+
+def split(path: str) -> tuple[str, str]:
+    """(directory, name) of a path."""
+    parent, _, name = path.rpartition("/")
+    return parent, name
+
+
+def paths_cte(ids: str) -> str:
+    """A recursive CTE, `dir_path(id, parent_id, path)`, putting together the
+    paths of the directories selected by `ids` by walking up to their roots.
+    Only rows with parent_id NULL hold a finished path."""
+    return f"""
+        dir_path(id, parent_id, path) AS (
+            SELECT id, parent_id, name FROM directory WHERE id IN ({ids})
+            UNION ALL
+            SELECT dir_path.id, d.parent_id, d.name || '/' || dir_path.path
+            FROM dir_path
+            JOIN directory d ON d.id = dir_path.parent_id
+        )
+    """
+
+
+def tree_cte() -> str:
+    """A recursive CTE, `dir_tree(id, path)`, of every directory with its path,
+    walking down from the roots. Cheaper than paths_cte when most directories
+    are needed."""
+    return """
+        dir_tree(id, path) AS (
+            SELECT id, name FROM directory WHERE parent_id IS NULL
+            UNION ALL
+            SELECT d.id, dir_tree.path || '/' || d.name
+            FROM dir_tree
+            JOIN directory d ON d.parent_id = dir_tree.id
+        )
+    """
+
+
+def subtree_cte(ids: str) -> str:
+    """A recursive CTE, `subtree(id)`, of the directories selected by `ids` and
+    every directory under them."""
+    return f"""
+        subtree(id) AS (
+            SELECT id FROM directory WHERE id IN ({ids})
+            UNION ALL
+            SELECT d.id FROM directory d JOIN subtree ON d.parent_id = subtree.id
+        )
+    """
+
+
+def _child(conn: Connection, parent_id: int | None, name: str) -> int | None:
+    row = conn.execute(
+        "SELECT id FROM directory WHERE parent_id IS ? AND name = ?",
+        (parent_id, name),
+    ).fetchone()
+    return None if row is None else row[0]
+
+
+def get_id(
+    conn: Connection,
+    path: str,
+    create: bool = False,
+    cache: dict[str, int] | None = None,
+) -> int | None:
+    """Id of a directory, walking down from the root one name at a time. With
+    `create`, missing directories are added, otherwise None is returned.
+
+    Pass the same dict when looking up many paths, so shared ancestors are
+    only looked up once. Cached ids go stale once directories are moved or
+    deleted, so only share one across lookups made in a single go."""
+    if cache is not None and path in cache:
+        return cache[path]
+
+    parent_path, sep, name = path.rpartition("/")
+    parent_id = None
+    if sep:
+        parent_id = get_id(conn, parent_path, create, cache)
+        if parent_id is None:
+            return None
+
+    id_ = _child(conn, parent_id, name)
+    if id_ is None and create:
+        id_ = conn.execute(
+            "INSERT INTO directory (parent_id, name) VALUES (?, ?) RETURNING id",
+            (parent_id, name),
+        ).fetchone()[0]
+
+    if cache is not None and id_ is not None:
+        cache[path] = id_
+
+    return id_
+
+
+def get_path(conn: Connection, id_: int) -> str | None:
+    q = f"""
+        WITH RECURSIVE {paths_cte("?")}
+        SELECT path FROM dir_path WHERE parent_id IS NULL
+    """
+    row = conn.execute(q, (id_,)).fetchone()
+    return None if row is None else row[0]
+
+
+def iter_file_dirs(conn: Connection) -> Generator[str]:
+    """Streams the path of each directory holding files."""
+    q = f"""
+        WITH RECURSIVE {paths_cte("SELECT DISTINCT directory_id FROM file")}
+        SELECT path FROM dir_path WHERE parent_id IS NULL
+    """
+    for (path,) in conn.execute(q):
+        yield path
+
+
+def count_files(conn: Connection, id_: int) -> int:
+    """Number of files in and under a directory."""
+    q = f"""
+        WITH RECURSIVE {subtree_cte("?")}
+        SELECT COUNT(*) FROM file WHERE directory_id IN (SELECT id FROM subtree)
+    """
+    return conn.execute(q, (id_,)).fetchone()[0]
+
+
+def iter_file_ids(conn: Connection, id_: int) -> Generator[int]:
+    """Streams the ids of files in and under a directory."""
+    q = f"""
+        WITH RECURSIVE {subtree_cte("?")}
+        SELECT id FROM file WHERE directory_id IN (SELECT id FROM subtree)
+    """
+    for (file_id,) in conn.execute(q, (id_,)):
+        yield file_id
+
+
+def move(conn: Connection, old: str, new: str) -> int:
+    """Moves a directory, and so all files under it, to another path.
+
+    Usually a single-row update. If `new` is already a directory, the two are
+    merged instead: files whose path is already taken stay where they were.
+    Returns number of files moved.
+    """
+    src = get_id(conn, old)
+    if src is None:
+        return 0
+
+    # checked on the paths, before any directory is created for the new one
+    parent_path, name = split(new)
+    if parent_path == old or parent_path.startswith(old + "/"):
+        raise ValueError(f"Can't move {old} under itself")
+
+    parent = get_id(conn, parent_path, create=True)
+
+    old_parent = conn.execute(
+        "SELECT parent_id FROM directory WHERE id = ?", (src,)
+    ).fetchone()[0]
+
+    dst = _child(conn, parent, name)
+    if dst == src:
+        return 0
+
+    if dst is None:
+        moved = count_files(conn, src)
+        conn.execute(
+            "UPDATE directory SET parent_id = ?, name = ? WHERE id = ?",
+            (parent, name, src),
+        )
+    else:
+        moved = _merge(conn, src, dst)
+
+    prune(conn, [old_parent] if old_parent is not None else [])
+    return moved
+
+
+def _merge(conn: Connection, src: int, dst: int) -> int:
+    """Moves the contents of one directory into another, recursively merging
+    subdirectories with the same name. Returns number of files moved."""
+    moved = conn.execute(
+        "UPDATE OR IGNORE file SET directory_id = ? WHERE directory_id = ?",
+        (dst, src),
+    ).rowcount
+
+    children = conn.execute(
+        "SELECT id, name FROM directory WHERE parent_id = ?", (src,)
+    ).fetchall()
+    for id_, name in children:
+        if (existing := _child(conn, dst, name)) is None:
+            moved += count_files(conn, id_)
+            conn.execute("UPDATE directory SET parent_id = ? WHERE id = ?", (dst, id_))
+        else:
+            moved += _merge(conn, id_, existing)
+
+    prune(conn, [src])
+    return moved
+
+
+def prune(conn: Connection, ids: Iterable[int]) -> None:
+    """Deletes those of the directories that hold neither files nor other
+    directories, then their parents if that left them empty, and so on."""
+    ids = list(ids)
+    while ids:
+        rows = conn.execute(
+            """
+            DELETE FROM directory
+            WHERE id IN (SELECT value FROM json_each(?))
+            AND NOT EXISTS (SELECT 1 FROM file WHERE directory_id = directory.id)
+            AND NOT EXISTS (SELECT 1 FROM directory d WHERE d.parent_id = directory.id)
+            RETURNING parent_id
+            """,
+            (json.dumps(ids),),
+        ).fetchall()
+        ids = list({parent_id for (parent_id,) in rows if parent_id is not None})
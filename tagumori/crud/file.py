@@ -1,10 +1,16 @@
+import json
 import sys
+from collections.abc import Generator, Iterable
 from pathlib import Path
 from sqlite3 import Connection, Row
-from typing import Sequence
+from typing import Any
 
-from tagumori.crud.base import BaseCRUD, _placeholders
-from tagumori.utils import flatten
+from tagumori.crud import directory
+from tagumori.crud.base import JSON_CHUNK_SIZE, BaseCRUD, _json_chunks, _temp_ids
+from tagumori.utils import chunked
+
+# rows fetched per page by iter_paged
+PAGE_SIZE = 10_000
 
 
 def _get_inode_and_device(path: Path) -> tuple[int | None, int | None]:
@@ -28,48 +34,365 @@ def _get_inode_and_device(path: Path) -> tuple[int | None, int | None]:
         return None, None
 
 
+def _select(where: str | None = None, order_by: str = "id", ctes: str = "") -> str:
+    """SELECT of file rows matching `where` (all by default), with their full
+    path put together from their directory's. `ctes` are put in front of the
+    ones used here, for `where` to refer to."""
+    if where is None:
+        return f"""
+            WITH RECURSIVE {directory.tree_cte()}
+            SELECT file.*, dir_tree.path || '/' || file.name AS path
+            FROM file
+            JOIN dir_tree ON dir_tree.id = file.directory_id
+            ORDER BY {order_by}
+        """
+
+    return f"""
+        WITH RECURSIVE {ctes}
+        matched AS (SELECT * FROM file WHERE {where}),
+        {directory.paths_cte("SELECT directory_id FROM matched")}
+        SELECT matched.*, dir_path.path || '/' || matched.name AS path
+        FROM matched
+        JOIN dir_path ON dir_path.id = matched.directory_id
+        WHERE dir_path.parent_id IS NULL
+        ORDER BY {order_by}
+    """
+
+
 class FileCRUD(BaseCRUD):
+    """Files are stored as (directory_id, name) (see crud.directory), but come
+    with their full `path`, and are looked up by it, like any other column."""
+
     def __init__(self):
         super().__init__(table="file", unique_col="path")
 
-    def get_by_path(self, conn: Connection, path: Path) -> Row:
+    def get_all(self, conn: Connection) -> list[Row]:
+        return conn.execute(_select()).fetchall()
+
+    def iter_all(self, conn: Connection, order_by: str = "id") -> Generator[Row]:
+        yield from conn.execute(_select(order_by=order_by))
+
+    def get(self, conn: Connection, id: int) -> Row:
+        return conn.execute(_select("id = ?"), (id,)).fetchone()
+
+    def iter_under(
+        self, conn: Connection, dir_id: int, order_by: str = "id"
+    ) -> Generator[Row]:
+        """Streams the files in and under a directory."""
+        q = _select(
+            "directory_id IN (SELECT id FROM subtree)",
+            order_by,
+            ctes=directory.subtree_cte("?") + ",",
+        )
+        yield from conn.execute(q, (dir_id,))
+
+    def get_by_unique_col(self, conn: Connection, value: str) -> Row | None:
+        return next(self._iter_many_by_col(conn, "path", [value]), None)
+
+    def _iter_many_by_col(
+        self, conn: Connection, col: str, values: Iterable[Any]
+    ) -> Generator[Row]:
+        if col != "path":
+            q = _select(f"{col} IN (SELECT value FROM json_each(?))")
+            for chunk in _json_chunks(values):
+                yield from conn.execute(q, (chunk,)).fetchall()
+            return
+
+        for paths in chunked(values, JSON_CHUNK_SIZE):
+            # a cache per chunk, as directories may be moved between them
+            cache: dict[str, int] = {}
+            located = self._locate(conn, dict.fromkeys(paths), cache=cache)
+            yield from self._iter_located(conn, list(located))
+
+    def _iter_located(
+        self, conn: Connection, located: list[tuple[int, str, str]]
+    ) -> Generator[Row]:
+        """Rows of (directory_id, name, path) files; the paths are known
+        already, so there's no need to put them together."""
+        q = """
+            SELECT file.*, json_extract(j.value, '$[2]') AS path
+            FROM json_each(?) j
+            JOIN file
+                ON file.directory_id = json_extract(j.value, '$[0]')
+                AND file.name = json_extract(j.value, '$[1]')
+        """
+        yield from conn.execute(q, (json.dumps(located),)).fetchall()
+
+    def _locate(
+        self,
+        conn: Connection,
+        paths: Iterable[str],
+        create: bool = False,
+        cache: dict[str, int] | None = None,
+    ) -> Generator[tuple[int, str, str]]:
+        """(directory_id, name, path) of each path. Without `create`, paths
+        in directories that aren't in the vault are skipped."""
+        for path in paths:
+            parent, name = directory.split(path)
+            dir_id = directory.get_id(conn, parent, create, cache)
+            if dir_id is not None:
+                yield dir_id, name, path
+
+    def get_by_path(self, conn: Connection, path: Path) -> Row | None:
         # TODO: might want to generalize the type conversion here into BaseCRUD
         return self.get_by_unique_col(conn, str(path.resolve()))
 
-    def get_many_by_path(self, conn: Connection, paths: Sequence[Path]) -> list[Row]:
-        return self.get_many_by_unique_col(conn, [str(p.resolve()) for p in paths])
+    def iter_many_by_path(
+        self, conn: Connection, paths: Iterable[Path]
+    ) -> Generator[Row]:
+        return self.iter_many_by_unique_col(conn, (str(p.resolve()) for p in paths))
+
+    def get_many_by_path(self, conn: Connection, paths: Iterable[Path]) -> list[Row]:
+        return list(self.iter_many_by_path(conn, paths))
 
     def get_by_inode(self, conn: Connection, inode: int) -> list[Row]:
-        return conn.execute("SELECT * FROM file WHERE inode = ?", (inode,)).fetchall()
+        return conn.execute(_select("inode = ?"), (inode,)).fetchall()
 
     def get_or_create(self, conn: Connection, path: Path) -> Row:
-        q = """
-                INSERT INTO file (path, inode, device) VALUES (?,?,?)
-                ON CONFLICT(path) DO UPDATE SET path=path --no-op update
-                RETURNING *
-            """
+        return next(self.iter_or_create_many(conn, [path]))
 
-        inode, device = _get_inode_and_device(path)
-        return conn.execute(q, (str(path.resolve()), inode, device)).fetchone()
+    def iter_or_create_many(
+        self, conn: Connection, paths: Iterable[Path], resolve: bool = True
+    ) -> Generator[Row]:
+        """Inserts paths in chunks that fit the variable limit, yielding ids
+        as it goes, so inputs are never held in memory as a whole.
 
-    def get_or_create_many(self, conn: Connection, paths: list[Path]) -> list[Row]:
-        vals = _placeholders(len(paths), "(?,?,?)")
-        q = f"""
-                INSERT INTO file (path, inode, device) VALUES {vals}
-                ON CONFLICT(path) DO UPDATE SET path=path --no-op update
-                RETURNING id
-            """
-        params = [(str(p.resolve()), *_get_inode_and_device(p)) for p in paths]
+        Pass `resolve=False` for paths that have already been resolved.
+        """
+        for chunk in chunked(paths, JSON_CHUNK_SIZE):
+            if resolve:
+                chunk = [p.resolve() for p in chunk]
 
-        return conn.execute(q, tuple(flatten(params))).fetchall()
+            # a cache per chunk, as directories may be moved between them
+            cache: dict[str, int] = {}
+            strs = map(str, chunk)
+            located = list(self._locate(conn, strs, create=True, cache=cache))
+            rows = [
+                (dir_id, name, *_get_inode_and_device(p))
+                for (dir_id, name, _), p in zip(located, chunk)
+            ]
+            conn.execute(
+                """
+                INSERT INTO file (directory_id, name, inode, device)
+                SELECT
+                    json_extract(value, '$[0]'),
+                    json_extract(value, '$[1]'),
+                    json_extract(value, '$[2]'),
+                    json_extract(value, '$[3]')
+                FROM json_each(?) WHERE TRUE
+                ON CONFLICT (directory_id, name) DO NOTHING
+                """,
+                (json.dumps(rows),),
+            )
+            yield from self._iter_located(conn, located)
+
+    def get_or_create_many(self, conn: Connection, paths: Iterable[Path]) -> list[Row]:
+        return list(self.iter_or_create_many(conn, paths))
 
     def update(
         self, conn: Connection, file_id: int, path: Path, inode: int, device: int
     ):
-        conn.execute(
-            "UPDATE file SET path = ?, inode = ?, device = ? WHERE id = ?",
-            (str(path.resolve()), inode, device, file_id),
+        self.update_many(conn, [(file_id, path, inode, device)])
+
+    def update_many(
+        self, conn: Connection, rows: Iterable[tuple[int, Path, int, int]]
+    ) -> None:
+        """Updates (id, path, inode, device) rows in one executemany."""
+        rows = list(rows)
+        old_dirs = self._dirs_of(conn, (id_ for id_, *_ in rows))
+
+        cache: dict[str, int] = {}
+        paths = (str(p.resolve()) for _, p, _, _ in rows)
+        located = self._locate(conn, paths, create=True, cache=cache)
+        conn.executemany(
+            """
+            UPDATE file SET directory_id = ?, name = ?, inode = ?, device = ?
+            WHERE id = ?
+            """,
+            (
+                (dir_id, name, ino, dev, id_)
+                for (dir_id, name, _), (id_, _, ino, dev) in zip(located, rows)
+            ),
+        )
+        directory.prune(conn, old_dirs)
+
+    def _move_many(self, conn: Connection, rows: Iterable[tuple[int, str]]) -> int:
+        """Moves (id, path) files to (resolved) paths, except where the path is
+        already taken. Returns number moved."""
+        rows = list(rows)
+        old_dirs = self._dirs_of(conn, (id_ for id_, _ in rows))
+
+        cache: dict[str, int] = {}
+        located = self._locate(conn, (p for _, p in rows), create=True, cache=cache)
+        moved = conn.executemany(
+            "UPDATE OR IGNORE file SET directory_id = ?, name = ? WHERE id = ?",
+            ((dir_id, name, id_) for (dir_id, name, _), (id_, _) in zip(located, rows)),
+        ).rowcount
+
+        directory.prune(conn, old_dirs)
+        return moved
+
+    def _dirs_of(self, conn: Connection, ids: Iterable[int]) -> list[int]:
+        _temp_ids(conn, "_file_dirs", ids)
+        q = """
+            SELECT DISTINCT directory_id FROM file
+            WHERE id IN (SELECT id FROM _file_dirs)
+        """
+        return [dir_id for (dir_id,) in conn.execute(q)]
+
+    def delete(self, conn: Connection, id: int) -> None:
+        self.delete_many(conn, [id])
+
+    def delete_many(self, conn: Connection, ids: Iterable[int]) -> int:
+        """Deletes all given ids with one statement, along with directories
+        left empty. Returns number deleted."""
+        _temp_ids(conn, "_delete_ids", ids)
+        rows = conn.execute("""
+            DELETE FROM file WHERE id IN (SELECT id FROM _delete_ids)
+            RETURNING directory_id
+        """).fetchall()
+        directory.prune(conn, {dir_id for (dir_id,) in rows})
+        return len(rows)
+
+    def update_stats(
+        self, conn: Connection, rows: Iterable[tuple[int, int, int, int]]
+    ) -> None:
+        """Stores last seen (id, size, mtime_ns, ctime_ns) rows."""
+        conn.executemany(
+            "UPDATE file SET size = ?, mtime_ns = ?, ctime_ns = ? WHERE id = ?",
+            ((size, mtime, ctime, id_) for id_, size, mtime, ctime in rows),
+        )
+
+    def update_inodes(
+        self, conn: Connection, rows: Iterable[tuple[int, int, int]]
+    ) -> None:
+        """Stores (id, inode, device) rows, leaving paths as they are."""
+        conn.executemany(
+            "UPDATE file SET inode = ?, device = ? WHERE id = ?",
+            ((ino, dev, id_) for id_, ino, dev in rows),
         )
 
+    def iter_dirs(self, conn: Connection) -> Generator[str]:
+        """Streams each directory holding tracked files, with trailing slash."""
+        for path in directory.iter_file_dirs(conn):
+            yield path + "/"
+
+    def iter_paged(self, conn: Connection, unchecked: bool = False) -> Generator[Row]:
+        """Streams files a page at a time by id; with `unchecked`, only those
+        without an inode or in directories not in dir_state. No cursor is left
+        open between pages, so the rows can be updated along the way without
+        being skipped or visited twice."""
+        where = "1"
+        if unchecked:
+            checked = f"""
+                WITH RECURSIVE {directory.paths_cte("SELECT id FROM directory")}
+                SELECT id FROM dir_path
+                WHERE parent_id IS NULL AND path || '/' IN (SELECT path FROM dir_state)
+            """
+            where = f"inode IS NULL OR directory_id NOT IN ({checked})"
+
+        page = f"""page AS (
+            SELECT id FROM file WHERE id > ? AND ({where}) ORDER BY id LIMIT ?
+        ),"""
+        q = _select("id IN (SELECT id FROM page)", ctes=page)
+        last = 0
+        while rows := conn.execute(q, (last, PAGE_SIZE)).fetchall():
+            yield from rows
+            last = rows[-1]["id"]
+
+    def move_prefix(self, conn: Connection, old_dir: str, new_dir: str) -> int:
+        """Moves every file under `old_dir` to `new_dir`, by moving the
+        directory itself (see crud.directory.move). Returns number of files
+        moved."""
+        return directory.move(conn, old_dir, new_dir)
+
+    def sync_seen(
+        self, conn: Connection, rows: Iterable[tuple[str, int, int]]
+    ) -> tuple[int, int]:
+        """Matches (path, device, inode) rows of files found on disk against
+        the vault: files found under another path are moved there, and files
+        replaced at their path get the new inode/device. Set-based, through a
+        temp table that count_missing uses too. Returns (moved, refreshed).
+        """
+        conn.execute("""
+            CREATE TEMP TABLE IF NOT EXISTS _seen (
+                path TEXT PRIMARY KEY,
+                directory_id INTEGER,
+                name TEXT,
+                device INTEGER,
+                inode INTEGER
+            )
+        """)
+        conn.execute("DELETE FROM _seen")
+
+        cache: dict[str, int] = {}
+
+        def located():
+            for path, device, inode in rows:
+                parent, name = directory.split(path)
+                dir_id = directory.get_id(conn, parent, cache=cache)
+                yield path, dir_id, name, device, inode
+
+        conn.executemany(
+            "INSERT OR REPLACE INTO _seen VALUES (?, ?, ?, ?, ?)", located()
+        )
+
+        # directories of files moved elsewhere may not be in the vault yet
+        moves = conn.execute("""
+            SELECT file.id, s.path
+            FROM _seen s
+            JOIN file ON file.inode = s.inode AND file.device = s.device
+            WHERE s.directory_id IS NOT file.directory_id OR s.name != file.name
+        """).fetchall()
+
+        moved = self._move_many(conn, moves)
+
+        refreshed = conn.execute("""
+            UPDATE file SET inode = s.inode, device = s.device
+            FROM _seen s
+            WHERE file.directory_id = s.directory_id
+            AND file.name = s.name
+            AND (file.inode IS NOT s.inode OR file.device IS NOT s.device)
+            AND NOT EXISTS (
+                SELECT 1 FROM file f WHERE f.inode = s.inode AND f.device = s.device
+            )
+        """).rowcount
+
+        return moved, refreshed
+
+    def count_missing(self, conn: Connection, dir_: str, recursive: bool) -> int:
+        """Files in (or with `recursive`, under) a directory that weren't in
+        the last sync_seen."""
+        dir_id = directory.get_id(conn, dir_)
+        if dir_id is None:
+            return 0
+
+        dirs = "SELECT id FROM subtree" if recursive else "?"
+        q = f"""
+            WITH RECURSIVE {directory.subtree_cte("?")}
+            SELECT COUNT(*) FROM ({_select(f"directory_id IN ({dirs})")})
+            WHERE path NOT IN (SELECT path FROM _seen)
+        """
+        params = (dir_id,) if recursive else (dir_id, dir_id)
+        return conn.execute(q, params).fetchone()[0]
+
+    def update_fingerprints(
+        self,
+        conn: Connection,
+        rows: Iterable[tuple[int, int, int, int, str | None, str | None]],
+    ) -> None:
+        """Stores (id, size, mtime_ns, ctime_ns, partial_hash, hash) rows."""
+        conn.executemany(
+            """
+            UPDATE file
+            SET size = ?, mtime_ns = ?, ctime_ns = ?, partial_hash = ?, hash = ?
+            WHERE id = ?
+            """,
+            ((*fp, id_) for id_, *fp in rows),
+        )
+
+    def iter_unhashed(self, conn: Connection) -> Generator[Row]:
+        yield from conn.execute(_select("hash IS NULL"))
+
 
 file = FileCRUD()
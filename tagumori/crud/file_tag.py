@@ -1,5 +1,15 @@
+from collections.abc import Generator, Iterable, Sequence
 from sqlite3 import Connection, Row
 
+from tagumori.crud import directory
+from tagumori.crud.base import _temp_ids
+
+# (node, parent_node, depth, tag_id); roots have parent_node 0
+TreeNode = tuple[int, int, int, int | None]
+
+# (file_id, node, parent_node, depth, tag_id); node is unique across all files
+ForestNode = tuple[int, int, int, int, int]
+
 
 def resolve_path(conn: Connection, file_id: int, path: tuple[str, ...]) -> int:
     """Finds the lowest node of a path and returns file_tag.id if said path exists for file."""
@@ -31,37 +41,208 @@ def resolve_path(conn: Connection, file_id: int, path: tuple[str, ...]) -> int:
     return parent_id
 
 
-def get_by_file_ids(conn: Connection, file_ids: list[int]) -> list[Row]:
-    if not file_ids:
-        return []
+def iter_by_file_ids(conn: Connection, file_ids: Iterable[int]) -> Generator[Row]:
+    """Streams file_tags of the given files, ordered by file_id.
 
-    placeholders = ",".join("?" for _ in file_ids)
-    q = f"""
+    Ids go through a temp table, so there's no limit on how many are given.
+    """
+    _temp_ids(conn, "_file_tag_file", file_ids)
+
+    q = """
         SELECT
             file_tag.file_id,
             file_tag.id,
             tag.name,
             file_tag.parent_id
-        FROM file_tag
+        FROM _file_tag_file f
+        JOIN file_tag
+            on file_tag.file_id = f.id
         JOIN tag
             on tag.id = file_tag.tag_id
-        WHERE file_tag.file_id IN ({placeholders})
         ORDER BY file_id, parent_id, name
     """
-    return conn.execute(q, file_ids).fetchall()
+    yield from conn.execute(q)
+
+
+def get_by_file_ids(conn: Connection, file_ids: Iterable[int]) -> list[Row]:
+    return list(iter_by_file_ids(conn, file_ids))
+
+
+def iter_with_files(conn: Connection, since: int = 0) -> Generator[Row]:
+    """Streams every file changed at or after `since`, with its file_tags, over a
+    single cursor ordered by file id. Untagged files come as one row with
+    NULL file_tag columns. Files under a directory moved since count as
+    changed too."""
+    q = f"""
+        WITH RECURSIVE
+        {directory.subtree_cte("SELECT id FROM directory WHERE changed >= :since")},
+        changed_file AS (
+            SELECT * FROM file
+            WHERE changed >= :since OR directory_id IN (SELECT id FROM subtree)
+        ),
+        {directory.paths_cte("SELECT directory_id FROM changed_file")}
+        SELECT
+            file.id file_id,
+            dir_path.path || '/' || file.name path,
+            file.inode,
+            file.device,
+            file_tag.id,
+            tag.name,
+            file_tag.parent_id
+        FROM changed_file file
+        JOIN dir_path
+            on dir_path.id = file.directory_id AND dir_path.parent_id IS NULL
+        LEFT JOIN file_tag
+            on file_tag.file_id = file.id
+        LEFT JOIN tag
+            on tag.id = file_tag.tag_id
+        ORDER BY file.id
+    """
+    yield from conn.execute(q, {"since": since})
 
 
 def replace(conn: Connection, old_id: int, new_id: int) -> None:
     conn.execute("UPDATE file_tag SET tag_id = ? where tag_id = ?", (new_id, old_id))
 
 
+def merge(conn: Connection, source_ids: Iterable[int], target_id: int) -> int:
+    """Replaces all source tags with the target tag, merging nodes that end up
+    as siblings with the same tag (and recursively, their children).
+
+    The affected files' trees are walked level by level into `_merge_node`.
+    Nodes are grouped by (file, merged parent, tag after replacing) and one
+    node per group survives: preferably one already under the merged parent,
+    so it needn't move, then one already tagged with the target. Survivors are
+    re-pointed to merged parents, the rest deleted and sources retagged, each
+    in one statement. No step can hit the partial unique indexes, as
+    survivors are unique per group. Returns number of nodes merged away.
+    """
+    _temp_ids(conn, "_merge_source", (i for i in source_ids if i != target_id))
+
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS _merge_file (id INTEGER PRIMARY KEY)")
+    conn.execute("DELETE FROM _merge_file")
+    conn.execute("""
+        INSERT INTO _merge_file (id)
+        SELECT DISTINCT file_id FROM file_tag
+        WHERE tag_id IN (SELECT id FROM _merge_source)
+    """)
+
+    conn.execute("""
+        CREATE TEMP TABLE IF NOT EXISTS _merge_node (
+            id INTEGER PRIMARY KEY,
+            file_id INTEGER NOT NULL,
+            parent_id INTEGER,
+            merged_parent_id INTEGER,
+            tag_id INTEGER NOT NULL,
+            is_target BOOLEAN NOT NULL,
+            depth INTEGER NOT NULL,
+            survivor_id INTEGER
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS _merge_node_depth ON _merge_node(depth)")
+    conn.execute("DELETE FROM _merge_node")
+
+    # tag after replacing sources with the target
+    merged_tag = """
+        CASE WHEN ft.tag_id IN (SELECT id FROM _merge_source)
+        THEN :target ELSE ft.tag_id END
+    """
+
+    conn.execute(
+        f"""
+        INSERT INTO _merge_node
+            (id, file_id, parent_id, merged_parent_id, tag_id, is_target, depth)
+        SELECT ft.id, ft.file_id, NULL, NULL, {merged_tag}, ft.tag_id = :target, 1
+        FROM _merge_file f
+        JOIN file_tag ft ON ft.file_id = f.id AND ft.parent_id IS NULL
+        """,
+        {"target": target_id},
+    )
+
+    depth = 1
+    while True:
+        conn.execute(
+            """
+            WITH ranked AS (
+                SELECT
+                    id,
+                    FIRST_VALUE(id) OVER (
+                        PARTITION BY file_id, merged_parent_id, tag_id
+                        ORDER BY
+                            parent_id IS NOT merged_parent_id,
+                            NOT is_target,
+                            id
+                    ) survivor_id
+                FROM _merge_node
+                WHERE depth = ?
+            )
+            UPDATE _merge_node SET survivor_id = ranked.survivor_id
+            FROM ranked WHERE _merge_node.id = ranked.id
+            """,
+            (depth,),
+        )
+
+        cursor = conn.execute(
+            f"""
+            INSERT INTO _merge_node
+                (id, file_id, parent_id, merged_parent_id, tag_id, is_target, depth)
+            SELECT
+                ft.id,
+                ft.file_id,
+                ft.parent_id,
+                p.survivor_id,
+                {merged_tag},
+                ft.tag_id = :target,
+                :depth
+            FROM _merge_node p
+            JOIN file_tag ft ON ft.parent_id = p.id
+            WHERE p.depth = :depth - 1
+            """,
+            {"target": target_id, "depth": depth + 1},
+        )
+
+        if not cursor.rowcount:
+            break
+
+        depth += 1
+
+    conn.execute("""
+        UPDATE file_tag SET parent_id = n.merged_parent_id
+        FROM _merge_node n
+        WHERE file_tag.id = n.id
+        AND n.survivor_id = n.id
+        AND n.parent_id IS NOT n.merged_parent_id
+    """)
+
+    # counted up front, nested nodes are deleted by cascades
+    (merged,) = conn.execute(
+        "SELECT COUNT(*) FROM _merge_node WHERE survivor_id != id"
+    ).fetchone()
+
+    conn.execute("""
+        DELETE FROM file_tag
+        WHERE id IN (SELECT id FROM _merge_node WHERE survivor_id != id)
+    """)
+
+    for col in ("tag_id", "implied_by"):
+        conn.execute(
+            f"""
+            UPDATE file_tag SET {col} = ?
+            WHERE {col} IN (SELECT id FROM _merge_source)
+            """,
+            (target_id,),
+        )
+
+    return merged
+
+
 def attach(
     conn: Connection, file_id: int, tag_id: int, parent_id: int | None = None
 ) -> int:
     (file_tag_id,) = conn.execute(
         """
             INSERT INTO file_tag(file_id, tag_id, parent_id) VALUES (?,?,?)
-            ON CONFLICT DO UPDATE SET file_id = file_id
+            ON CONFLICT DO UPDATE SET implied_by = NULL
             RETURNING id
         """,
         (file_id, tag_id, parent_id),
@@ -70,9 +251,290 @@ def attach(
     return file_tag_id
 
 
+def _load_tree(conn: Connection, tree: Iterable[TreeNode]) -> None:
+    conn.execute("""
+        CREATE TEMP TABLE IF NOT EXISTS _tag_tree (
+            node INTEGER PRIMARY KEY,
+            parent_node INTEGER NOT NULL,
+            depth INTEGER NOT NULL,
+            tag_id INTEGER
+        )
+    """)
+    conn.execute("DELETE FROM _tag_tree")
+    conn.executemany("INSERT INTO _tag_tree VALUES (?,?,?,?)", tree)
+
+
+def attach_many(
+    conn: Connection, file_ids: Iterable[int], tree: Sequence[TreeNode]
+) -> None:
+    """Attaches the same tag tree to all given files.
+
+    Each level of the tree is inserted for all files with one INSERT ... SELECT,
+    and the resulting file_tag ids are collected into `_attach_node` to serve as
+    parents for the next level. Statement count depends only on tree depth.
+
+    Nodes that already exist as implied tags become direct ones.
+    """
+    if not tree:
+        return
+
+    _load_tree(conn, tree)
+    _temp_ids(conn, "_attach_file", file_ids)
+
+    conn.execute("""
+        CREATE TEMP TABLE IF NOT EXISTS _attach_node (
+            node INTEGER,
+            file_id INTEGER,
+            file_tag_id INTEGER,
+            PRIMARY KEY (node, file_id)
+        )
+    """)
+    conn.execute("DELETE FROM _attach_node")
+
+    # node 0 is a virtual parent for roots
+    conn.execute("INSERT INTO _attach_node SELECT 0, id, NULL FROM _attach_file")
+
+    max_depth = max(depth for _, _, depth, _ in tree)
+
+    for depth in range(1, max_depth + 1):
+        conn.execute(
+            """
+            INSERT INTO file_tag (file_id, tag_id, parent_id)
+            SELECT parent.file_id, t.tag_id, parent.file_tag_id
+            FROM _tag_tree t
+            JOIN _attach_node parent ON parent.node = t.parent_node
+            WHERE t.depth = ?
+            ON CONFLICT DO UPDATE SET implied_by = NULL WHERE implied_by IS NOT NULL
+            """,
+            (depth,),
+        )
+
+        if depth == max_depth:
+            break
+
+        # split on depth so that the matching partial unique index gets used
+        parent_clause = (
+            "ft.parent_id IS NULL"
+            if depth == 1
+            else "ft.parent_id = parent.file_tag_id"
+        )
+
+        conn.execute(
+            f"""
+            INSERT INTO _attach_node (node, file_id, file_tag_id)
+            SELECT t.node, parent.file_id, ft.id
+            FROM _tag_tree t
+            JOIN _attach_node parent ON parent.node = t.parent_node
+            JOIN file_tag ft
+                ON ft.file_id = parent.file_id
+                AND ft.tag_id = t.tag_id
+                AND {parent_clause}
+            WHERE t.depth = ?
+            AND EXISTS (SELECT 1 FROM _tag_tree c WHERE c.parent_node = t.node)
+            """,
+            (depth,),
+        )
+
+
+def attach_forest(conn: Connection, forest: Iterable[ForestNode]) -> None:
+    """Attaches a different tag tree to each file.
+
+    Same level-by-level approach as attach_many, except that every node
+    belongs to a single file, so no cross join between files and tree.
+    """
+    conn.execute("""
+        CREATE TEMP TABLE IF NOT EXISTS _forest (
+            node INTEGER PRIMARY KEY,
+            file_id INTEGER NOT NULL,
+            parent_node INTEGER NOT NULL,
+            depth INTEGER NOT NULL,
+            tag_id INTEGER NOT NULL
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS _forest_depth ON _forest(depth)")
+    conn.execute("CREATE INDEX IF NOT EXISTS _forest_parent ON _forest(parent_node)")
+    conn.execute("""
+        CREATE TEMP TABLE IF NOT EXISTS _forest_id (
+            node INTEGER PRIMARY KEY,
+            file_tag_id INTEGER NOT NULL
+        )
+    """)
+    conn.execute("DELETE FROM _forest")
+    conn.execute("DELETE FROM _forest_id")
+    conn.executemany(
+        """
+        INSERT INTO _forest (file_id, node, parent_node, depth, tag_id)
+        VALUES (?,?,?,?,?)
+        """,
+        forest,
+    )
+
+    (max_depth,) = conn.execute("SELECT MAX(depth) FROM _forest").fetchone()
+
+    for depth in range(1, (max_depth or 0) + 1):
+        conn.execute(
+            """
+            INSERT INTO file_tag (file_id, tag_id, parent_id)
+            SELECT n.file_id, n.tag_id, parent.file_tag_id
+            FROM _forest n
+            LEFT JOIN _forest_id parent ON parent.node = n.parent_node
+            WHERE n.depth = ?
+            ON CONFLICT DO UPDATE SET implied_by = NULL WHERE implied_by IS NOT NULL
+            """,
+            (depth,),
+        )
+
+        if depth == max_depth:
+            break
+
+        # split on depth so that the matching partial unique index gets used
+        if depth == 1:
+            parent_join = "AND ft.parent_id IS NULL"
+        else:
+            parent_join = """
+                JOIN _forest_id parent ON parent.node = n.parent_node
+                AND ft.parent_id = parent.file_tag_id
+            """
+
+        conn.execute(
+            f"""
+            INSERT INTO _forest_id (node, file_tag_id)
+            SELECT n.node, ft.id
+            FROM _forest n
+            JOIN file_tag ft
+                ON ft.file_id = n.file_id
+                AND ft.tag_id = n.tag_id
+                {parent_join}
+            WHERE n.depth = ?
+            AND EXISTS (SELECT 1 FROM _forest c WHERE c.parent_node = n.node)
+            """,
+            (depth,),
+        )
+
+
+def _match_tree_sql(file_table: str) -> str:
+    """Recursive CTE `match(file_id, id, node)` pairing the file_tags of files in
+    `file_table` with the `_tag_tree` nodes whose path (from root) they match."""
+    return f"""
+        WITH RECURSIVE match(file_id, id, node) AS (
+            SELECT ft.file_id, ft.id, t.node
+            FROM _tag_tree t
+            JOIN file_tag ft
+                ON ft.tag_id = t.tag_id
+                AND ft.parent_id IS NULL
+            JOIN {file_table} f ON f.id = ft.file_id
+            WHERE t.parent_node = 0
+
+            UNION ALL
+
+            SELECT ft.file_id, ft.id, t.node
+            FROM match m
+            JOIN _tag_tree t ON t.parent_node = m.node
+            JOIN file_tag ft
+                ON ft.file_id = m.file_id
+                AND ft.tag_id = t.tag_id
+                AND ft.parent_id = m.id
+        )
+    """
+
+
+def detach_many(
+    conn: Connection, file_ids: Iterable[int], tree: Sequence[TreeNode]
+) -> int:
+    """Detaches the leaves of a tag tree from all given files in one statement.
+
+    A recursive CTE walks the tree and the files' tags side by side, so only
+    nodes whose whole path matches get deleted (with their children). Returns
+    the number of matched nodes removed.
+    """
+    if not tree:
+        return 0
+
+    _load_tree(conn, tree)
+    _temp_ids(conn, "_detach_file", file_ids)
+
+    # CTE is kept in the subquery, sqlite3 reports no rowcount for a leading WITH
+    cursor = conn.execute(f"""
+        DELETE FROM file_tag WHERE id IN (
+            {_match_tree_sql("_detach_file")}
+            SELECT m.id FROM match m
+            WHERE NOT EXISTS (SELECT 1 FROM _tag_tree c WHERE c.parent_node = m.node)
+        )
+    """)
+
+    return cursor.rowcount
+
+
+def prune_to_tree(
+    conn: Connection, file_ids: Iterable[int], tree: Sequence[TreeNode]
+) -> int:
+    """Deletes every file_tag of the given files that isn't part of the tag tree.
+
+    Matching nodes are collected into `_keep` once, then only the topmost
+    unmatched nodes are deleted; cascades take care of the rest. Together with
+    attach_many, this applies just the difference between current and desired
+    trees. Returns the number of topmost nodes deleted.
+    """
+    _load_tree(conn, tree)
+    _temp_ids(conn, "_prune_file", file_ids)
+
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS _keep (id INTEGER PRIMARY KEY)")
+    conn.execute("DELETE FROM _keep")
+    conn.execute(f"""
+        INSERT INTO _keep (id)
+        {_match_tree_sql("_prune_file")}
+        SELECT id FROM match
+    """)
+
+    cursor = conn.execute("""
+        DELETE FROM file_tag
+        WHERE file_id IN (SELECT id FROM _prune_file)
+        AND id NOT IN (SELECT id FROM _keep)
+        AND (parent_id IS NULL OR parent_id IN (SELECT id FROM _keep))
+    """)
+
+    return cursor.rowcount
+
+
 def detach(conn: Connection, file_tag_id: int) -> None:
     conn.execute("DELETE FROM file_tag WHERE id = ?", (file_tag_id,))
 
 
 def drop_for_file(conn: Connection, file_id: int) -> None:
     conn.execute("DELETE FROM file_tag WHERE file_id = ?", (file_id,))
+
+
+def drop_for_files(conn: Connection, file_ids: Iterable[int]) -> int:
+    """Deletes all file_tags of the given files: roots are deleted directly and
+    children go with them via parent_id cascades. Returns number of roots."""
+    _temp_ids(conn, "_drop_file", file_ids)
+    cursor = conn.execute("""
+        DELETE FROM file_tag
+        WHERE file_id IN (SELECT id FROM _drop_file)
+        AND parent_id IS NULL
+    """)
+    return cursor.rowcount
+
+
+def detach_tags(conn: Connection, tag_ids: Iterable[int], limit: int) -> int:
+    """Deletes at most `limit` file_tags using or implied by any of the given
+    tags, along with their subtrees. Call repeatedly until it returns 0 to keep
+    each transaction short, instead of leaving implied ones to the cascade of
+    one big tag delete. Returns number of matching file_tags deleted.
+    """
+    _temp_ids(conn, "_detach_tag", tag_ids)
+    # separate selects, so both the tag_id and implied_by indexes are used
+    cursor = conn.execute(
+        """
+        DELETE FROM file_tag WHERE id IN (
+            SELECT id FROM file_tag
+            WHERE tag_id IN (SELECT id FROM _detach_tag)
+            UNION ALL
+            SELECT id FROM file_tag
+            WHERE implied_by IN (SELECT id FROM _detach_tag)
+            LIMIT ?
+        )
+        """,
+        (limit,),
+    )
+    return cursor.rowcount
@@ -4,7 +4,7 @@ from tagumori.crud.base import BaseCRUD
 
 
 class QueryCRUD(BaseCRUD):
-    def get_by_name(self, conn: Connection, name: str) -> Row:
+    def get_by_name(self, conn: Connection, name: str) -> Row | None:
         return self.get_by_unique_col(conn, name)
 
     def create(
@@ -17,6 +17,7 @@ class QueryCRUD(BaseCRUD):
         pattern: str,
         ignore_case: bool,
         invert_match: bool,
+        under: str | None = None,
     ) -> Row:
         return conn.execute(
             """
@@ -27,10 +28,20 @@ class QueryCRUD(BaseCRUD):
                 ignore_tag_case,
                 pattern,
                 ignore_case,
-                invert_match
-            ) VALUES (?, ?, ?, ?, ?, ?, ?) RETURNING *
+                invert_match,
+                under
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?) RETURNING *
             """,
-            (name, select_tags, exclude_tags, ignore_tag_case, pattern, ignore_case, invert_match),
+            (
+                name,
+                select_tags,
+                exclude_tags,
+                ignore_tag_case,
+                pattern,
+                ignore_case,
+                invert_match,
+                under,
+            ),
         ).fetchone()
 
     def upsert(
@@ -43,6 +54,7 @@ class QueryCRUD(BaseCRUD):
         pattern: str,
         ignore_case: bool,
         invert_match: bool,
+        under: str | None = None,
     ) -> Row:
         return conn.execute(
             """
@@ -53,8 +65,9 @@ class QueryCRUD(BaseCRUD):
                 ignore_tag_case,
                 pattern,
                 ignore_case,
-                invert_match
-            ) VALUES (?, ?, ?, ?, ?, ?, ?)
+                invert_match,
+                under
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
             ON CONFLICT (name) DO UPDATE
               SET
                 name=excluded.name,
@@ -63,10 +76,20 @@ class QueryCRUD(BaseCRUD):
                 ignore_tag_case=excluded.ignore_tag_case,
                 pattern=excluded.pattern,
                 ignore_case=excluded.ignore_case,
-                invert_match=excluded.invert_match
+                invert_match=excluded.invert_match,
+                under=excluded.under
             RETURNING *
             """,
-            (name, select_tags, exclude_tags, ignore_tag_case, pattern, ignore_case, invert_match),
+            (
+                name,
+                select_tags,
+                exclude_tags,
+                ignore_tag_case,
+                pattern,
+                ignore_case,
+                invert_match,
+                under,
+            ),
         ).fetchone()
 
 
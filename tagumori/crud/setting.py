@@ -0,0 +1,16 @@
+from sqlite3 import Connection
+
+
+def get(conn: Connection, key: str, default: str | None = None) -> str | None:
+    row = conn.execute("SELECT value FROM setting WHERE key = ?", (key,)).fetchone()
+    return default if row is None else row["value"]
+
+
+def set(conn: Connection, key: str, value: str) -> None:
+    conn.execute(
+        """
+        INSERT INTO setting (key, value) VALUES (?, ?)
+        ON CONFLICT (key) DO UPDATE SET value = excluded.value
+        """,
+        (key, value),
+    )
@@ -1,17 +1,18 @@
-from collections.abc import Sequence
+from collections.abc import Iterable
 from sqlite3 import Connection, Row
 
-from tagumori.crud.base import BaseCRUD, _placeholders
+from tagumori.crud.base import MAX_VARIABLES, BaseCRUD, _placeholders
+from tagumori.utils import chunked
 
 
 class TagCRUD(BaseCRUD):
     def __init__(self):
         super().__init__(table="tag", unique_col="name")
 
-    def get_by_name(self, conn: Connection, name: str) -> Row:
+    def get_by_name(self, conn: Connection, name: str) -> Row | None:
         return self.get_by_unique_col(conn, name)
 
-    def get_many_by_name(self, conn: Connection, names: Sequence[str]) -> list[Row]:
+    def get_many_by_name(self, conn: Connection, names: Iterable[str]) -> list[Row]:
         return self.get_many_by_unique_col(conn, names)
 
     def create(self, conn: Connection, name: str, category: str | None = None) -> Row:
@@ -28,16 +29,21 @@ class TagCRUD(BaseCRUD):
         """
         return conn.execute(q, (name,)).fetchone()
 
-    def get_or_create_many(self, conn: Connection, names: list[str]) -> list[Row]:
-        vals = _placeholders(len(names), "(?)")
+    def get_or_create_many(self, conn: Connection, names: Iterable[str]) -> list[Row]:
+        rows = []
 
-        q = f"""
-            INSERT INTO tag(name) VALUES {vals}
-            ON CONFLICT (name) DO UPDATE SET name=name --no-op
-            RETURNING id
-        """
+        for chunk in chunked(names, MAX_VARIABLES):
+            vals = _placeholders(len(chunk), "(?)")
+
+            q = f"""
+                INSERT INTO tag(name) VALUES {vals}
+                ON CONFLICT (name) DO UPDATE SET name=name --no-op
+                RETURNING *
+            """
+
+            rows.extend(conn.execute(q, chunk).fetchall())
 
-        return conn.execute(q, names).fetchall()
+        return rows
 
     def update(self, conn: Connection, names: list[str], data: dict) -> None:
         ALLOWED_COLS = {"name", "category"}
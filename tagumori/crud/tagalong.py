@@ -1,20 +1,160 @@
 from sqlite3 import Connection, Row
 from typing import Iterable
 
+from tagumori.crud import setting
+from tagumori.crud.base import _temp_ids
+
+# every (tag, implied tag) pair reachable in the tagalong graph; UNION keeps
+# cycles from recursing forever
+CLOSURE_SQL = """
+    WITH RECURSIVE implied(tag_id, tagalong_id) AS (
+        SELECT tag_id, tagalong_id
+        FROM tagalong
+        {where}
+
+        UNION
+
+        SELECT implied.tag_id, t.tagalong_id
+        FROM tagalong t
+        JOIN implied ON t.tag_id = implied.tagalong_id
+    )
+    SELECT tag_id, tagalong_id FROM implied
+"""
+
 
 def create(conn: Connection, source_id: int, target_id: int) -> None:
-    conn.execute(
+    cursor = conn.execute(
         "INSERT OR IGNORE INTO tagalong(tag_id, tagalong_id) VALUES (?,?)",
         (source_id, target_id),
     )
 
+    if not cursor.rowcount:
+        return
 
-def delete(conn: Connection, source_id: int, target_id: int) -> None:
+    # the source and whatever implies it now imply the target and whatever it
+    # implies; cycles just produce pairs that already exist
     conn.execute(
+        """
+        INSERT OR IGNORE INTO tagalong_closure (tag_id, tagalong_id)
+        SELECT s.tag_id, t.tagalong_id
+        FROM (
+            SELECT :source tag_id
+            UNION SELECT tag_id FROM tagalong_closure WHERE tagalong_id = :source
+        ) s
+        CROSS JOIN (
+            SELECT :target tagalong_id
+            UNION SELECT tagalong_id FROM tagalong_closure WHERE tag_id = :target
+        ) t
+        """,
+        {"source": source_id, "target": target_id},
+    )
+
+
+def delete(
+    conn: Connection, source_id: int, target_id: int, retract_tags: bool = False
+) -> int:
+    """Deletes a tagalong. With `retract_tags`, tags it implied are removed
+    from files too; returns the number of those."""
+    cursor = conn.execute(
         "DELETE FROM tagalong WHERE tag_id = ? AND tagalong_id = ?",
         (source_id, target_id),
     )
 
+    if not cursor.rowcount:
+        return 0
+
+    # only tags that reached the target through the source can lose pairs,
+    # so just their part of the closure is recomputed
+    affected = [source_id] + [
+        tag_id
+        for (tag_id,) in conn.execute(
+            "SELECT tag_id FROM tagalong_closure WHERE tagalong_id = ?", (source_id,)
+        )
+    ]
+    refresh_closure(conn, affected)
+
+    return retract(conn, affected) if retract_tags else 0
+
+
+def drop_implied(conn: Connection) -> int:
+    """Deletes every tag added by tagalongs. Returns number deleted."""
+    return conn.execute("DELETE FROM file_tag WHERE implied_by IS NOT NULL").rowcount
+
+
+def retract(conn: Connection, source_ids: Iterable[int]) -> int:
+    """Deletes tags implied by the given source tags that the closure no longer
+    backs. A node still implied by another sibling is kept and credited to that
+    one instead. Both statements find nodes via idx_file_tag_implied_by.
+    Returns number of nodes deleted.
+    """
+    _temp_ids(conn, "_retract_source", source_ids)
+
+    stale = """
+        file_tag.implied_by IN (SELECT id FROM _retract_source)
+        AND NOT EXISTS (
+            SELECT 1 FROM tagalong_closure c
+            WHERE c.tag_id = file_tag.implied_by
+            AND c.tagalong_id = file_tag.tag_id
+        )
+    """
+    # a sibling whose tag still implies the node's tag
+    other_source = """
+        SELECT s.tag_id
+        FROM file_tag s
+        JOIN tagalong_closure c
+            ON c.tag_id = s.tag_id
+            AND c.tagalong_id = file_tag.tag_id
+        WHERE s.file_id = file_tag.file_id
+        AND s.parent_id IS file_tag.parent_id
+        AND s.id != file_tag.id
+        LIMIT 1
+    """
+
+    conn.execute(f"""
+        UPDATE file_tag SET implied_by = ({other_source})
+        WHERE {stale} AND EXISTS ({other_source})
+    """)
+
+    cursor = conn.execute(f"DELETE FROM file_tag WHERE {stale}")
+    return cursor.rowcount
+
+
+def refresh_closure(conn: Connection, source_ids: Iterable[int]) -> None:
+    """Recomputes just the closure pairs of the given source tags."""
+    _temp_ids(conn, "_closure_source", source_ids)
+    conn.execute("""
+        DELETE FROM tagalong_closure
+        WHERE tag_id IN (SELECT id FROM _closure_source)
+    """)
+    conn.execute(
+        "INSERT INTO tagalong_closure (tag_id, tagalong_id)"
+        + CLOSURE_SQL.format(where="WHERE tag_id IN (SELECT id FROM _closure_source)")
+    )
+
+
+def rebuild_closure(conn: Connection) -> None:
+    """Recomputes the whole closure, e.g. after tags in the graph are deleted."""
+    conn.execute("DELETE FROM tagalong_closure")
+    conn.execute(
+        "INSERT INTO tagalong_closure (tag_id, tagalong_id)"
+        + CLOSURE_SQL.format(where="")
+    )
+
+
+def closure_stats(conn: Connection) -> Row:
+    return conn.execute("""
+        SELECT
+            (SELECT COUNT(*) FROM tagalong) rules,
+            COUNT(*) pairs,
+            COUNT(DISTINCT tag_id) sources,
+            COUNT(*) FILTER (WHERE tag_id = tagalong_id) cyclic,
+            (
+                SELECT COUNT(*) FROM tagalong_closure
+                GROUP BY tag_id ORDER BY 1 DESC LIMIT 1
+            ) max_implied
+        FROM tagalong_closure
+    """).fetchone()
+
 
 def get_all_names(conn: Connection) -> list[Row]:
     result = conn.execute("""
@@ -28,32 +168,105 @@ def get_all_names(conn: Connection) -> list[Row]:
     return result
 
 
-def apply(conn: Connection, file_ids: Iterable[int] | None = None) -> None:
-    # TODO: consider allowing tag filtering
-    q = """
-        WITH RECURSIVE implied(tag_id, tagalong_id) AS (
-            -- direct tagalongs
-            SELECT tag_id, tagalong_id
-            FROM tagalong
-            
-            UNION
-            
-            -- indirect tagalongs
-            SELECT implied.tag_id, t.tagalong_id
-            FROM tagalong t
-            JOIN implied ON t.tag_id = implied.tagalong_id
-        )
+def implying(conn: Connection, tag_ids: Iterable[int]) -> list[int]:
+    """The given tags plus every tag that implies one of them."""
+    _temp_ids(conn, "_implied_tag", tag_ids)
+    rows = conn.execute("""
+        SELECT id FROM _implied_tag
+        UNION
+        SELECT tag_id FROM tagalong_closure
+        WHERE tagalong_id IN (SELECT id FROM _implied_tag)
+    """)
+    return [id_ for (id_,) in rows]
+
+
+def closure_names(conn: Connection) -> list[Row]:
+    """(tag, tagalong) name pairs of the whole closure."""
+    return conn.execute("""
+        SELECT s.name tag, t.name tagalong
+        FROM tagalong_closure c
+        JOIN tag s ON s.id = c.tag_id
+        JOIN tag t ON t.id = c.tagalong_id
+    """).fetchall()
+
+
+def is_virtual(conn: Connection) -> bool:
+    """In virtual mode tagalongs aren't stored, queries resolve them instead."""
+    return setting.get(conn, "tagalong_mode") == "virtual"
+
+
+def set_virtual(conn: Connection, enabled: bool) -> None:
+    setting.set(conn, "tagalong_mode", "virtual" if enabled else "materialized")
+
 
-        INSERT OR IGNORE INTO file_tag (file_id, tag_id, parent_id)
+def apply(
+    conn: Connection,
+    file_ids: Iterable[int] | None = None,
+    tag_ids: Iterable[int] | None = None,
+) -> None:
+    """Adds implied tags next to existing ones. Can be limited to given files
+    and/or to nodes with given tags; the latter goes through idx_file_tag_tag_id,
+    so only those nodes are visited. Does nothing in virtual mode."""
+    if is_virtual(conn):
+        return
+
+    q = """
+        INSERT OR IGNORE INTO file_tag (file_id, tag_id, parent_id, implied_by)
         SELECT
             file_tag.file_id,
-            implied.tagalong_id tag_id,
-            file_tag.parent_id
+            c.tagalong_id,
+            file_tag.parent_id,
+            file_tag.tag_id
         FROM file_tag
-        JOIN implied on implied.tag_id = file_tag.tag_id"""
+        JOIN tagalong_closure c on c.tag_id = file_tag.tag_id"""
+
+    filters = []
 
     if file_ids:
-        phs = ",".join("?" for _ in file_ids)
-        q += f"\nWHERE file_tag.file_id IN ({phs})"
+        _temp_ids(conn, "_tagalong_file", file_ids)
+        filters.append("file_tag.file_id IN (SELECT id FROM _tagalong_file)")
+
+    if tag_ids is not None:
+        _temp_ids(conn, "_tagalong_tag", tag_ids)
+        filters.append("file_tag.tag_id IN (SELECT id FROM _tagalong_tag)")
+
+    if filters:
+        q += "\nWHERE " + " AND ".join(filters)
+
+    conn.execute(q)
+
+
+AUTO_APPLY_TRIGGER = "tagalong_auto_apply"
+
+
+def set_auto_apply(conn: Connection, enabled: bool) -> None:
+    """Toggles a trigger that adds implied tags to every new file_tag row, no
+    matter where the insert comes from.
+
+    The trigger's own inserts don't fire it again (recursive_triggers is off),
+    which is fine as the closure already holds every implied tag. Retagging
+    existing rows doesn't fire it either; service.replace_tags applies the
+    tagalongs of the new tag itself.
+    """
+    if not enabled:
+        conn.execute(f"DROP TRIGGER IF EXISTS {AUTO_APPLY_TRIGGER}")
+        return
+
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS {AUTO_APPLY_TRIGGER}
+        AFTER INSERT ON file_tag
+        BEGIN
+            INSERT OR IGNORE INTO file_tag (file_id, tag_id, parent_id, implied_by)
+            SELECT NEW.file_id, c.tagalong_id, NEW.parent_id, NEW.tag_id
+            FROM tagalong_closure c
+            WHERE c.tag_id = NEW.tag_id;
+        END
+    """)
+
 
-    conn.execute(q, tuple(file_ids or []))
+def is_auto_apply(conn: Connection) -> bool:
+    row = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = ?",
+        (AUTO_APPLY_TRIGGER,),
+    ).fetchone()
+    return row is not None
@@ -1,9 +1,272 @@
 from sqlite3 import Connection
 
+
+def _parent(path: str) -> str:
+    """SQL for everything before the last "/" of `path`: the directory it's
+    in, "" for the root. Paths without any "/" (relative ones, which older
+    versions let in) are put in the root too."""
+    return f"""CASE WHEN instr({path}, '/') = 0 THEN '' ELSE
+        substr({path}, 1, length(rtrim({path}, replace({path}, '/', ''))) - 1)
+    END"""
+
+
+def _name(path: str) -> str:
+    """SQL for everything after the last "/" of `path`, all of it if there's
+    none."""
+    return f"substr({path}, length(rtrim({path}, replace({path}, '/', ''))) + 1)"
+
+
 MIGRATIONS = {
     3: [
         "ALTER TABLE query ADD COLUMN ignore_tag_case BOOLEAN DEFAULT FALSE",
     ],
+    # change counter for incremental exports: triggers stamp files with the
+    # counter's current value whenever they or their tags change.
+    4: [
+        """
+        CREATE TABLE IF NOT EXISTS change_counter (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            value INTEGER NOT NULL
+        )
+        """,
+        "INSERT OR IGNORE INTO change_counter (id, value) VALUES (1, 1)",
+        "ALTER TABLE file ADD COLUMN changed INTEGER NOT NULL DEFAULT 0",
+        "CREATE INDEX IF NOT EXISTS idx_file_changed ON file(changed)",
+        """
+        CREATE TRIGGER IF NOT EXISTS file_changed_insert AFTER INSERT ON file
+        BEGIN
+            UPDATE file SET changed = (SELECT value FROM change_counter)
+            WHERE id = NEW.id;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS file_changed_update
+        AFTER UPDATE OF path, inode, device ON file
+        WHEN OLD.path IS NOT NEW.path
+            OR OLD.inode IS NOT NEW.inode
+            OR OLD.device IS NOT NEW.device
+        BEGIN
+            UPDATE file SET changed = (SELECT value FROM change_counter)
+            WHERE id = NEW.id;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS file_tag_changed_insert AFTER INSERT ON file_tag
+        BEGIN
+            UPDATE file SET changed = (SELECT value FROM change_counter)
+            WHERE id = NEW.file_id AND changed != (SELECT value FROM change_counter);
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS file_tag_changed_update
+        AFTER UPDATE OF tag_id, parent_id ON file_tag
+        BEGIN
+            UPDATE file SET changed = (SELECT value FROM change_counter)
+            WHERE id = NEW.file_id AND changed != (SELECT value FROM change_counter);
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS file_tag_changed_delete AFTER DELETE ON file_tag
+        BEGIN
+            UPDATE file SET changed = (SELECT value FROM change_counter)
+            WHERE id = OLD.file_id AND changed != (SELECT value FROM change_counter);
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS tag_changed_rename AFTER UPDATE OF name ON tag
+        WHEN OLD.name IS NOT NEW.name
+        BEGIN
+            UPDATE file SET changed = (SELECT value FROM change_counter)
+            WHERE id IN (SELECT file_id FROM file_tag WHERE tag_id = NEW.id);
+        END
+        """,
+    ],
+    # ON DELETE CASCADE through parent_id looks up children by parent_id;
+    # without an index every deleted node scans file_tag
+    5: [
+        "CREATE INDEX IF NOT EXISTS idx_file_tag_parent_id ON file_tag(parent_id)",
+    ],
+    # transitive closure of tagalong, kept up to date by crud.tagalong
+    6: [
+        """
+        CREATE TABLE IF NOT EXISTS tagalong_closure (
+            tag_id INTEGER REFERENCES tag(id) ON DELETE CASCADE,
+            tagalong_id INTEGER REFERENCES tag(id) ON DELETE CASCADE,
+            PRIMARY KEY (tag_id, tagalong_id)
+        )
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS idx_tagalong_closure_tagalong_id
+        ON tagalong_closure(tagalong_id)
+        """,
+        """
+        INSERT OR IGNORE INTO tagalong_closure (tag_id, tagalong_id)
+        WITH RECURSIVE implied(tag_id, tagalong_id) AS (
+            SELECT tag_id, tagalong_id FROM tagalong
+            UNION
+            SELECT implied.tag_id, t.tagalong_id
+            FROM tagalong t
+            JOIN implied ON t.tag_id = implied.tagalong_id
+        )
+        SELECT tag_id, tagalong_id FROM implied
+        """,
+    ],
+    # provenance: tag whose tagalongs implied the node, NULL for direct tags
+    7: [
+        """
+        ALTER TABLE file_tag
+        ADD COLUMN implied_by INTEGER REFERENCES tag(id) ON DELETE CASCADE
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_file_tag_implied_by ON file_tag(implied_by)",
+    ],
+    # vault-wide settings, e.g. how tagalongs are applied
+    8: [
+        """
+        CREATE TABLE IF NOT EXISTS setting (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        )
+        """,
+    ],
+    # relocation and `file info --inode` look files up by inode (and device)
+    9: [
+        "CREATE INDEX IF NOT EXISTS idx_file_inode_device ON file(inode, device)",
+    ],
+    # last seen stats, so `file check --incremental` can skip quiet directories
+    10: [
+        "ALTER TABLE file ADD COLUMN size INTEGER",
+        "ALTER TABLE file ADD COLUMN mtime_ns INTEGER",
+        "ALTER TABLE file ADD COLUMN ctime_ns INTEGER",
+        """
+        CREATE TABLE IF NOT EXISTS dir_state (
+            path TEXT PRIMARY KEY,
+            mtime_ns INTEGER NOT NULL
+        )
+        """,
+    ],
+    # optional content fingerprints, see tagumori/hashing.py
+    11: [
+        "ALTER TABLE file ADD COLUMN partial_hash TEXT",
+        "ALTER TABLE file ADD COLUMN hash TEXT",
+        "CREATE INDEX IF NOT EXISTS idx_file_hash ON file(hash)",
+    ],
+    # paths are split into a directory tree and file names, so directory
+    # prefixes are stored once and renaming a directory updates a single row.
+    # The file table is rebuilt, which needs foreign keys off (see migrate)
+    # and the legacy rename, as file_tag's triggers refer to the old table
+    12: [
+        """
+        CREATE TABLE directory (
+            id INTEGER PRIMARY KEY,
+            parent_id INTEGER REFERENCES directory(id),
+            name TEXT NOT NULL,
+            changed INTEGER NOT NULL DEFAULT 0
+        )
+        """,
+        # NULL != NULL, so roots need their own index, like file_tag's
+        "CREATE UNIQUE INDEX directory_unique_child ON directory(parent_id, name)",
+        """
+        CREATE UNIQUE INDEX directory_unique_root ON directory(name)
+        WHERE parent_id IS NULL
+        """,
+        "CREATE INDEX idx_directory_changed ON directory(changed)",
+        # every directory holding files and all of their ancestors; rowids
+        # become directory ids
+        "CREATE TEMP TABLE _migrate_dir (path TEXT PRIMARY KEY)",
+        f"""
+        INSERT INTO _migrate_dir (path)
+        WITH RECURSIVE dirs(path) AS (
+            SELECT {_parent("path")} FROM file
+            UNION
+            SELECT {_parent("path")} FROM dirs WHERE path != ''
+        )
+        SELECT path FROM dirs ORDER BY path
+        """,
+        f"""
+        INSERT INTO directory (id, parent_id, name)
+        SELECT
+            d.rowid,
+            p.rowid,
+            {_name("d.path")}
+        FROM _migrate_dir d
+        LEFT JOIN _migrate_dir p ON d.path != '' AND p.path = {_parent("d.path")}
+        """,
+        """
+        CREATE TABLE file_new (
+            id INTEGER PRIMARY KEY,
+            directory_id INTEGER NOT NULL REFERENCES directory(id),
+            name TEXT NOT NULL,
+            inode INTEGER,
+            device INTEGER,
+            changed INTEGER NOT NULL DEFAULT 0,
+            size INTEGER,
+            mtime_ns INTEGER,
+            ctime_ns INTEGER,
+            partial_hash TEXT,
+            hash TEXT,
+            UNIQUE (directory_id, name)
+        )
+        """,
+        f"""
+        INSERT INTO file_new
+        SELECT
+            file.id,
+            d.rowid,
+            {_name("file.path")},
+            inode,
+            device,
+            changed,
+            size,
+            mtime_ns,
+            ctime_ns,
+            partial_hash,
+            hash
+        FROM file
+        JOIN _migrate_dir d ON d.path = {_parent("file.path")}
+        """,
+        "DROP TABLE _migrate_dir",
+        "DROP TABLE file",
+        "PRAGMA legacy_alter_table = ON",
+        "ALTER TABLE file_new RENAME TO file",
+        "PRAGMA legacy_alter_table = OFF",
+        "CREATE INDEX idx_file_changed ON file(changed)",
+        "CREATE INDEX idx_file_inode_device ON file(inode, device)",
+        "CREATE INDEX idx_file_hash ON file(hash)",
+        """
+        CREATE TRIGGER file_changed_insert AFTER INSERT ON file
+        BEGIN
+            UPDATE file SET changed = (SELECT value FROM change_counter)
+            WHERE id = NEW.id;
+        END
+        """,
+        """
+        CREATE TRIGGER file_changed_update
+        AFTER UPDATE OF directory_id, name, inode, device ON file
+        WHEN OLD.directory_id IS NOT NEW.directory_id
+            OR OLD.name IS NOT NEW.name
+            OR OLD.inode IS NOT NEW.inode
+            OR OLD.device IS NOT NEW.device
+        BEGIN
+            UPDATE file SET changed = (SELECT value FROM change_counter)
+            WHERE id = NEW.id;
+        END
+        """,
+        # a moved directory changes the paths of all files under it; exports
+        # find those through the directory's stamp instead
+        """
+        CREATE TRIGGER directory_changed_update
+        AFTER UPDATE OF parent_id, name ON directory
+        WHEN OLD.parent_id IS NOT NEW.parent_id OR OLD.name IS NOT NEW.name
+        BEGIN
+            UPDATE directory SET changed = (SELECT value FROM change_counter)
+            WHERE id = NEW.id;
+        END
+        """,
+    ],
+    # saved queries can be limited to a directory (`query save --under`)
+    13: [
+        "ALTER TABLE query ADD COLUMN under TEXT",
+    ],
 }
 
 LATEST_VERSION = max(MIGRATIONS.keys())
@@ -11,9 +274,23 @@ LATEST_VERSION = max(MIGRATIONS.keys())
 
 def migrate(conn: Connection):
     (current_version,) = conn.execute("PRAGMA user_version").fetchone()
+    (foreign_keys,) = conn.execute("PRAGMA foreign_keys").fetchone()
 
-    for version in range(current_version + 1, LATEST_VERSION + 1):
-        for statement in MIGRATIONS[version]:
-            conn.execute(statement)
+    # Dropping a rebuilt table would cascade to the tables referencing it.
+    # Foreign keys can't be switched inside a transaction, so that's done
+    # first, and the migrations then run in a single transaction of their own
+    conn.commit()
+    conn.execute("PRAGMA foreign_keys = OFF")
+    try:
+        conn.execute("BEGIN")
+        for version in range(current_version + 1, LATEST_VERSION + 1):
+            for statement in MIGRATIONS[version]:
+                conn.execute(statement)
 
-    conn.execute(f"PRAGMA user_version = {LATEST_VERSION}")
+        conn.execute(f"PRAGMA user_version = {LATEST_VERSION}")
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        conn.execute(f"PRAGMA foreign_keys = {foreign_keys}")
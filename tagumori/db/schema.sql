@@ -36,7 +36,8 @@ ON file_tag (file_id, tag_id, parent_id)
 WHERE parent_id IS NOT NULL;
 
 /** TODO:
-    consider index on parent_id and potentially tag_id, parent_id
+    consider index on tag_id, parent_id
+    (index on parent_id is added in migration 5)
 */
 -- Indices for lookup
 CREATE INDEX IF NOT EXISTS idx_file_tag_file_id ON file_tag(file_id);
@@ -0,0 +1,79 @@
+"""Content fingerprints of files.
+
+A partial hash over the head and tail of a file is cheap and, together with
+the size, rules out most non-matches; only files that agree on both get the
+full hash. Full hashes go over mmap'd files, so hashlib reads straight from
+the page cache without the GIL. The helpers here are module level, so they
+can run in a process pool.
+"""
+
+import hashlib
+import mmap
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Generator, Iterable
+
+from tagumori.utils import map_ahead
+
+# bytes from each end of a file that go into its partial hash
+PARTIAL_SIZE = 1 << 16
+
+
+def _digest():
+    return hashlib.blake2b(digest_size=20)
+
+
+def full_hash(path: str) -> str:
+    h = _digest()
+    with open(path, "rb") as f:
+        # empty files can't be mapped
+        if os.fstat(f.fileno()).st_size:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                h.update(m)
+    return h.hexdigest()
+
+
+def partial_hash(path: str) -> str:
+    h = _digest()
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        h.update(f.read(PARTIAL_SIZE))
+        if size > PARTIAL_SIZE:
+            f.seek(max(PARTIAL_SIZE, size - PARTIAL_SIZE))
+            h.update(f.read())
+    return h.hexdigest()
+
+
+def fingerprint(path: str) -> tuple[int, int, int, str, str] | None:
+    """(size, mtime_ns, ctime_ns, partial hash, full hash), None if unreadable."""
+    try:
+        st = os.stat(path)
+        hashes = partial_hash(path), full_hash(path)
+    except OSError:
+        return None
+
+    return st.st_size, st.st_mtime_ns, st.st_ctime_ns, *hashes
+
+
+def _safe(fn: Callable[[str], str], path: str) -> str | None:
+    try:
+        return fn(path)
+    except OSError:
+        return None
+
+
+def safe_partial_hash(path: str) -> str | None:
+    return _safe(partial_hash, path)
+
+
+def safe_full_hash(path: str) -> str | None:
+    return _safe(full_hash, path)
+
+
+def map_paths(
+    fn: Callable[[str], object], paths: Iterable[str], workers: int | None = None
+) -> Generator[tuple[str, object]]:
+    """Streams (path, fn(path)) computed on a process pool, in input order."""
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(workers) as pool:
+        yield from map_ahead(pool, fn, paths, workers * 4)
@@ -1,21 +1,31 @@
+from functools import cache
 from sqlite3 import Connection
 
 from tagumori.query.ast import Expr, Transformer, validate_for_storage
 from tagumori.query.executor import execute
-from tagumori.query.parser import Lark_StandAlone
-from tagumori.query.planner import simplify, to_query_plan
+from tagumori.query.parser import Lark, Lark_StandAlone
+from tagumori.query.planner import QueryPlan, simplify, to_query_plan
+
+
+@cache
+def _get_parser() -> Lark:
+    # building the parser tables is far more expensive than a parse, so reuse it
+    return Lark_StandAlone(transformer=Transformer())
 
 
 def _string_to_ast(string: str) -> Expr:
-    parser = Lark_StandAlone(transformer=Transformer())
-    ast = parser.parse(string)
+    ast = _get_parser().parse(string)
     return ast
 
 
-def search(conn: Connection, string: str, case: bool = True) -> set[int]:
-    ast = _string_to_ast(string)
-    query_plan = simplify(to_query_plan(ast))
-    return execute(conn, query_plan, case)
+def plan(string: str) -> QueryPlan:
+    return simplify(to_query_plan(_string_to_ast(string)))
+
+
+def search(
+    conn: Connection, string: str, case: bool = True, under: int | None = None
+) -> set[int]:
+    return execute(conn, plan(string), case, under)
 
 
 def parse_for_storage(string) -> Expr:
@@ -1,11 +1,13 @@
 import sqlite3
-from collections import Counter
+from collections.abc import Generator
+from collections import Counter, defaultdict
 from functools import cache, reduce
 from itertools import chain
 
 from tagumori import crud
 from tagumori.query.planner import (
     QP_And,
+    QP_Empty,
     QP_Not,
     QP_OnlyOne,
     QP_Or,
@@ -15,49 +17,88 @@ from tagumori.query.planner import (
     SegmentTag,
     SegmentWildCardSingle,
     TagPath,
+    expand_tagalongs,
+    simplify,
 )
 
 flatten = chain.from_iterable
 
 
-def _build_value(segment: Segment):
-    """Returns tuples of (name, is_any, is_root, is_leaf)"""
+def _build_values(segment: Segment):
+    """Returns tuples of (name, is_any, is_root, is_leaf); one per name a tag
+    segment matches."""
     match segment:
-        case SegmentTag(name, is_root, is_leaf):
-            return (name, 0, is_root, is_leaf)
+        case SegmentTag(name, is_root, is_leaf, aliases):
+            # aliases stand in for implied tags, which are always leaves
+            return [(name, 0, is_root, is_leaf)] + [
+                (alias, 0, is_root, 0) for alias in aliases
+            ]
         case SegmentWildCardSingle(is_root, is_leaf):
-            return (None, 1, is_root, is_leaf)
+            return [(None, 1, is_root, is_leaf)]
 
 
-def find_all(conn, path: TagPath, case):
-    values_ph = ", ".join("(?,?,?,?,?)" for _ in path)
+@cache
+def _find_all_sql(rows: int, case: bool, scoped: bool = False) -> str:
+    """SQL for matching a path given as `rows` (depth, name, ...) rows; a depth
+    with several rows matches any of them. Only depends on the shape of the
+    path, so it's built once and reused by every query of that shape.
 
-    # build values
-    rows = ((i, *vals) for i, vals in enumerate(map(_build_value, path), 1))
-    values = tuple(flatten(rows))
+    When `scoped`, the first parameter is a directory id, and only files in
+    and under it are matched."""
+    values_ph = ", ".join("(?,?,?,?,?)" for _ in range(rows))
 
     # configure case sensitivity
     collate_clause = "" if case else "COLLATE NOCASE"
 
-    q = f"""
-        WITH path(depth, tag_name, is_any, is_root, is_leaf) AS (
+    # matches start from root-level segments, so filtering those is enough
+    scope = ""
+    scope_clause = ""
+    if scoped:
+        scope = f"""{crud.directory.subtree_cte("?")},
+        scope(file_id) AS (
+            SELECT id FROM file WHERE directory_id IN (SELECT id FROM subtree)
+        ),"""
+        scope_clause = "AND file_tag.file_id IN (SELECT file_id FROM scope)"
+
+    return f"""
+        WITH RECURSIVE {scope}
+        path(depth, tag_name, is_any, is_root, is_leaf) AS (
             VALUES {values_ph}
         ),
 
-        match(file_id, id, depth) AS (
+        match(file_id, id, depth, is_leaf) AS (
+            -- named tags go through the tag name and file_tag.tag_id indexes,
+            -- so only nodes carrying one of them are visited
             SELECT
                 file_tag.file_id,
                 file_tag.id,
-                1
-            FROM file_tag
-            JOIN tag ON tag.id = file_tag.tag_id
-            JOIN path
-                ON path.depth = 1
+                1,
+                path.is_leaf
+            FROM path
+            JOIN tag ON tag.name = path.tag_name {collate_clause}
+            JOIN file_tag ON file_tag.tag_id = tag.id
+            WHERE path.depth = 1
+                AND path.is_any = 0
+                {scope_clause}
                 AND (
-                    path.tag_name = tag.name {collate_clause}
+                    -- root check
+                    path.is_root = 0
                     OR
-                    path.is_any = 1 --wilcard (*)
+                    file_tag.parent_id IS NULL
                 )
+
+            UNION ALL
+
+            SELECT
+                file_tag.file_id,
+                file_tag.id,
+                1,
+                path.is_leaf
+            FROM path
+            JOIN file_tag
+            WHERE path.depth = 1
+                AND path.is_any = 1 --wilcard (*)
+                {scope_clause}
                 AND (
                     -- root check
                     path.is_root = 0
@@ -70,7 +111,8 @@ def find_all(conn, path: TagPath, case):
             SELECT
                 child.file_id,
                 child.id,
-                parent.depth + 1
+                parent.depth + 1,
+                path.is_leaf
             FROM match parent
             JOIN file_tag child
                 ON child.parent_id = parent.id
@@ -86,29 +128,151 @@ def find_all(conn, path: TagPath, case):
         )
 
         SELECT DISTINCT match.file_id FROM match
-        JOIN path ON path.depth = match.depth
         WHERE match.depth = (SELECT MAX(depth) FROM path)
         AND (
-            path.is_leaf = 0
+            match.is_leaf = 0
             OR
             NOT EXISTS (SELECT 1 FROM file_tag WHERE file_tag.parent_id = match.id)
         )
     """
+
+
+def _find_all_query(path: list[Segment], case, under: int | None = None):
+    """SQL and parameters selecting the `file_id`s a path matches."""
+    # build values
+    rows = [
+        (i, *vals)
+        for i, segment in enumerate(path, 1)
+        for vals in _build_values(segment)
+    ]
+    values = tuple(flatten(rows))
+
+    if under is not None:
+        values = (under, *values)
+
+    return _find_all_sql(len(rows), case, under is not None), values
+
+
+def find_all(conn, path: list[Segment], case, under: int | None = None):
+    q, values = _find_all_query(path, case, under)
     return {x["file_id"] for x in conn.execute(q, values).fetchall()}
 
 
-def execute(conn: sqlite3.Connection, qp: QueryPlan, case: bool = True):
+def _closure(conn: sqlite3.Connection, case: bool):
+    """The tagalong closure as an implies(a, b) predicate and a lookup of tag
+    name -> names of tags implying it."""
+    fold = (lambda s: s) if case else str.lower
+
+    pairs = set()
+    implied_by = defaultdict(list)
+    for row in crud.tagalong.closure_names(conn):
+        pairs.add((fold(row["tag"]), fold(row["tagalong"])))
+        implied_by[fold(row["tagalong"])].append(row["tag"])
+
+    return (
+        lambda a, b: (fold(a), fold(b)) in pairs,
+        lambda name: implied_by.get(fold(name), []),
+    )
+
+
+def _expand(conn: sqlite3.Connection, qp: QueryPlan, case: bool) -> QueryPlan:
+    # tagalongs that aren't stored are matched through their sources instead.
+    # They can't be removed by hand either, so implied operands can be pruned
+    # before any SQL runs
+    if crud.tagalong.is_virtual(conn):
+        implies, implied_by = _closure(conn, case)
+        return expand_tagalongs(simplify(qp, implies), implied_by)
+    return qp
+
+
+def _plan_query(qp: QueryPlan, case: bool, under: int | None) -> tuple[str, tuple]:
+    """A plan as a single statement selecting matching `file_id`s, so it can
+    be evaluated by SQLite instead of with sets."""
+
+    def members(operands: list[QueryPlan]) -> tuple[list[str], tuple]:
+        queries = [_plan_query(op, case, under) for op in operands]
+        selects = [f"SELECT file_id FROM ({q})" for q, _ in queries]
+        return selects, tuple(flatten(values for _, values in queries))
+
+    match qp:
+        case TagPath(segments):
+            return _find_all_query(segments, case, under)
+
+        case QP_And(operands):
+            selects, values = members(operands)
+            return " INTERSECT ".join(selects), values
+
+        case QP_Or(operands):
+            selects, values = members(operands)
+            return " UNION ".join(selects), values
+
+        case QP_Xor(operands) | QP_OnlyOne(operands):
+            # operands are distinct, so a count is how many of them matched
+            having = "% 2 = 1" if isinstance(qp, QP_Xor) else "= 1"
+            selects, values = members(operands)
+            q = f"""
+                SELECT file_id FROM ({" UNION ALL ".join(selects)})
+                GROUP BY file_id HAVING count(*) {having}
+            """
+            return q, values
+
+        case QP_Not(operand):
+            q, values = _plan_query(operand, case, under)
+            if under is None:
+                every = "SELECT id AS file_id FROM file"
+            else:
+                every = """
+                    SELECT id AS file_id FROM file
+                    WHERE directory_id IN (SELECT id FROM subtree)
+                """
+                values = (under, *values)
+            q = f"{every} EXCEPT SELECT file_id FROM ({q})"
+            if under is not None:
+                q = f"WITH RECURSIVE {crud.directory.subtree_cte('?')} {q}"
+            return q, values
+
+        case QP_Empty():
+            return "SELECT id AS file_id FROM file WHERE 0", ()
+
+    raise TypeError(f"Unknown query plan {qp!r}")
+
+
+def iter_ids(
+    conn: sqlite3.Connection,
+    qp: QueryPlan,
+    case: bool = True,
+    under: int | None = None,
+) -> Generator[int]:
+    """Streams ids of files matching a plan in ascending order, straight from
+    a cursor; same matches as `execute`."""
+    q, values = _plan_query(_expand(conn, qp, case), case, under)
+    for (file_id,) in conn.execute(f"SELECT file_id FROM ({q}) ORDER BY 1", values):
+        yield file_id
+
+
+def execute(
+    conn: sqlite3.Connection,
+    qp: QueryPlan,
+    case: bool = True,
+    under: int | None = None,
+):
+    """Ids of files matching a plan. With `under`, a directory id, only files
+    in and under that directory are considered, by NOT too."""
+    qp = _expand(conn, qp, case)
+
     # cached func for use with NOT
     @cache
     def get_all_file_ids():
-        return {x["id"] for x in crud.file.get_all(conn)}
+        if under is not None:
+            return set(crud.directory.iter_file_ids(conn, under))
+        return {x["id"] for x in crud.file.iter_all(conn)}
 
     def _exec(qp: QueryPlan):
         """Inner function to simplify calling and caching"""
 
         match qp:
             case TagPath(segments):
-                return find_all(conn, segments, case)
+                return find_all(conn, segments, case, under)
 
             case QP_And(operands):
                 # short circuit if any set is empty
@@ -135,4 +299,7 @@ def execute(conn: sqlite3.Connection, qp: QueryPlan, case: bool = True):
             case QP_Not(operand):
                 return get_all_file_ids() - _exec(operand)
 
+            case QP_Empty():
+                return set()
+
     return _exec(qp)
@@ -1,4 +1,6 @@
-from dataclasses import dataclass
+from collections.abc import Callable, Iterable
+from dataclasses import dataclass, replace
+from itertools import chain
 
 from tagumori.query.ast import (
     And,
@@ -20,6 +22,8 @@ class SegmentTag:
     name: str
     is_root: bool = False
     is_leaf: bool = False
+    # other tag names that also match, e.g. tags implying this one
+    aliases: tuple[str, ...] = ()
 
 
 @dataclass
@@ -79,7 +83,17 @@ class QP_Not:
     operand: "QueryPlan"
 
 
-QueryPlan = QP_And | QP_Or | QP_Xor | QP_OnlyOne | QP_Not | TagPath
+@dataclass
+class QP_Empty:
+    """Matches nothing, e.g. a contradiction found while simplifying"""
+
+    pass
+
+
+QueryPlan = QP_And | QP_Or | QP_Xor | QP_OnlyOne | QP_Not | QP_Empty | TagPath
+
+# implies(a, b): every tag a comes with tag b next to it
+Implies = Callable[[str, str], bool]
 
 
 def to_query_plan(
@@ -153,22 +167,91 @@ def to_query_plan(
             return QP_Not(inner)
 
 
-def simplify(qp: QueryPlan) -> QueryPlan:
+def expand_tagalongs(
+    qp: QueryPlan, implied_by: Callable[[str], Iterable[str]]
+) -> QueryPlan:
+    """Lets the last tag of each path also match tags that imply it.
+
+    This is what a stored tagalong looks like: the implied tag sits next to
+    its source and has no children, so only the last segment is expanded.
+    """
     match qp:
-        case TagPath():
+        case TagPath([*prefix, SegmentTag() as last]):
+            aliases = tuple(n for n in implied_by(last.name) if n != last.name)
+            if not aliases:
+                return qp
+            return TagPath([*prefix, replace(last, aliases=aliases)])
+
+        case TagPath() | QP_Empty():
+            return qp
+
+        case QP_Not(operand):
+            return QP_Not(expand_tagalongs(operand, implied_by))
+
+        case QP_And(ops) | QP_Or(ops) | QP_Xor(ops) | QP_OnlyOne(ops):
+            return type(qp)([expand_tagalongs(op, implied_by) for op in ops])
+
+
+def _implies_path(p: QueryPlan, q: QueryPlan, implies: Implies) -> bool:
+    """Whether every file matching path p also matches path q, i.e. q is p with
+    the last tag swapped for one that p's last tag implies."""
+    match p, q:
+        case (
+            TagPath([*p_prefix, SegmentTag() as a]),
+            TagPath([*q_prefix, SegmentTag() as b]),
+        ):
+            return (
+                p_prefix == q_prefix
+                # the implied tag is a sibling, so it's a root if a is, but
+                # it may have children if it was also added by hand
+                and (a.is_root or not b.is_root)
+                and not b.is_leaf
+                and implies(a.name, b.name)
+            )
+
+    return False
+
+
+def _prune_implied(operands: list[QueryPlan], implies: Implies) -> list[QueryPlan]:
+    """Drops AND operands implied by another one. A,!B where A implies B can't
+    match anything, so the whole AND becomes empty."""
+    for op in operands:
+        if isinstance(op, QP_Not) and any(
+            _implies_path(p, op.operand, implies) for p in operands
+        ):
+            return [QP_Empty()]
+
+    # an operand goes if something kept or still to come implies it; checking
+    # only kept ones on the left means one of A,B survives when they imply
+    # each other
+    kept: list[QueryPlan] = []
+    for i, op in enumerate(operands):
+        others = chain(kept, operands[i + 1 :])
+        if not any(_implies_path(other, op, implies) for other in others):
+            kept.append(op)
+
+    return kept
+
+
+def simplify(qp: QueryPlan, implies: Implies | None = None) -> QueryPlan:
+    """Normalizes a plan. Given `implies`, tagalongs are taken into account
+    too: AND operands implied by another are dropped and contradictions become
+    QP_Empty. Only pass it when implied tags are guaranteed to be present."""
+    match qp:
+        case TagPath() | QP_Empty():
             # base case, nothing to simplify
             return qp
 
         case QP_Not(QP_Not(inner)):
             # double negation
-            return simplify(inner)
+            return simplify(inner, implies)
 
         case QP_Not(operand):
-            return QP_Not(simplify(operand))
+            return QP_Not(simplify(operand, implies))
 
         case QP_And(operands):
             # simplify children
-            simplified = map(simplify, operands)
+            simplified = [simplify(op, implies) for op in operands]
 
             # flatten nested: AND(AND(a,b), c) -> AND(a,b,c)
             flattened = []
@@ -178,6 +261,13 @@ def simplify(qp: QueryPlan) -> QueryPlan:
                 else:
                     flattened.append(op)
 
+            # anything AND nothing is nothing
+            if any(isinstance(op, QP_Empty) for op in flattened):
+                return QP_Empty()
+
+            if implies:
+                flattened = _prune_implied(flattened, implies)
+
             # unwrap single: AND(a) -> a
             if len(flattened) == 1:
                 return flattened[0]
@@ -186,16 +276,20 @@ def simplify(qp: QueryPlan) -> QueryPlan:
 
         case QP_Or(operands):
             # simplify children
-            simplified = map(simplify, operands)
+            simplified = [simplify(op, implies) for op in operands]
 
             # flatten nested: OR(OR(a,b), c) -> OR(a,b,c)
             flattened = []
             for op in simplified:
                 if isinstance(op, QP_Or):
                     flattened.extend(op.operands)
-                else:
+                elif not isinstance(op, QP_Empty):
                     flattened.append(op)
 
+            # every operand was empty
+            if not flattened:
+                return QP_Empty()
+
             # unwrap single: OR(a) -> a
             if len(flattened) == 1:
                 return flattened[0]
@@ -203,7 +297,7 @@ def simplify(qp: QueryPlan) -> QueryPlan:
             return QP_Or(flattened)
 
         case QP_Xor(operands):
-            simplified = list(map(simplify, operands))
+            simplified = [simplify(op, implies) for op in operands]
 
             # unwrap single: XOR(a) -> a
             if len(simplified) == 1:
@@ -212,7 +306,7 @@ def simplify(qp: QueryPlan) -> QueryPlan:
             return QP_Xor(simplified)
 
         case QP_OnlyOne(operands):
-            simplified = list(map(simplify, operands))
+            simplified = [simplify(op, implies) for op in operands]
 
             # unwrap single: OnlyOne(a) -> a
             if len(simplified) == 1:
@@ -1,12 +1,24 @@
+import json
+import os
 from collections import defaultdict
-from itertools import groupby
+from collections.abc import Generator, Iterable, Sequence
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain, groupby
 from pathlib import Path
 from sqlite3 import Connection, Row
+from typing import TYPE_CHECKING
 
-from tagumori import crud
+from tagumori import crud, hashing
 from tagumori.query import parse_for_storage, search
 from tagumori.query.ast import And, Expr, Tag
-from tagumori.utils import compile_pattern
+from tagumori.utils import chunked, compile_pattern, iter_files, map_ahead
+
+if TYPE_CHECKING:
+    # the watchers are only loaded by the watch command
+    from tagumori.watch import Changes
+
+# files per round trip when streaming files with their tags
+CHUNK_SIZE = 10_000
 
 
 # utilities for turning the db file_tag structures to AST and paths
@@ -37,18 +49,29 @@ def _db_to_ast(file_tags: list[Row]) -> Expr:
     return And(roots)
 
 
-def _ast_to_paths(node: Expr, prefix=()) -> list[tuple[str, ...]]:
-    match node:
-        case Tag(name, None):
-            return [prefix + (name,)]
-        case Tag(name, children):
-            return _ast_to_paths(children, prefix + (name,))
-        case And(operands):
-            return [p for op in operands for p in _ast_to_paths(op, prefix)]
+def _implies(conn: Connection) -> dict[str, list[str]]:
+    """Tag name -> names of the tags it implies, from the tagalong closure."""
+    lookup = defaultdict(list)
+    for row in crud.tagalong.closure_names(conn):
+        lookup[row["tag"]].append(row["tagalong"])
+    return lookup
 
 
-def _db_tags_to_paths(file_tags: list[Row]) -> set[tuple[str, ...]]:
-    return set(_ast_to_paths(_db_to_ast(file_tags)))
+def _with_implied(file_tags: list[Row], implies: dict[str, list[str]]) -> list:
+    """Adds the tags that virtual tagalongs imply as extra leaf rows, next to
+    the tags implying them, so they render like stored ones."""
+    present = {(row["parent_id"], row["name"]) for row in file_tags}
+    extra = []
+
+    for row in file_tags:
+        for name in implies.get(row["name"], ()):
+            key = (row["parent_id"], name)
+            if key not in present:
+                present.add(key)
+                # negative ids can't clash with real nodes
+                extra.append({"id": -len(present), "name": name, "parent_id": key[0]})
+
+    return [*file_tags, *extra]
 
 
 def attach_tree(
@@ -67,16 +90,65 @@ def attach_tree(
                 attach_tree(conn, file_id, op, parent_id)
 
 
+def _ast_to_tree(node: Expr) -> list[tuple[int, int, int, str]]:
+    """Flattens a storage AST into (node, parent_node, depth, name) rows.
+
+    Siblings with the same name are merged, e.g. a[b],a[c] is a single a
+    with children b and c. Roots have parent_node 0.
+    """
+    tree: dict[tuple[int, str], tuple[int, int, int, str]] = {}
+
+    def walk(node: Expr, parent: int, depth: int):
+        match node:
+            case Tag(name, children):
+                if (parent, name) not in tree:
+                    tree[parent, name] = (len(tree) + 1, parent, depth, name)
+
+                if children is not None:
+                    walk(children, tree[parent, name][0], depth + 1)
+
+            case And(operands):
+                for op in operands:
+                    walk(op, parent, depth)
+
+    walk(node, 0, 1)
+    return list(tree.values())
+
+
+def _resolve_tree(
+    conn: Connection, tree: list[tuple[int, int, int, str]], create: bool = True
+) -> list[crud.file_tag.TreeNode]:
+    """Swaps tag names for tag ids. Without `create`, unknown tags get None."""
+    names = list(dict.fromkeys(name for *_, name in tree))
+
+    if create:
+        rows = crud.tag.get_or_create_many(conn, names)
+    else:
+        rows = crud.tag.get_many_by_name(conn, names)
+
+    ids = {row["name"]: row["id"] for row in rows}
+
+    return [(node, parent, depth, ids.get(name)) for node, parent, depth, name in tree]
+
+
+def attach_tree_many(conn: Connection, file_ids: list[int], node: Expr):
+    """Bulk version of attach_tree: attaches the same tree to all files."""
+    tree = _resolve_tree(conn, _ast_to_tree(node))
+    crud.file_tag.attach_many(conn, file_ids, tree)
+
+
 def add_tags_to_files(
-    conn: Connection, files: list[Path], tags: list[str], apply_tagalongs: bool = True
+    conn: Connection,
+    files: list[Path],
+    tags: Iterable[str],
+    apply_tagalongs: bool = True,
 ):
     file_ids = [x["id"] for x in crud.file.get_or_create_many(conn, files)]
 
     tag_expr = ",".join(tags)
     node = parse_for_storage(tag_expr)
 
-    for file_id in file_ids:
-        attach_tree(conn, file_id, node)
+    attach_tree_many(conn, file_ids, node)
 
     if apply_tagalongs:
         crud.tagalong.apply(
@@ -85,83 +157,331 @@ def add_tags_to_files(
         )
 
 
-def remove_tags_from_files(conn: Connection, files: list[Path], tags: list[str]):
+def add_tag_records(
+    conn: Connection,
+    records: list[tuple[Path, list[str]]],
+    apply_tagalongs: bool = True,
+):
+    """Adds a different set of tags to each file, with one set-based pass
+    for the whole batch. Tag expressions are parsed once per distinct string."""
+    trees: dict[str, list[tuple[int, int, int, str]]] = {}
+    for _, tags in records:
+        tag_expr = ",".join(tags)
+        if tag_expr and tag_expr not in trees:
+            trees[tag_expr] = _ast_to_tree(parse_for_storage(tag_expr))
+
+    # resolving is the costliest per-record step, so only do it once
+    paths = [path.resolve() for path, _ in records]
+    files = crud.file.iter_or_create_many(conn, paths, resolve=False)
+    file_ids = {f["path"]: f["id"] for f in files}
+
+    names = list(dict.fromkeys(n for tree in trees.values() for *_, n in tree))
+    tag_ids = {t["name"]: t["id"] for t in crud.tag.get_or_create_many(conn, names)}
+
+    forest: list[crud.file_tag.ForestNode] = []
+    for path, (_, tags) in zip(paths, records):
+        tag_expr = ",".join(tags)
+        if not tag_expr:
+            continue
+
+        file_id = file_ids[str(path)]
+        # offset node numbers so they are unique across the batch (0 stays 0)
+        offset = len(forest)
+        for node, parent, depth, name in trees[tag_expr]:
+            parent = parent and parent + offset
+            forest.append((file_id, node + offset, parent, depth, tag_ids[name]))
+
+    crud.file_tag.attach_forest(conn, forest)
+
+    if apply_tagalongs and file_ids:
+        crud.tagalong.apply(conn, list(file_ids.values()))
+
+
+def import_records(
+    conn: Connection,
+    records: Iterable[tuple[Path, list[str]]],
+    apply_tagalongs: bool = True,
+    batch_size: int = CHUNK_SIZE,
+) -> Generator[int]:
+    """Adds tag records in batches, yielding the size of each batch once it has
+    been applied. The caller decides when to commit."""
+    for batch in chunked(records, batch_size):
+        add_tag_records(conn, batch, apply_tagalongs)
+        yield len(batch)
+
+
+def import_rules(
+    conn: Connection, records: Iterable[dict], apply_tagalongs: bool = True
+) -> None:
+    """Restores the tagalong and query records of an export. Queries replace
+    saved queries of the same name."""
+    source_ids = []
+
+    for record in records:
+        if record["type"] == "tagalong":
+            source = crud.tag.get_or_create(conn, record["tag"])
+            target = crud.tag.get_or_create(conn, record["tagalong"])
+            crud.tagalong.create(conn, source["id"], target["id"])
+            source_ids.append(source["id"])
+
+        elif record["type"] == "query":
+            crud.query.upsert(
+                conn,
+                name=record["name"],
+                select_tags=json.dumps(record.get("select_tags", [])),
+                exclude_tags=json.dumps(record.get("exclude_tags", [])),
+                ignore_tag_case=record.get("ignore_tag_case", False),
+                pattern=record.get("pattern", ".*"),
+                ignore_case=record.get("ignore_case", False),
+                invert_match=record.get("invert_match", False),
+                under=record.get("under"),
+            )
+
+    # only nodes with the sources, or tags implying them, can gain tags
+    if apply_tagalongs and source_ids:
+        crud.tagalong.apply(conn, tag_ids=crud.tagalong.implying(conn, source_ids))
+
+
+def remove_tags_from_files(
+    conn: Connection, files: list[Path], tags: Iterable[str]
+) -> int:
+    """Removes the leaf of each tag path from the files. Returns number removed."""
     # non-existing files are skipped here due to how get_many_by_path works.
     file_ids = [x["id"] for x in crud.file.get_many_by_path(conn, files)]
 
     tag_expr = ",".join(tags)
     node = parse_for_storage(tag_expr)
 
-    tag_paths = _ast_to_paths(node)
-
-    for file_id in file_ids:
-        for tag in tags:
-            for path in tag_paths:
-                file_tag_id = crud.file_tag.resolve_path(conn, file_id, path)
-                if file_tag_id:
-                    crud.file_tag.detach(conn, file_tag_id)
+    tree = _resolve_tree(conn, _ast_to_tree(node), create=False)
+    return crud.file_tag.detach_many(conn, file_ids, tree)
 
 
 def set_tags_on_files(
-    conn: Connection, files: list[Path], tags: Expr, apply_tagalongs: bool = True
+    conn: Connection,
+    files: list[Path],
+    tags: Iterable[str],
+    apply_tagalongs: bool = True,
 ):
     tag_expr = ",".join(tags)
     node = parse_for_storage(tag_expr)
 
-    # remove unwanted paths
-    desired_paths = set(_ast_to_paths(node))
-
     file_ids = [x["id"] for x in crud.file.get_or_create_many(conn, files)]
+    tree = _resolve_tree(conn, _ast_to_tree(node))
 
-    db_tags = crud.file_tag.get_by_file_ids(conn, file_ids)
-
-    lookup = {k: list(v) for k, v in groupby(db_tags, key=lambda x: x["file_id"])}
+    # remove unwanted nodes, then add missing ones: only the delta is touched
+    crud.file_tag.prune_to_tree(conn, file_ids, tree)
+    crud.file_tag.attach_many(conn, file_ids, tree)
 
-    for file_id in file_ids:
-        existing_paths = _db_tags_to_paths(lookup.get(file_id, []))
+    # done after pruning so new tagalongs aren't nuked.
+    if apply_tagalongs:
+        crud.tagalong.apply(conn, file_ids)
 
-        paths_to_delete = existing_paths - desired_paths
-        for path in paths_to_delete:
-            file_tag_id = crud.file_tag.resolve_path(conn, file_id, path)
-            crud.file_tag.detach(conn, file_tag_id)
 
-    # attach new tags - done after removal so new tagalongs aren't nuked.
-    # add_tags_to_files evaluates ´tags´ as well, so there's a bit of double work here.
-    add_tags_to_files(conn, files, tags, apply_tagalongs)
+def iter_add_tags(
+    conn: Connection,
+    files: Iterable[Path],
+    tags: Iterable[str],
+    apply_tagalongs: bool = True,
+    batch_size: int = CHUNK_SIZE,
+) -> Generator[int]:
+    """add_tags_to_files, one batch of files at a time, so files can come from
+    a directory walk without being collected first. Yields batch sizes."""
+    for batch in chunked(files, batch_size):
+        add_tags_to_files(conn, batch, tags, apply_tagalongs)
+        yield len(batch)
+
+
+def iter_set_tags(
+    conn: Connection,
+    files: Iterable[Path],
+    tags: Iterable[str],
+    apply_tagalongs: bool = True,
+    batch_size: int = CHUNK_SIZE,
+) -> Generator[int]:
+    """set_tags_on_files in batches, like iter_add_tags."""
+    for batch in chunked(files, batch_size):
+        set_tags_on_files(conn, batch, tags, apply_tagalongs)
+        yield len(batch)
+
+
+def iter_remove_tags(
+    conn: Connection,
+    files: Iterable[Path],
+    tags: Iterable[str],
+    batch_size: int = CHUNK_SIZE,
+) -> Generator[int]:
+    """remove_tags_from_files in batches. Yields number of tags removed per
+    batch."""
+    for batch in chunked(files, batch_size):
+        yield remove_tags_from_files(conn, batch, tags)
 
 
-def drop_file_tags(conn: Connection, files: list[Path], retain_file: bool = False):
-    file_ids = [x["id"] for x in crud.file.get_many_by_path(conn, files)]
-    for file_id in file_ids:
-        crud.file_tag.drop_for_file(conn, file_id)
+def iter_drop_file_tags(
+    conn: Connection,
+    file_ids: Iterable[int],
+    retain_file: bool = False,
+    batch_size: int = CHUNK_SIZE,
+) -> Generator[int]:
+    """Drops the tags (and unless `retain_file`, the records) of files, one
+    batch of files at a time. Yields batch sizes; the caller decides when to
+    commit, so the write lock is only held per batch."""
+    for batch in chunked(file_ids, batch_size):
+        # tags first, so the file delete doesn't have to cascade
+        crud.file_tag.drop_for_files(conn, batch)
 
         if not retain_file:
-            crud.file.delete(conn, file_id)
-
+            crud.file.delete_many(conn, batch)
 
-def get_files_with_tags(conn: Connection, files: list[Path]) -> dict[Path, Expr]:
-    file_records = crud.file.get_many_by_path(conn, files)
-    ids = [file["id"] for file in file_records]
-    tags = crud.file_tag.get_by_file_ids(conn, ids)
+        yield len(batch)
 
-    # tags are ordered by file id so we can groupby safely
-    lookup = {k: list(v) for k, v in groupby(tags, key=lambda x: x["file_id"])}
-
-    return {
-        Path(f["path"]): {"file": f, "ast": _db_to_ast(lookup.get(f["id"], []))}
-        for f in file_records
-    }
 
+def drop_file_tags(conn: Connection, files: list[Path], retain_file: bool = False):
+    file_ids = [x["id"] for x in crud.file.get_many_by_path(conn, files)]
+    for _ in iter_drop_file_tags(conn, file_ids, retain_file):
+        pass
 
-def execute_query(
+
+def iter_delete_tags(
+    conn: Connection, tag_ids: list[int], batch_size: int = CHUNK_SIZE
+) -> Generator[int]:
+    """Deletes tags, first detaching them from files `batch_size` nodes at a
+    time (subtrees included). Yields number of nodes detached per batch."""
+    while count := crud.file_tag.detach_tags(conn, tag_ids, batch_size):
+        yield count
+
+    # implications through deleted tags are gone too, but only tags implying
+    # one of them can have lost any
+    affected = crud.tagalong.implying(conn, tag_ids)
+    crud.tag.delete_many(conn, tag_ids)
+    crud.tagalong.refresh_closure(conn, affected)
+
+
+def replace_tags(
+    conn: Connection, old: Iterable[str], new: str, remove: bool = False
+) -> int:
+    """Merges the old tags into the new one on every file. With `remove`, the
+    old tags are deleted afterwards. Returns number of nodes merged away."""
+    target = crud.tag.get_or_create(conn, new)
+    old_ids = [
+        t["id"] for t in crud.tag.get_many_by_name(conn, old) if t["id"] != target["id"]
+    ]
+
+    merged = crud.file_tag.merge(conn, old_ids, target["id"])
+
+    # merging retags nodes with an UPDATE, which the auto-apply trigger misses
+    if crud.tagalong.is_auto_apply(conn):
+        crud.tagalong.apply(conn, tag_ids=[target["id"]])
+
+    if remove:
+        crud.tag.delete_many(conn, old_ids)
+        crud.tagalong.rebuild_closure(conn)
+
+    return merged
+
+
+def iter_files_with_tags(
+    conn: Connection, files: Iterable[Path]
+) -> Generator[tuple[Path, dict]]:
+    """Streams (path, {"file": record, "ast": tags}) pairs in input order.
+
+    Files are looked up in chunks, so memory use doesn't grow with the number of
+    files. Untracked files are skipped. With virtual tagalongs, implied tags are
+    shown as if they were stored.
+    """
+    implies = _implies(conn) if crud.tagalong.is_virtual(conn) else {}
+
+    for chunk in chunked(files, CHUNK_SIZE):
+        paths = [str(f.resolve()) for f in chunk]
+        records = {r["path"]: r for r in crud.file.iter_many_by_unique_col(conn, paths)}
+        ids = [r["id"] for r in records.values()]
+        tags = crud.file_tag.iter_by_file_ids(conn, ids)
+
+        # tags are ordered by file id so we can groupby safely
+        lookup = {k: list(v) for k, v in groupby(tags, key=lambda x: x["file_id"])}
+
+        if implies:
+            lookup = {k: _with_implied(v, implies) for k, v in lookup.items()}
+
+        for path in paths:
+            if f := records.get(path):
+                yield Path(path), {
+                    "file": f,
+                    "ast": _db_to_ast(lookup.get(f["id"], [])),
+                }
+
+
+def get_files_with_tags(conn: Connection, files: list[Path]) -> dict[Path, dict]:
+    return dict(iter_files_with_tags(conn, files))
+
+
+def _ast_to_strs(node: Expr) -> list[str]:
+    """Splits a stored tag tree into one tag expression per root."""
+    if isinstance(node, And):
+        return [str(op) for op in node.operands]
+    return [str(node)]
+
+
+def iter_export(conn: Connection, since: int = 0) -> Generator[dict]:
+    """Streams the vault as records: files changed at or after `since` with their
+    tags, then all tagalongs and saved queries. Deleted files leave nothing
+    behind to export, so they're only missed by a full export.
+
+    Files are read over a single cursor and each tag tree is built as soon as
+    its last row is seen, so memory use is bounded by the largest tree.
+    """
+    rows = crud.file_tag.iter_with_files(conn, since)
+
+    for _, grouped in groupby(rows, key=lambda x: x["file_id"]):
+        group = list(grouped)
+        file = group[0]
+        tagged = (r for r in group if r["id"] is not None)
+        file_tags = sorted(tagged, key=lambda x: x["name"])
+
+        yield {
+            "type": "file",
+            "path": file["path"],
+            "inode": file["inode"],
+            "device": file["device"],
+            "tags": _ast_to_strs(_db_to_ast(file_tags)) if file_tags else [],
+        }
+
+    for tag, tagalong in crud.tagalong.get_all_names(conn):
+        yield {"type": "tagalong", "tag": tag, "tagalong": tagalong}
+
+    for q in crud.query.iter_all(conn, order_by="name"):
+        yield {
+            "type": "query",
+            "name": q["name"],
+            "select_tags": json.loads(q["select_tags"]),
+            "exclude_tags": json.loads(q["exclude_tags"]),
+            "ignore_tag_case": bool(q["ignore_tag_case"]),
+            "pattern": q["pattern"],
+            "ignore_case": bool(q["ignore_case"]),
+            "invert_match": bool(q["invert_match"]),
+            "under": q["under"],
+        }
+
+
+def iter_query(
     conn: Connection,
-    select_strs: list[str],
-    exclude_strs: list[str],
+    select_strs: Sequence[str],
+    exclude_strs: Sequence[str],
     ignore_tag_case: bool = False,
     pattern: str = ".*",
     ignore_case: bool = False,
     invert_match: bool = False,
-) -> list[Path]:
+    under: Path | None = None,
+) -> Generator[Path]:
+    """Yields matching paths in order. Without tag filters, paths are streamed
+    straight from the path index.
+
+    With `under`, only files in and under that directory are searched: the
+    scope is part of the SQL, so files elsewhere are never fetched."""
+    under_id = None
+    if under is not None:
+        under_id = crud.directory.get_id(conn, str(under.resolve()).rstrip("/"))
+        if under_id is None:
+            return
 
     query_parts = []
 
@@ -173,29 +493,341 @@ def execute_query(
 
     query_str = ",".join(query_parts)
 
+    paths: Iterable[str]
     if query_str:
-        ids = search(conn, query_str, not ignore_tag_case)
-        files = crud.file.get_many(conn, list(ids))
+        ids = search(conn, query_str, not ignore_tag_case, under_id)
+        paths = sorted(f["path"] for f in crud.file.iter_many(conn, ids))
+    elif under_id is not None:
+        files = crud.file.iter_under(conn, under_id, order_by="path")
+        paths = (f["path"] for f in files)
     else:
-        files = crud.file.get_all(conn)
+        paths = (f["path"] for f in crud.file.iter_all(conn, order_by="path"))
 
     regex = compile_pattern(pattern, ignore_case)
 
-    return sorted(
-        Path(f["path"]) for f in files if bool(regex.search(f["path"])) ^ invert_match
+    for path in paths:
+        if bool(regex.search(path)) ^ invert_match:
+            yield Path(path)
+
+
+def execute_query(
+    conn: Connection,
+    select_strs: Sequence[str],
+    exclude_strs: Sequence[str],
+    ignore_tag_case: bool = False,
+    pattern: str = ".*",
+    ignore_case: bool = False,
+    invert_match: bool = False,
+    under: Path | None = None,
+) -> list[Path]:
+    return list(
+        iter_query(
+            conn,
+            select_strs,
+            exclude_strs,
+            ignore_tag_case,
+            pattern,
+            ignore_case,
+            invert_match,
+            under,
+        )
     )
 
 
-def relocate_file(conn: Connection, file: Row, search_root: Path):
-    """Finds a file by inode/device and updates its path."""
-    target_inode = file["inode"]
-    target_device = file["device"]
+def _stat(path: str) -> os.stat_result | None:
+    try:
+        return os.stat(path)
+    except OSError:
+        return None
+
+
+def _stat_record(record: Row) -> os.stat_result | None:
+    return _stat(record["path"])
+
+
+def iter_file_stats(
+    conn: Connection, workers: int = 16, incremental: bool = False
+) -> Generator[tuple[Row, os.stat_result | None]]:
+    """Streams file records with a fresh stat of their path (None if gone).
+
+    Records are read a page at a time and stat'ed on a thread pool, a
+    bounded number ahead of the consumer, so slow (e.g. network) storage is
+    checked in parallel without loading the file table first. No cursor stays
+    open, so the caller can update and commit records as they come. With
+    `incremental`, only files in directories not in dir_state are streamed
+    (see forget_changed_dirs).
+    """
+    records = crud.file.iter_paged(conn, unchecked=incremental)
+
+    with ThreadPoolExecutor(workers) as pool:
+        yield from map_ahead(pool, _stat_record, records, workers * 4)
+
+
+def refresh_inodes_under(conn: Connection, dir_: Path, workers: int = 16) -> int:
+    """Stores a fresh inode/device for every file in and under a directory,
+    stat'ed on a thread pool. For after a move that didn't keep inodes, e.g.
+    one across filesystems. Returns number of files updated."""
+    dir_id = crud.directory.get_id(conn, str(dir_.resolve()).rstrip("/"))
+    if dir_id is None:
+        return 0
+
+    # collected first, as the records come from a cursor over the same table
+    records = crud.file.iter_under(conn, dir_id)
+    with ThreadPoolExecutor(workers) as pool:
+        rows = [
+            (record["id"], stat.st_ino, stat.st_dev)
+            for record, stat in map_ahead(pool, _stat_record, records, workers * 4)
+            if stat is not None
+        ]
+
+    crud.file.update_inodes(conn, rows)
+    return len(rows)
+
+
+def forget_changed_dirs(conn: Connection, workers: int = 16) -> dict[str, int]:
+    """Stats every directory holding tracked files and drops the dir_state of
+    those that changed or are gone, so their files count as unchecked.
+
+    Returns the current mtimes of changed directories, to store once their
+    files have been checked.
+    """
+    seen = crud.dir_state.get_all(conn)
+    changed = {}
+    gone = []
+
+    with ThreadPoolExecutor(workers) as pool:
+        dirs = crud.file.iter_dirs(conn)
+        for path, stat in map_ahead(pool, _stat, dirs, workers * 4):
+            mtime = seen.pop(path, None)
+
+            if stat is None:
+                gone.append(path)
+            elif stat.st_mtime_ns != mtime:
+                changed[path] = stat.st_mtime_ns
+
+    # what's left in `seen` no longer holds tracked files
+    crud.dir_state.forget(conn, chain(changed, gone, seen))
+    return changed
+
+
+def sync_changes(
+    conn: Connection, changes: "Changes", errors: list[str] | None = None
+) -> tuple[int, int, int]:
+    """Brings file records in line with changes seen by a watcher: directory
+    moves are applied as prefix updates, then files in changed directories are
+    matched by inode. Returns (moved, refreshed, missing) counts.
+
+    Moves that can't be applied, e.g. of a directory under itself, raise
+    ValueError, unless `errors` is given: then they're skipped and described
+    there.
+    """
+    moved = 0
+    for old, new in changes.moves:
+        try:
+            moved += crud.file.move_prefix(conn, old, new)
+        except ValueError as e:
+            if errors is None:
+                raise
+            errors.append(f"{old} -> {new}: {e}")
+
+    rows = []
+    gone = set()
+    for dir_ in changes.dirs:
+        try:
+            with os.scandir(dir_) as it:
+                files = [entry for entry in it if entry.is_file()]
+        except OSError:
+            gone.add(dir_)
+            continue
+
+        for entry in files:
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            rows.append((entry.path, stat.st_dev, stat.st_ino))
 
-    for path in search_root.rglob("*"):
-        if not path.is_file():
+    found, refreshed = crud.file.sync_seen(conn, rows)
+
+    missing = sum(
+        crud.file.count_missing(conn, dir_, recursive=dir_ in gone)
+        for dir_ in changes.dirs
+    )
+    return moved + found, refreshed, missing
+
+
+def iter_hash_files(
+    conn: Connection,
+    rehash: bool = False,
+    workers: int | None = None,
+    batch_size: int = CHUNK_SIZE,
+) -> Generator[int]:
+    """Fingerprints tracked files that don't have one yet (all with `rehash`)
+    on a process pool. Yields the number stored per batch, for the caller to
+    commit. Unreadable files are skipped."""
+    records = crud.file.iter_all(conn) if rehash else crud.file.iter_unhashed(conn)
+    # collected first: storing hashes while the cursor over `hash IS NULL` is
+    # still open could skip rows or visit them twice
+    ids = {record["path"]: record["id"] for record in records}
+
+    for chunk in chunked(
+        hashing.map_paths(hashing.fingerprint, list(ids), workers), batch_size
+    ):
+        rows = []
+        for path, fp in chunk:
+            id_ = ids.pop(path)
+            if fp is not None:
+                rows.append((id_, *fp))
+
+        crud.file.update_fingerprints(conn, rows)
+        yield len(rows)
+
+
+def iter_dupes(conn: Connection, workers: int | None = None) -> Generator[list[str]]:
+    """Streams groups of tracked files with the same content.
+
+    Files are grouped by size first and only same-size files get a partial
+    hash; only those that still agree get a full hash. Stored fingerprints of
+    files that haven't changed since are reused, new ones are stored.
+    Empty files are left out.
+    """
+    by_size = defaultdict(list)
+    for record, stat in iter_file_stats(conn):
+        if stat and stat.st_size:
+            by_size[stat.st_size].append((record, stat))
+
+    def fresh(record, stat):
+        return (record["size"], record["mtime_ns"]) == (stat.st_size, stat.st_mtime_ns)
+
+    stats = {}
+    partial = {}
+    full = {}
+    for group in by_size.values():
+        if len(group) < 2:
             continue
+        for record, stat in group:
+            stats[record["path"]] = record, stat
+            if fresh(record, stat) and record["partial_hash"]:
+                partial[record["path"]] = record["partial_hash"]
+                full[record["path"]] = record["hash"]
+
+    stale = {path for path in stats if path not in partial}
+    partial |= hashing.map_paths(hashing.safe_partial_hash, stale, workers)
+
+    by_partial = defaultdict(list)
+    for path, h in partial.items():
+        if h is not None:
+            by_partial[stats[path][1].st_size, h].append(path)
+
+    unhashed = {
+        path
+        for group in by_partial.values()
+        if len(group) > 1
+        for path in group
+        if full.get(path) is None
+    }
+    full |= hashing.map_paths(hashing.safe_full_hash, unhashed, workers)
+
+    # keep what was computed, so the next run can skip it
+    crud.file.update_fingerprints(
+        conn,
+        (
+            (record["id"], stat.st_size, stat.st_mtime_ns, stat.st_ctime_ns)
+            + (partial[path], full.get(path))
+            for path, (record, stat) in stats.items()
+            if path in stale or path in unhashed
+        ),
+    )
+
+    by_hash = defaultdict(list)
+    for path, h in full.items():
+        if h is not None:
+            by_hash[h].append(path)
+
+    for paths in by_hash.values():
+        if len(paths) > 1:
+            yield sorted(paths)
 
-        stat = path.stat()
 
-        if stat.st_ino == target_inode and stat.st_dev == target_device:
-            crud.file.update(conn, file["id"], path, stat.st_ino, stat.st_dev)
+def relocate_files(
+    conn: Connection,
+    files: Iterable[Row],
+    search_root: Path,
+    workers: int | None = None,
+) -> list[Row]:
+    """Finds files under `search_root` and updates their paths.
+
+    Files are looked up by inode/device in a single walk, which stops once
+    each one is found. Files with a fingerprint (`file hash`) can be found by
+    content too, e.g. after crossing filesystems: files met on the walk with
+    the size of one still missing are compared by partial, then full hash.
+    Returns the records that weren't found.
+    """
+    files = list(files)
+    pending = {f["id"] for f in files}
+    by_inode = {(f["device"], f["inode"]): f for f in files if f["inode"] is not None}
+    sizes = {f["size"] for f in files if f["hash"] is not None}
+    candidates = []
+
+    for entry in iter_files(search_root):
+        # files can vanish or turn unreadable mid-walk
+        try:
+            stat = entry.stat()
+        except OSError:
+            continue
+
+        f = by_inode.get((stat.st_dev, stat.st_ino))
+
+        if f and f["id"] in pending:
+            crud.file.update(conn, f["id"], Path(entry.path), stat.st_ino, stat.st_dev)
+            pending.discard(f["id"])
+
+            if not pending:
+                return []
+
+        elif stat.st_size in sizes:
+            candidates.append((entry.path, stat))
+
+    wanted = [f for f in files if f["id"] in pending and f["hash"] is not None]
+    for f, path, stat in _match_content(conn, wanted, candidates, workers):
+        crud.file.update(conn, f["id"], Path(path), stat.st_ino, stat.st_dev)
+        pending.discard(f["id"])
+
+    return [f for f in files if f["id"] in pending]
+
+
+def _match_content(
+    conn: Connection,
+    wanted: list[Row],
+    candidates: list[tuple[str, os.stat_result]],
+    workers: int | None,
+) -> Generator[tuple[Row, str, os.stat_result]]:
+    """Pairs fingerprinted records with untracked candidate files of the same
+    content. Only candidates that pass the size and partial hash filters get
+    a full hash."""
+    sizes = {f["size"] for f in wanted}
+    candidates = [
+        (str(Path(p).resolve()), st) for p, st in candidates if st.st_size in sizes
+    ]
+
+    # a file that's tracked already isn't some other record's lost file
+    tracked = {
+        r["path"]
+        for r in crud.file.iter_many_by_unique_col(conn, (p for p, _ in candidates))
+    }
+    stats = {p: st for p, st in candidates if p not in tracked}
+
+    partials = {f["partial_hash"] for f in wanted}
+    partial_matches = [
+        path
+        for path, h in hashing.map_paths(hashing.safe_partial_hash, stats, workers)
+        if h in partials
+    ]
+
+    by_hash = defaultdict(list)
+    for f in wanted:
+        by_hash[f["hash"]].append(f)
+
+    for path, h in hashing.map_paths(hashing.safe_full_hash, partial_matches, workers):
+        if by_hash.get(h):
+            yield by_hash[h].pop(), path, stats[path]
@@ -1,13 +1,184 @@
+import codecs
+import json
+import os
 import re
-from itertools import chain
+from collections import deque
+from concurrent.futures import Executor, Future
+from fnmatch import fnmatchcase
+from itertools import chain, islice
 from pathlib import Path
-from typing import Generator
+from typing import Any, BinaryIO, Callable, Generator, Iterable
 
 import click
 
 flatten = chain.from_iterable
 
 
+def chunked(iterable: Iterable, size: int) -> Generator[list]:
+    """Splits an iterable into lists of at most `size` items."""
+    it = iter(iterable)
+    while chunk := list(islice(it, size)):
+        yield chunk
+
+
+def map_ahead(
+    pool: Executor, fn: Callable, iterable: Iterable, ahead: int
+) -> Generator[tuple[Any, Any]]:
+    """Like pool.map, yielding (item, fn(item)) in input order, but only keeps
+    `ahead` calls in flight, so the input is consumed lazily."""
+    pending: deque[tuple[Any, Future]] = deque()
+
+    for item in iterable:
+        pending.append((item, pool.submit(fn, item)))
+
+        if len(pending) >= ahead:
+            item, future = pending.popleft()
+            yield item, future.result()
+
+    for item, future in pending:
+        yield item, future.result()
+
+
+def iter_files(
+    root: Path, skip_dir: Callable[[os.DirEntry], bool] | None = None
+) -> Generator[os.DirEntry]:
+    """Walks a directory tree with os.scandir, yielding entries of files.
+
+    Listings tell directories apart without a stat, so entries can be stat'ed
+    lazily by the caller. Symlinked directories aren't followed and unreadable
+    directories are skipped, as are those `skip_dir` returns True for.
+    """
+    stack = [str(root)]
+    while stack:
+        try:
+            with os.scandir(stack.pop()) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False):
+                        if skip_dir is None or not skip_dir(entry):
+                            stack.append(entry.path)
+                    elif entry.is_file():
+                        yield entry
+        except OSError:
+            continue
+
+
+def iter_tree(
+    root: Path, include: Iterable[str] = (), exclude: Iterable[str] = ()
+) -> Generator[Path]:
+    """Streams paths of files under root, without listing the tree up front.
+
+    Globs match either the name or the path relative to root, so `*.mp3` and
+    `.git` apply at any depth and `live/*` only under root/live. With
+    `include`, files have to match one of them; files and directories
+    matching `exclude` are left out.
+    """
+    include, exclude = tuple(include), tuple(exclude)
+    start = len(str(root)) + 1
+
+    def matches(entry: os.DirEntry, patterns: tuple[str, ...]) -> bool:
+        rel = entry.path[start:]
+        return any(fnmatchcase(entry.name, p) or fnmatchcase(rel, p) for p in patterns)
+
+    for entry in iter_files(root, lambda e: matches(e, exclude)):
+        if include and not matches(entry, include):
+            continue
+        if not matches(entry, exclude):
+            yield Path(entry.path)
+
+
+def iter_json_members(
+    f: BinaryIO, chunk_size: int = 1 << 20, max_size: int = 1 << 26
+) -> Generator[tuple[str, Any]]:
+    """Incrementally reads a top-level JSON object from a binary file.
+
+    Yields (key, value) for each member. Array members are yielded one
+    (key, item) pair per item instead, so large arrays are never held in memory.
+    Only the item currently being decoded needs to fit in the buffer, and
+    items over `max_size` characters are rejected instead of read on until
+    the end of the file.
+    """
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder("utf-8")()
+    buf = ""
+    pos = 0
+    eof = False
+
+    def fill() -> bool:
+        nonlocal buf, pos, eof
+        if eof:
+            return False
+        data = f.read(chunk_size)
+        eof = not data
+        buf = buf[pos:] + utf8.decode(data, final=eof)
+        pos = 0
+        return True
+
+    def peek() -> str:
+        nonlocal pos
+        while True:
+            while pos < len(buf) and buf[pos].isspace():
+                pos += 1
+            if pos < len(buf):
+                return buf[pos]
+            if not fill():
+                raise ValueError("unexpected end of JSON input")
+
+    def expect(chars: str) -> str:
+        nonlocal pos
+        char = peek()
+        if char not in chars:
+            raise ValueError(f"expected one of {chars!r}, got {char!r}")
+        pos += 1
+        return char
+
+    def value() -> Any:
+        nonlocal pos
+        peek()
+        failed_at = None
+        while True:
+            try:
+                obj, end = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError as e:
+                # an error more input didn't move is in the input itself; only
+                # an unterminated string's is reported where the string starts
+                if e.pos - pos == failed_at and not e.msg.startswith("Unterminated"):
+                    raise
+                if len(buf) - pos > max_size:
+                    raise ValueError(f"JSON item over {max_size} characters") from e
+                failed_at = e.pos - pos
+                if fill():
+                    continue
+                raise
+            # a value ending at the buffer's edge may continue in the next chunk
+            if end == len(buf) and fill():
+                continue
+            pos = end
+            return obj
+
+    expect("{")
+    if peek() == "}":
+        return
+
+    while True:
+        key = value()
+        expect(":")
+
+        if peek() == "[":
+            pos += 1
+            if peek() == "]":
+                pos += 1
+            else:
+                while True:
+                    yield key, value()
+                    if expect(",]") == "]":
+                        break
+        else:
+            yield key, value()
+
+        if expect(",}") == "}":
+            return
+
+
 def compile_pattern(pattern: str, ignore_case: bool):
     if not pattern:
         return None
@@ -18,10 +189,10 @@ def compile_pattern(pattern: str, ignore_case: bool):
 
 
 def format_file_output(
-    files: dict, long: bool, relative_to: Path, prefix: str
+    files: Iterable[tuple[Path, dict]], long: bool, relative_to: Path, prefix: str
 ) -> Generator[str]:
     # TODO: the data flow / interface is a bit messy
-    for path, data in files.items():
+    for path, data in files:
         try:
             # relative path
             display_path = prefix / path.relative_to(relative_to.resolve())
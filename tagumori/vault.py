@@ -0,0 +1,119 @@
+from collections.abc import Iterable, Iterator
+from pathlib import Path
+from sqlite3 import Connection, Row
+
+from tagumori import crud, service
+from tagumori.db.connect import get_vault
+from tagumori.db.init import init_db
+from tagumori.query import plan
+from tagumori.query.executor import iter_ids
+from tagumori.query.planner import QueryPlan
+from tagumori.utils import chunked
+
+# how many file records are fetched per round trip when iterating results
+FETCH_SIZE = 500
+
+
+class PreparedQuery:
+    """A query that has been parsed and planned once, bound to a vault.
+
+    Results are evaluated on each call, so a prepared query can be reused
+    as the vault changes.
+    """
+
+    def __init__(self, conn: Connection, string: str, case: bool = True):
+        self._conn = conn
+        self.string = string
+        self.case = case
+        # empty query matches all files, same as `ls` without filters
+        self.plan: QueryPlan | None = plan(string) if string else None
+
+    def __repr__(self) -> str:
+        return f"PreparedQuery({self.string!r}, case={self.case})"
+
+    def ids(self) -> Iterator[int]:
+        """Streams ids of matching files, in order, from a cursor."""
+        if self.plan is None:
+            cursor = self._conn.execute("SELECT id FROM file ORDER BY id")
+            return (id_ for (id_,) in cursor)
+
+        # the whole plan runs as one statement, nothing is collected here
+        return iter_ids(self._conn, self.plan, self.case)
+
+    def iter(self) -> Iterator[Row]:
+        """Yields file records of matching files, fetched in batches."""
+        for chunk in chunked(self.ids(), FETCH_SIZE):
+            # records come back ordered by id, same as the chunk
+            yield from crud.file.get_many(self._conn, chunk)
+
+    def paths(self) -> Iterator[Path]:
+        return (Path(record["path"]) for record in self.iter())
+
+
+class Vault:
+    """Python interface to a vault.
+
+    Keeps a single connection open, along with prepared queries, so repeated
+    operations don't pay for reconnecting and re-parsing. Each modifying
+    method runs in its own transaction.
+    """
+
+    def __init__(self, path: Path | str):
+        self.path = Path(path)
+
+        if not self.path.exists():
+            raise FileNotFoundError(
+                f"{self.path} does not exist. Use Vault.create to initialize it."
+            )
+
+        self.conn = get_vault(self.path)
+        self._queries: dict[tuple[str, bool], PreparedQuery] = {}
+
+    @classmethod
+    def create(cls, path: Path | str) -> "Vault":
+        init_db(Path(path))
+        return cls(path)
+
+    def __enter__(self) -> "Vault":
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def compile(self, query: str, ignore_tag_case: bool = False) -> PreparedQuery:
+        key = (query, not ignore_tag_case)
+
+        if key not in self._queries:
+            self._queries[key] = PreparedQuery(self.conn, *key)
+
+        return self._queries[key]
+
+    def add(
+        self, files: Iterable[Path], tags: Iterable[str], apply_tagalongs: bool = True
+    ) -> None:
+        with self.conn:
+            service.add_tags_to_files(
+                self.conn, list(files), list(tags), apply_tagalongs
+            )
+
+    def remove(self, files: Iterable[Path], tags: Iterable[str]) -> int:
+        with self.conn:
+            return service.remove_tags_from_files(self.conn, list(files), list(tags))
+
+    def set(
+        self, files: Iterable[Path], tags: Iterable[str], apply_tagalongs: bool = True
+    ) -> None:
+        with self.conn:
+            service.set_tags_on_files(
+                self.conn, list(files), list(tags), apply_tagalongs
+            )
+
+    def drop(self, files: Iterable[Path], retain_file: bool = False) -> None:
+        with self.conn:
+            service.drop_file_tags(self.conn, list(files), retain_file)
+
+    def tags(self, files: Iterable[Path]) -> dict[Path, dict]:
+        return service.get_files_with_tags(self.conn, list(files))
@@ -0,0 +1,279 @@
+"""Watching directories for moves, renames and deletes of tracked files.
+
+Both watchers boil events down to the same batches: directory moves, which
+are applied to the vault as a single prefix update each, and directories
+whose files need a look (see service.sync_changes). A burst of events, such as
+a big directory being moved, becomes one batch and one transaction.
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import sys
+import time
+from collections.abc import Generator, Iterable
+from dataclasses import dataclass, field
+from pathlib import Path
+
+# from <sys/inotify.h>
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+
+WATCH_MASK = (
+    IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_ONLYDIR | IN_DONT_FOLLOW
+)
+
+EVENT = struct.Struct("iIII")
+
+# how long the event stream has to be quiet for a batch to end
+QUIET = 0.2
+
+
+@dataclass
+class Changes:
+    # (old, new) directory moves, in the order they happened
+    moves: list[tuple[str, str]] = field(default_factory=list)
+    # directories whose files should be looked at; may no longer exist
+    dirs: set[str] = field(default_factory=set)
+
+    def __bool__(self):
+        return bool(self.moves or self.dirs)
+
+    def move(self, old: str, new: str) -> None:
+        """Records a directory move, renaming already collected dirs too."""
+        self.moves.append((old, new))
+        self.dirs = {_rename(d, old, new) for d in self.dirs}
+
+
+def _is_under(path: str, root: str) -> bool:
+    return path == root or path.startswith(root + "/")
+
+
+def _rename(path: str, old: str, new: str) -> str:
+    return new + path[len(old) :] if _is_under(path, old) else path
+
+
+def iter_dirs(root: str) -> Generator[tuple[str, os.stat_result]]:
+    """Streams root and every directory under it with its stat. Symlinked
+    directories aren't followed and unreadable ones are skipped."""
+    try:
+        yield root, os.stat(root)
+    except OSError:
+        return
+
+    stack = [root]
+    while stack:
+        try:
+            with os.scandir(stack.pop()) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                        yield entry.path, entry.stat(follow_symlinks=False)
+        except OSError:
+            continue
+
+
+class PollingWatcher:
+    """Finds changes by comparing snapshots of directory stats.
+
+    A directory showing up with the inode of one that vanished was moved. Files
+    are only looked at in directories whose mtime changed.
+    """
+
+    def __init__(self, roots: Iterable[Path], interval: float = 2.0):
+        self.roots = [str(r) for r in roots]
+        self.interval = interval
+        self.snapshot = self._snapshot()
+
+    def _snapshot(self) -> dict[str, os.stat_result]:
+        return {path: st for root in self.roots for path, st in iter_dirs(root)}
+
+    def poll(self) -> Changes:
+        new = self._snapshot()
+        changes = diff_snapshots(self.snapshot, new)
+        self.snapshot = new
+        return changes
+
+    def batches(self) -> Generator[Changes]:
+        while True:
+            time.sleep(self.interval)
+            if changes := self.poll():
+                yield changes
+
+    def close(self):
+        pass
+
+
+def diff_snapshots(
+    old: dict[str, os.stat_result], new: dict[str, os.stat_result]
+) -> Changes:
+    changes = Changes()
+    gone = old.keys() - new.keys()
+    by_inode = {(old[p].st_dev, old[p].st_ino): p for p in gone}
+
+    # parents first, so moves of their subdirectories are recognized as such
+    for path in sorted(new.keys() - old.keys(), key=len):
+        src = by_inode.get((new[path].st_dev, new[path].st_ino))
+
+        if src is None:
+            changes.dirs.add(path)
+            continue
+
+        gone.discard(src)
+        if not any(_rename(src, o, n) == path for o, n in changes.moves):
+            changes.moves.append((src, path))
+
+        if old[src].st_mtime_ns != new[path].st_mtime_ns:
+            changes.dirs.add(path)
+
+    changes.dirs |= gone
+    changes.dirs |= {
+        p for p in old.keys() & new.keys() if old[p].st_mtime_ns != new[p].st_mtime_ns
+    }
+    return changes
+
+
+class InotifyWatcher:
+    """Linux inotify, through libc. Every directory under the roots gets a
+    watch, as inotify isn't recursive."""
+
+    def __init__(self, roots: Iterable[Path], interval: float = 2.0):
+        self.interval = interval
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+        self.paths: dict[int, str] = {}
+        try:
+            for root in roots:
+                self._watch_tree(str(root))
+        except OSError:
+            self.close()
+            raise
+
+    def _watch_tree(self, root: str) -> list[str]:
+        added = []
+        for path, _ in iter_dirs(root):
+            wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+            if wd < 0:
+                err = ctypes.get_errno()
+                # out of watches, see fs.inotify.max_user_watches
+                if err == errno.ENOSPC:
+                    raise OSError(err, os.strerror(err), path)
+                continue
+
+            self.paths[wd] = path
+            added.append(path)
+
+        return added
+
+    def _unwatch_tree(self, root: str) -> None:
+        for wd, path in list(self.paths.items()):
+            if _is_under(path, root):
+                self._libc.inotify_rm_watch(self.fd, wd)
+                del self.paths[wd]
+
+    def _read(self, timeout: float | None) -> list[tuple[int, int, int, str]]:
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+
+        data = os.read(self.fd, 1 << 20)
+        events = []
+        pos = 0
+        while pos < len(data):
+            wd, mask, cookie, length = EVENT.unpack_from(data, pos)
+            pos += EVENT.size
+            name = os.fsdecode(data[pos : pos + length].rstrip(b"\0"))
+            pos += length
+            events.append((wd, mask, cookie, name))
+
+        return events
+
+    def batches(self) -> Generator[Changes]:
+        while True:
+            events = self._read(None)
+
+            # keep collecting until things calm down, but not forever
+            deadline = time.monotonic() + self.interval
+            while time.monotonic() < deadline and (more := self._read(QUIET)):
+                events += more
+
+            if changes := self.to_changes(events):
+                yield changes
+
+    def to_changes(self, events: list[tuple[int, int, int, str]]) -> Changes:
+        changes = Changes()
+        moved_from: dict[int, str] = {}
+
+        for wd, mask, cookie, name in events:
+            if mask & IN_Q_OVERFLOW:
+                # events were lost, so everything needs a look
+                changes.dirs |= set(self.paths.values())
+                continue
+
+            if mask & IN_IGNORED:
+                self.paths.pop(wd, None)
+                continue
+
+            if wd not in self.paths:
+                continue
+
+            parent = self.paths[wd]
+            path = os.path.join(parent, name)
+
+            if not mask & IN_ISDIR:
+                changes.dirs.add(parent)
+
+            elif mask & IN_MOVED_FROM:
+                moved_from[cookie] = path
+
+            elif mask & IN_MOVED_TO and cookie in moved_from:
+                old = moved_from.pop(cookie)
+                changes.move(old, path)
+                for w, p in self.paths.items():
+                    self.paths[w] = _rename(p, old, path)
+
+            elif mask & (IN_MOVED_TO | IN_CREATE):
+                # new to us: files in it may have been moved in from elsewhere
+                changes.dirs |= set(self._watch_tree(path))
+
+            elif mask & IN_DELETE:
+                changes.dirs.add(path)
+
+        # moved somewhere we don't watch
+        for path in moved_from.values():
+            self._unwatch_tree(path)
+            changes.dirs.add(path)
+
+        return changes
+
+    def close(self):
+        os.close(self.fd)
+
+
+def watcher(
+    roots: Iterable[Path], poll: bool = False, interval: float = 2.0
+) -> InotifyWatcher | PollingWatcher:
+    """Inotify where available, polling otherwise."""
+    if not poll and sys.platform.startswith("linux"):
+        try:
+            return InotifyWatcher(roots, interval)
+        except (OSError, AttributeError):
+            # AttributeError: libc without inotify
+            pass
+
+    return PollingWatcher(roots, interval)
@@ -164,3 +164,39 @@ class TestInfo:
         assert "file:" in result.output
         assert "tag:" in result.output
         assert "file_tag:" in result.output
+
+
+class TestMigrateJson:
+    def test_migrate_json(self, runner, vault, sample_files, tmp_path):
+        import json
+
+        a, b = sample_files
+        legacy = tmp_path / "legacy.json"
+        legacy.write_text(
+            json.dumps(
+                {
+                    "entries": [
+                        {
+                            "name": str(a),
+                            "children": [
+                                {"name": "genre", "children": [{"name": "rock"}]}
+                            ],
+                        },
+                        {"name": str(b), "children": [{"name": "jazz"}]},
+                    ],
+                    "tagalongs": [["rock", "guitar"]],
+                }
+            )
+        )
+
+        result = runner.invoke(
+            cli,
+            ["--vault", str(vault), "db", "migrate-json", str(legacy)]
+            + ["--batch-size", "1"],
+        )
+
+        assert result.exit_code == 0
+        assert "Migrated 2 entries." in result.output
+
+        info = runner.invoke(cli, ["--vault", str(vault), "file", "info", str(a)])
+        assert "genre[guitar,rock]" in info.output
@@ -541,6 +541,113 @@ class TestFileCheck:
         result = runner.invoke(cli, ["--vault", str(vault), "file", "check"])
         assert "No issues found" in result.output
 
+    def test_check_fix_in_batches(self, runner, vault, tmp_path):
+        import sqlite3
+
+        files = [tmp_path / f"{i}.txt" for i in range(5)]
+        for f in files:
+            f.touch()
+        runner.invoke(cli, ["--vault", str(vault), "file", "add", *map(str, files)])
+
+        conn = sqlite3.connect(vault)
+        conn.execute("UPDATE file SET inode = NULL, device = NULL")
+        conn.commit()
+        conn.close()
+
+        result = runner.invoke(
+            cli,
+            [
+                "--vault",
+                str(vault),
+                "file",
+                "check",
+                "--fix",
+                "--batch-size",
+                "2",
+                "-j",
+                "3",
+            ],
+        )
+
+        assert result.output.count("(fixed)") == 5
+        assert "Checked 5 files" in result.output
+
+        result = runner.invoke(cli, ["--vault", str(vault), "file", "check"])
+        assert "No issues found" in result.output
+
+    def test_check_fix_across_pages(self, runner, vault, tmp_path, monkeypatch):
+        import sqlite3
+        import sys
+
+        files = [tmp_path / f"{i}.txt" for i in range(5)]
+        for f in files:
+            f.touch()
+        runner.invoke(cli, ["--vault", str(vault), "file", "add", *map(str, files)])
+
+        conn = sqlite3.connect(vault)
+        conn.execute("UPDATE file SET inode = NULL, device = NULL")
+        conn.commit()
+        conn.close()
+
+        # fixed files drop out of the unchecked ones while they're being paged
+        monkeypatch.setattr(sys.modules["tagumori.crud.file"], "PAGE_SIZE", 2)
+        check = ["--vault", str(vault), "file", "check", "--incremental"]
+        result = runner.invoke(cli, [*check, "--fix", "--batch-size", "1"])
+
+        assert all(result.output.count(f"{f}  ") == 1 for f in files)
+        assert result.output.count("(fixed)") == 5
+
+        result = runner.invoke(cli, ["--vault", str(vault), "file", "check"])
+        assert "No issues found" in result.output
+
+    def test_check_incremental(self, runner, vault, tmp_path):
+        import sqlite3
+
+        a, b = tmp_path / "a", tmp_path / "b"
+        files = [a / "1.txt", a / "2.txt", b / "3.txt"]
+        for f in files:
+            f.parent.mkdir(exist_ok=True)
+            f.write_text("x")
+        runner.invoke(cli, ["--vault", str(vault), "file", "add", *map(str, files)])
+
+        check = ["--vault", str(vault), "file", "check", "--incremental"]
+        result = runner.invoke(cli, check)
+        assert "Checked 3 files" in result.output
+
+        # last seen stats are stored
+        conn = sqlite3.connect(vault)
+        sizes = conn.execute("SELECT DISTINCT size FROM file").fetchall()
+        assert sizes == [(1,)]
+        conn.close()
+
+        result = runner.invoke(cli, check)
+        assert "Checked 0 files" in result.output
+
+        # only the directory that changed is looked into, until it's healthy
+        files[0].unlink()
+        for _ in range(2):
+            result = runner.invoke(cli, check)
+            assert "Checked 2 files" in result.output
+            assert "NOT FOUND" in result.output
+
+        # a full check still looks at everything
+        result = runner.invoke(cli, ["--vault", str(vault), "file", "check"])
+        assert "Checked 3 files" in result.output
+
+
+class TestFileDupes:
+    def test_hash_and_dupes(self, runner, vault, tmp_path):
+        files = [tmp_path / name for name in ("a.txt", "b.txt", "c.txt")]
+        for f, content in zip(files, ["same", "same", "other"]):
+            f.write_text(content)
+        runner.invoke(cli, ["--vault", str(vault), "file", "add", *map(str, files)])
+
+        result = runner.invoke(cli, ["--vault", str(vault), "file", "hash", "-j", "2"])
+        assert "Hashed 3 file(s)" in result.output
+
+        result = runner.invoke(cli, ["--vault", str(vault), "file", "dupes"])
+        assert result.output.split() == [str(files[0]), str(files[1])]
+
 
 class TestFileMv:
     def test_mv_single_file(self, runner, vault, tagged_file, tmp_path):
@@ -792,3 +899,56 @@ class TestFileMv:
 
         assert result.exit_code == 0
         assert dst.exists()
+
+    def test_mv_directory(self, runner, vault, tmp_path):
+        """A directory is moved once, with its tracked files and their tags."""
+        src = tmp_path / "music"
+        (src / "live").mkdir(parents=True)
+        for name in ("a.mp3", "live/b.mp3"):
+            (src / name).touch()
+        runner.invoke(cli, ["--vault", str(vault), "add", "-r", str(src), "-t", "rock"])
+        dst = tmp_path / "archive"
+        dst.mkdir()
+
+        result = runner.invoke(
+            cli, ["--vault", str(vault), "file", "mv", str(src), "-t", str(dst)]
+        )
+
+        assert result.exit_code == 0
+        assert "(2 tracked files)" in result.output
+        assert not src.exists()
+
+        result = runner.invoke(cli, ["--vault", str(vault), "ls", "-s", "rock"])
+        assert result.output.split() == [
+            str(dst / "music" / "a.mp3"),
+            str(dst / "music" / "live" / "b.mp3"),
+        ]
+
+    def test_mv_directory_into_itself_fails(self, runner, vault, tmp_path):
+        src = tmp_path / "music"
+        src.mkdir()
+        (src / "a.mp3").touch()
+        runner.invoke(cli, ["--vault", str(vault), "file", "add", str(src / "a.mp3")])
+
+        result = runner.invoke(
+            cli, ["--vault", str(vault), "file", "mv", str(src), "-t", str(src / "x")]
+        )
+
+        assert result.exit_code != 0
+        assert "into itself" in result.output
+        assert (src / "a.mp3").exists()
+
+    def test_mv_directory_onto_existing_fails(self, runner, vault, tmp_path):
+        src, taken = tmp_path / "music", tmp_path / "taken"
+        for d in (src, taken / "music"):
+            d.mkdir(parents=True)
+        (src / "a.mp3").touch()
+        runner.invoke(cli, ["--vault", str(vault), "file", "add", str(src / "a.mp3")])
+
+        result = runner.invoke(
+            cli, ["--vault", str(vault), "file", "mv", str(src), "-t", str(taken)]
+        )
+
+        assert result.exit_code != 0
+        assert "already exists" in result.output
+        assert (src / "a.mp3").exists()
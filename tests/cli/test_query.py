@@ -156,6 +156,20 @@ class TestRun:
         assert (output_dir / "rock-files").exists()
         assert str(tagged_file) in (output_dir / "rock-files").read_text()
 
+    def test_run_under(self, runner, vault, tagged_file, tmp_path):
+        other = tmp_path / "other"
+        other.mkdir()
+        base = ["--vault", str(vault), "query"]
+        runner.invoke(cli, [*base, "save", "here", "-s", "rock"])
+        runner.invoke(
+            cli, [*base, "save", "there", "-s", "rock", "--under", str(other)]
+        )
+
+        result = runner.invoke(cli, [*base, "run"])
+
+        assert result.exit_code == 0
+        assert result.output.split() == ["[here]", str(tagged_file), "[there]"]
+
     def test_run_nonexistent_query_silent(self, runner, vault):
         result = runner.invoke(
             cli, ["--vault", str(vault), "query", "run", "nonexistent"]
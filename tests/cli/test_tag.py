@@ -140,3 +140,30 @@ class TestTagCommands:
         )
 
         assert result.exit_code == 0
+
+    def test_tag_replace_pattern(self, runner, vault, sample_file):
+        runner.invoke(
+            cli,
+            ["--vault", str(vault), "add", "-f", str(sample_file), "-t", "Rock,rock"],
+        )
+
+        result = runner.invoke(
+            cli,
+            ["--vault", str(vault), "tag", "replace", "-p", "^rock$", "-i"]
+            + ["-n", "rock music"],
+        )
+
+        assert result.exit_code == 0
+        assert "Merged 1 colliding tag(s)." in result.output
+
+        info = runner.invoke(
+            cli, ["--vault", str(vault), "file", "info", str(sample_file)]
+        )
+        assert "Tags: rock music" in info.output
+
+    def test_tag_replace_requires_sources(self, runner, vault):
+        result = runner.invoke(
+            cli, ["--vault", str(vault), "tag", "replace", "-n", "jazz"]
+        )
+
+        assert result.exit_code != 0
@@ -23,6 +23,60 @@ class TestTagalongCommands:
         assert "guitar" in result.output
         assert "->" in result.output
 
+    def test_tagalong_remove_retracts(self, runner, vault, tagged_file):
+        runner.invoke(
+            cli,
+            ["--vault", str(vault), "tagalong", "add", "-t", "rock", "-ta", "guitar"],
+        )
+
+        result = runner.invoke(
+            cli,
+            [
+                "--vault",
+                str(vault),
+                "tagalong",
+                "remove",
+                "-t",
+                "rock",
+                "-ta",
+                "guitar",
+            ],
+        )
+
+        assert "Retracted 1 implied tag(s)." in result.output
+        show_result = runner.invoke(
+            cli, ["--vault", str(vault), "file", "info", str(tagged_file)]
+        )
+        assert "guitar" not in show_result.output
+
+    def test_tagalong_ls_stats(self, runner, vault):
+        runner.invoke(
+            cli,
+            ["--vault", str(vault), "tagalong", "add", "-t", "rock", "-ta", "guitar"],
+        )
+        runner.invoke(
+            cli,
+            [
+                "--vault",
+                str(vault),
+                "tagalong",
+                "add",
+                "-t",
+                "guitar",
+                "-ta",
+                "strings",
+            ],
+        )
+
+        result = runner.invoke(
+            cli, ["--vault", str(vault), "tagalong", "ls", "--stats"]
+        )
+
+        assert result.exit_code == 0
+        assert "Rules: 2" in result.output
+        assert "Implied pairs: 3" in result.output
+        assert "Most implied by one tag: 2" in result.output
+
     def test_tagalong_remove(self, runner, vault):
         runner.invoke(
             cli,
@@ -80,3 +134,102 @@ class TestTagalongCommands:
             cli, ["--vault", str(vault), "file", "info", str(sample_file)]
         )
         assert "guitar" in show_result.output
+
+    def test_tagalong_add_applies_to_tagged_files(self, runner, vault, tagged_file):
+        runner.invoke(
+            cli,
+            ["--vault", str(vault), "tagalong", "add", "-t", "rock", "-ta", "guitar"],
+        )
+
+        show_result = runner.invoke(
+            cli, ["--vault", str(vault), "file", "info", str(tagged_file)]
+        )
+        assert "guitar" in show_result.output
+
+    def test_tagalong_add_no_apply(self, runner, vault, tagged_file):
+        runner.invoke(
+            cli,
+            ["--vault", str(vault), "tagalong", "add", "-t", "rock", "-ta", "guitar"]
+            + ["--no-apply"],
+        )
+
+        show_result = runner.invoke(
+            cli, ["--vault", str(vault), "file", "info", str(tagged_file)]
+        )
+        assert "guitar" not in show_result.output
+
+    def test_tagalong_apply_by_tag(self, runner, vault, sample_file):
+        for source, target in [("rock", "guitar"), ("jazz", "sax")]:
+            runner.invoke(
+                cli,
+                ["--vault", str(vault), "tagalong", "add", "-t", source, "-ta", target],
+            )
+        runner.invoke(
+            cli,
+            ["--vault", str(vault), "add", "-f", str(sample_file), "-t", "rock,jazz"]
+            + ["--no-tagalongs"],
+        )
+
+        result = runner.invoke(
+            cli, ["--vault", str(vault), "tagalong", "apply", "-t", "rock"]
+        )
+
+        assert result.exit_code == 0
+        show_result = runner.invoke(
+            cli, ["--vault", str(vault), "file", "info", str(sample_file)]
+        )
+        assert "guitar" in show_result.output
+        assert "sax" not in show_result.output
+
+    def test_tagalong_auto(self, runner, vault, sample_file):
+        runner.invoke(
+            cli,
+            ["--vault", str(vault), "tagalong", "add", "-t", "rock", "-ta", "guitar"],
+        )
+        result = runner.invoke(cli, ["--vault", str(vault), "tagalong", "auto", "--on"])
+        assert "Automatic tagalongs: on" in result.output
+
+        # import applies tagalongs unless told not to; the trigger still does
+        manifest = sample_file.with_suffix(".jsonl")
+        manifest.write_text(f'{{"path": "{sample_file}", "tags": ["rock"]}}')
+        runner.invoke(
+            cli, ["--vault", str(vault), "import", str(manifest), "--no-tagalongs"]
+        )
+
+        info = runner.invoke(
+            cli, ["--vault", str(vault), "file", "info", str(sample_file)]
+        )
+        assert "guitar" in info.output
+
+        result = runner.invoke(
+            cli, ["--vault", str(vault), "tagalong", "auto", "--off"]
+        )
+        assert "Automatic tagalongs: off" in result.output
+
+    def test_tagalong_virtual(self, runner, vault, sample_file):
+        runner.invoke(
+            cli,
+            ["--vault", str(vault), "tagalong", "add", "-t", "rock", "-ta", "guitar"],
+        )
+        runner.invoke(
+            cli, ["--vault", str(vault), "add", "-f", str(sample_file), "-t", "rock"]
+        )
+
+        result = runner.invoke(
+            cli, ["--vault", str(vault), "tagalong", "virtual", "--on"]
+        )
+        assert "Dropped 1 stored implied tag(s)." in result.output
+        assert "Virtual tagalongs: on" in result.output
+
+        # not stored, but still found and shown
+        ls = runner.invoke(cli, ["--vault", str(vault), "ls", "-s", "guitar", "-l"])
+        assert sample_file.name in ls.output
+        assert "guitar" in ls.output
+
+        result = runner.invoke(cli, ["--vault", str(vault), "tagalong", "auto", "--on"])
+        assert result.exit_code != 0
+
+        result = runner.invoke(
+            cli, ["--vault", str(vault), "tagalong", "virtual", "--off"]
+        )
+        assert "Virtual tagalongs: off" in result.output
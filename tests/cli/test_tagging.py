@@ -1,3 +1,5 @@
+import pytest
+
 from tagumori.cli import cli
 
 
@@ -74,6 +76,7 @@ class TestRemove:
         )
 
         assert result.exit_code == 0
+        assert "Removed 1 tag(s)." in result.output
 
 
 class TestSet:
@@ -91,6 +94,92 @@ class TestSet:
         assert "jazz" in show_result.output
 
 
+class TestRecursive:
+    @pytest.fixture
+    def tree(self, tmp_path):
+        (tmp_path / "music" / "live").mkdir(parents=True)
+        files = ["music/a.mp3", "music/b.txt", "music/live/c.mp3"]
+        for name in files:
+            (tmp_path / name).touch()
+        return tmp_path / "music"
+
+    def _ls(self, runner, vault, tree, *args):
+        result = runner.invoke(
+            cli,
+            ["--vault", str(vault), "ls", "--relative-to", str(tree), *args],
+        )
+        return sorted(result.output.split())
+
+    def test_add_walks_directory(self, runner, vault, tree):
+        result = runner.invoke(
+            cli,
+            ["--vault", str(vault), "add", "-r", str(tree), "-t", "rock"],
+            catch_exceptions=False,
+        )
+
+        assert result.exit_code == 0
+        assert self._ls(runner, vault, tree, "-s", "rock") == [
+            "a.mp3",
+            "b.txt",
+            "live/c.mp3",
+        ]
+
+    def test_globs_and_batches(self, runner, vault, tree):
+        args = ["--vault", str(vault), "add", "-r", str(tree), "-t", "rock"]
+        result = runner.invoke(
+            cli, [*args, "--include", "*.mp3", "--exclude", "live", "--batch-size", "1"]
+        )
+
+        assert result.exit_code == 0
+        assert self._ls(runner, vault, tree, "-s", "rock") == ["a.mp3"]
+
+    def test_set_and_remove(self, runner, vault, tree):
+        base = ["--vault", str(vault)]
+        runner.invoke(cli, [*base, "add", "-r", str(tree), "-t", "rock"])
+        runner.invoke(cli, [*base, "set", "-r", str(tree / "live"), "-t", "jazz"])
+
+        result = runner.invoke(
+            cli, [*base, "remove", "-r", str(tree), "-t", "rock", "--batch-size", "1"]
+        )
+
+        assert result.exit_code == 0
+        assert "Removed 2 tag(s)." in result.output
+        assert self._ls(runner, vault, tree, "-s", "jazz") == ["live/c.mp3"]
+
+    def test_ls_under(self, runner, vault, tree):
+        base = ["--vault", str(vault)]
+        runner.invoke(cli, [*base, "add", "-r", str(tree), "-t", "rock"])
+        runner.invoke(cli, [*base, "add", "-r", str(tree / "live"), "-t", "jazz"])
+        under = ["--under", str(tree / "live")]
+
+        assert self._ls(runner, vault, tree, *under) == ["live/c.mp3"]
+        assert self._ls(runner, vault, tree, *under, "-s", "rock") == ["live/c.mp3"]
+        assert self._ls(runner, vault, tree, *under, "-e", "jazz") == []
+        assert self._ls(runner, vault, tree, "--under", str(tree.parent)) == [
+            "a.mp3",
+            "b.txt",
+            "live/c.mp3",
+        ]
+
+    def test_skips_vault_in_tree(self, runner, tree):
+        vault = tree / "vault.db"
+        runner.invoke(cli, ["db", "init", str(vault)])
+        (tree / "vault.db-journal").touch()
+
+        result = runner.invoke(
+            cli, ["--vault", str(vault), "add", "-r", str(tree), "-t", "rock"]
+        )
+
+        assert result.exit_code == 0
+        assert self._ls(runner, vault, tree) == ["a.mp3", "b.txt", "live/c.mp3"]
+
+    def test_requires_files_or_dirs(self, runner, vault):
+        result = runner.invoke(cli, ["--vault", str(vault), "set", "-t", "rock"])
+
+        assert result.exit_code != 0
+        assert "-f" in result.output
+
+
 class TestDrop:
     def test_drop_removes_all_tags(self, runner, vault, tagged_file):
         result = runner.invoke(
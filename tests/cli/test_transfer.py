@@ -0,0 +1,173 @@
+import json
+
+from tagumori.cli import cli
+
+
+def _info(runner, vault, path):
+    return runner.invoke(cli, ["--vault", str(vault), "file", "info", str(path)])
+
+
+class TestImport:
+    def test_import_jsonl(self, runner, vault, sample_files, tmp_path):
+        a, b = sample_files
+        manifest = tmp_path / "manifest.jsonl"
+        manifest.write_text(
+            json.dumps({"path": str(a), "tags": ["rock", "artist[Queen]"]})
+            + "\n\n"
+            + json.dumps({"path": str(b), "tags": "jazz"})
+            + "\n"
+        )
+
+        result = runner.invoke(cli, ["--vault", str(vault), "import", str(manifest)])
+
+        assert result.exit_code == 0
+        assert "Imported 2 records." in result.output
+        assert "artist[Queen],rock" in _info(runner, vault, a).output
+        assert "jazz" in _info(runner, vault, b).output
+
+    def test_import_csv(self, runner, vault, sample_files, tmp_path):
+        a, b = sample_files
+        manifest = tmp_path / "manifest.csv"
+        manifest.write_text(f'path,tags\n{a},"genre[rock,pop]"\n{b},\n')
+
+        result = runner.invoke(cli, ["--vault", str(vault), "import", str(manifest)])
+
+        assert result.exit_code == 0
+        assert "genre[pop,rock]" in _info(runner, vault, a).output
+        assert "Not found" not in _info(runner, vault, b).output
+
+    def test_import_small_batches(self, runner, vault, tmp_path):
+        manifest = tmp_path / "manifest.jsonl"
+        lines = [json.dumps({"path": f"f{i}", "tags": [f"t{i}"]}) for i in range(5)]
+        manifest.write_text("\n".join(lines))
+
+        result = runner.invoke(
+            cli,
+            ["--vault", str(vault), "import", str(manifest), "--batch-size", "2"],
+        )
+
+        assert result.exit_code == 0
+        assert "Imported 5 records." in result.output
+
+    def test_import_applies_tagalongs(self, runner, vault, sample_file, tmp_path):
+        runner.invoke(
+            cli,
+            ["--vault", str(vault), "tagalong", "add", "-t", "rock", "-ta", "guitar"],
+        )
+        manifest = tmp_path / "manifest.jsonl"
+        manifest.write_text(json.dumps({"path": str(sample_file), "tags": ["rock"]}))
+
+        runner.invoke(cli, ["--vault", str(vault), "import", str(manifest)])
+
+        assert "guitar" in _info(runner, vault, sample_file).output
+
+    def test_import_bad_record_fails(self, runner, vault, tmp_path):
+        manifest = tmp_path / "manifest.jsonl"
+        manifest.write_text('{"tags": ["rock"]}\n')
+
+        result = runner.invoke(cli, ["--vault", str(vault), "import", str(manifest)])
+
+        assert result.exit_code != 0
+        assert "manifest.jsonl:1" in result.output
+
+    def test_import_bad_tagalong_fails(self, runner, vault, tmp_path):
+        manifest = tmp_path / "manifest.jsonl"
+        manifest.write_text('{"type": "tagalong", "tag": "rock"}\n')
+
+        result = runner.invoke(cli, ["--vault", str(vault), "import", str(manifest)])
+
+        assert result.exit_code != 0
+        assert "manifest.jsonl:1" in result.output
+
+
+def _export(runner, vault, *args):
+    result = runner.invoke(cli, ["--vault", str(vault), "export", *args])
+    assert result.exit_code == 0
+    return [json.loads(line) for line in result.stdout.splitlines()]
+
+
+class TestExport:
+    def test_export_files_and_tags(self, runner, vault, sample_files):
+        a, b = sample_files
+        runner.invoke(
+            cli,
+            ["--vault", str(vault), "add", "-f", str(a), "-t", "rock,artist[Queen]"],
+        )
+        runner.invoke(cli, ["--vault", str(vault), "add", "-f", str(b), "-t", "jazz"])
+
+        records = _export(runner, vault)
+        files = {r["path"]: r["tags"] for r in records if r["type"] == "file"}
+
+        assert files == {
+            str(a.resolve()): ["artist[Queen]", "rock"],
+            str(b.resolve()): ["jazz"],
+        }
+        assert records[-1]["type"] == "checkpoint"
+
+    def test_export_tagalongs_and_queries(self, runner, vault):
+        runner.invoke(
+            cli,
+            ["--vault", str(vault), "tagalong", "add", "-t", "rock", "-ta", "guitar"],
+        )
+        runner.invoke(cli, ["--vault", str(vault), "query", "save", "q", "-s", "rock"])
+
+        records = _export(runner, vault)
+
+        assert {"type": "tagalong", "tag": "rock", "tagalong": "guitar"} in records
+        (query,) = [r for r in records if r["type"] == "query"]
+        assert query["name"] == "q"
+        assert query["select_tags"] == ["rock"]
+
+    def test_export_since_checkpoint(self, runner, vault, sample_files):
+        a, b = sample_files
+        runner.invoke(cli, ["--vault", str(vault), "add", "-f", str(a), "-t", "rock"])
+        checkpoint = _export(runner, vault)[-1]["since"]
+
+        runner.invoke(cli, ["--vault", str(vault), "add", "-f", str(b), "-t", "jazz"])
+        records = _export(runner, vault, "--since", str(checkpoint))
+
+        paths = [r["path"] for r in records if r["type"] == "file"]
+        assert paths == [str(b.resolve())]
+        assert records[-1]["since"] > checkpoint
+
+    def test_export_since_misses_deletions(self, runner, vault, sample_files):
+        """Incremental exports only cover additions and changes."""
+        a, b = sample_files
+        base = ["--vault", str(vault)]
+        runner.invoke(cli, [*base, "add", "-f", str(a), "-f", str(b), "-t", "rock,pop"])
+        checkpoint = _export(runner, vault)[-1]["since"]
+
+        runner.invoke(cli, [*base, "remove", "-f", str(a), "-t", "pop"])
+        runner.invoke(cli, [*base, "file", "drop", str(b)], input="y\n")
+        records = _export(runner, vault, "--since", str(checkpoint))
+
+        files = {r["path"]: r["tags"] for r in records if r["type"] == "file"}
+        assert files == {str(a.resolve()): ["rock"]}
+
+    def test_export_roundtrip(self, runner, vault, tmp_path, sample_files):
+        a, _ = sample_files
+        runner.invoke(
+            cli,
+            ["--vault", str(vault), "add", "-f", str(a), "-t", "genre[rock,pop]"],
+        )
+        runner.invoke(
+            cli,
+            ["--vault", str(vault), "tagalong", "add", "-t", "rock", "-ta", "guitar"],
+        )
+        runner.invoke(
+            cli, ["--vault", str(vault), "query", "save", "q", "-s", "rock", "-i"]
+        )
+        dump = tmp_path / "dump.jsonl"
+        runner.invoke(cli, ["--vault", str(vault), "export", str(dump)])
+
+        other = tmp_path / "other.db"
+        runner.invoke(cli, ["db", "init", str(other)])
+        result = runner.invoke(cli, ["--vault", str(other), "import", str(dump)])
+
+        assert result.exit_code == 0
+        assert "Imported 1 records." in result.output
+        assert "Imported 2 tagalongs and queries." in result.output
+        assert "genre[guitar,pop,rock]" in _info(runner, other, a).output
+
+        # tagalongs and queries come back as they were
+        assert _export(runner, other)[1:-1] == _export(runner, vault)[1:-1]
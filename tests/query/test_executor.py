@@ -1,8 +1,10 @@
 from pathlib import Path
 
+import pytest
+
 from tagumori import crud
-from tagumori.query import search
-from tagumori.query.executor import execute, find_all
+from tagumori.query import plan, search
+from tagumori.query.executor import execute, find_all, iter_ids
 from tagumori.query.planner import (
     QP_And,
     QP_Not,
@@ -238,3 +240,89 @@ class TestSearchEndToEnd:
     def test_case_insensitive(self, conn):
         fid = make_file(conn, "song.mp3", [("Rock",)])
         assert search(conn, "rock", case=False) == {fid}
+
+
+class TestVirtualTagalongs:
+    def _rule(self, conn, source, target):
+        s = crud.tag.get_or_create(conn, source)
+        t = crud.tag.get_or_create(conn, target)
+        crud.tagalong.create(conn, s["id"], t["id"])
+
+    def test_implied_tag_found_through_source(self, conn):
+        self._rule(conn, "Led Zeppelin", "rock")
+        crud.tagalong.set_virtual(conn, True)
+        fid = make_file(conn, "a.mp3", [("artist", "Led Zeppelin")])
+
+        assert search(conn, "artist[rock]") == {fid}
+        assert search(conn, "~[rock]") == set()
+
+    def test_materialized_ignores_closure(self, conn):
+        self._rule(conn, "Led Zeppelin", "rock")
+        make_file(conn, "a.mp3", [("Led Zeppelin",)])
+
+        assert search(conn, "rock") == set()
+
+    def test_implied_tag_is_a_leaf(self, conn):
+        self._rule(conn, "Led Zeppelin", "rock")
+        crud.tagalong.set_virtual(conn, True)
+        fid = make_file(conn, "a.mp3", [("Led Zeppelin", "live")])
+
+        assert search(conn, "rock[~]") == {fid}
+        assert search(conn, "Led Zeppelin[~]") == set()
+
+    def test_transitive_and_case_insensitive(self, conn):
+        self._rule(conn, "Led Zeppelin", "rock")
+        self._rule(conn, "rock", "music")
+        crud.tagalong.set_virtual(conn, True)
+        fid = make_file(conn, "a.mp3", [("Led Zeppelin",)])
+
+        assert search(conn, "MUSIC", case=False) == {fid}
+        assert search(conn, "!music") == set()
+
+    def test_implied_operands_pruned(self, conn):
+        self._rule(conn, "Led Zeppelin", "rock")
+        crud.tagalong.set_virtual(conn, True)
+        fid = make_file(conn, "a.mp3", [("Led Zeppelin",)])
+        make_file(conn, "b.mp3", [("rock",)])
+
+        assert search(conn, "rock,Led Zeppelin") == {fid}
+        assert search(conn, "Led Zeppelin,!rock") == set()
+
+
+class TestIterIds:
+    QUERIES = [
+        "rock",
+        "rock,jazz",
+        "rock|jazz",
+        "!rock",
+        "rock^jazz^blues",
+        "xor(rock, jazz, blues)",
+        "genre[*]",
+        "(rock|blues),!jazz",
+        "genre[!rock]",
+        "~",
+        "nope",
+    ]
+
+    def _setup(self, conn):
+        make_file(conn, "/music/a.mp3", [("rock",)])
+        make_file(conn, "/music/live/b.mp3", [("jazz",), ("blues",)])
+        make_file(conn, "/music/live/c.mp3", [("rock",), ("jazz",), ("blues",)])
+        make_file(conn, "/other/d.mp3", [("genre", "rock")])
+
+    @pytest.mark.parametrize("query", QUERIES)
+    def test_same_as_execute(self, conn, query):
+        self._setup(conn)
+        qp = plan(query)
+
+        assert list(iter_ids(conn, qp)) == sorted(execute(conn, qp))
+
+    @pytest.mark.parametrize("query", QUERIES)
+    def test_same_as_execute_under(self, conn, query):
+        self._setup(conn)
+        qp = plan(query)
+        under = crud.directory.get_id(conn, "/music")
+
+        assert list(iter_ids(conn, qp, under=under)) == sorted(
+            execute(conn, qp, under=under)
+        )
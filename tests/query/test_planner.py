@@ -14,6 +14,7 @@ from tagumori.query.ast import (
 )
 from tagumori.query.planner import (
     QP_And,
+    QP_Empty,
     QP_Not,
     QP_OnlyOne,
     QP_Or,
@@ -21,6 +22,7 @@ from tagumori.query.planner import (
     SegmentTag,
     SegmentWildCardSingle,
     TagPath,
+    expand_tagalongs,
     simplify,
     to_query_plan,
 )
@@ -182,3 +184,80 @@ class TestSimplify:
         # OR inside AND should not be flattened
         result = simplify(QP_And([QP_Or([a, b]), c]))
         assert result == QP_And([QP_Or([a, b]), c])
+
+
+class TestExpandTagalongs:
+    implied_by = {"rock": ["Led Zeppelin", "AC/DC"]}
+
+    def expand(self, qp):
+        return expand_tagalongs(qp, lambda name: self.implied_by.get(name, []))
+
+    def test_last_segment_gets_aliases(self):
+        qp = TagPath([SegmentTag("genre"), SegmentTag("rock")])
+        assert self.expand(qp) == TagPath(
+            [SegmentTag("genre"), SegmentTag("rock", aliases=("Led Zeppelin", "AC/DC"))]
+        )
+
+    def test_inner_segments_untouched(self):
+        qp = TagPath([SegmentTag("rock"), SegmentTag("live")])
+        assert self.expand(qp) == qp
+
+    def test_wildcard_untouched(self):
+        qp = TagPath([SegmentTag("rock"), SegmentWildCardSingle()])
+        assert self.expand(qp) == qp
+
+    def test_recurses_into_operators(self):
+        rock = TagPath([SegmentTag("rock")])
+        expanded = TagPath([SegmentTag("rock", aliases=("Led Zeppelin", "AC/DC"))])
+        assert self.expand(QP_And([QP_Not(rock), a])) == QP_And([QP_Not(expanded), a])
+
+
+class TestSimplifyWithTagalongs:
+    # rock implies guitar, which implies instrument
+    closure = {("rock", "guitar"), ("rock", "instrument"), ("guitar", "instrument")}
+
+    def simplify(self, qp):
+        return simplify(qp, lambda x, y: (x, y) in self.closure)
+
+    rock = TagPath([SegmentTag("rock")])
+    guitar = TagPath([SegmentTag("guitar")])
+    instrument = TagPath([SegmentTag("instrument")])
+
+    def test_implied_conjunct_dropped(self):
+        assert self.simplify(QP_And([self.guitar, self.rock])) == self.rock
+
+    def test_transitive(self):
+        qp = QP_And([self.instrument, self.rock, self.guitar, a])
+        assert self.simplify(qp) == QP_And([self.rock, a])
+
+    def test_contradiction(self):
+        assert self.simplify(QP_And([self.rock, QP_Not(self.guitar)])) == QP_Empty()
+
+    def test_empty_propagates(self):
+        qp = QP_Or([QP_And([self.rock, QP_Not(self.guitar)]), a])
+        assert self.simplify(qp) == a
+
+        qp = QP_And([QP_And([self.rock, QP_Not(self.guitar)]), a])
+        assert self.simplify(qp) == QP_Empty()
+
+    def test_same_position_only(self):
+        nested = TagPath([SegmentTag("genre"), SegmentTag("guitar")])
+        qp = QP_And([self.rock, nested])
+        assert self.simplify(qp) == qp
+
+        genre_rock = TagPath([SegmentTag("genre"), SegmentTag("rock")])
+        assert self.simplify(QP_And([genre_rock, nested])) == genre_rock
+
+    def test_implied_leaf_or_root_not_guaranteed(self):
+        leaf = TagPath([SegmentTag("guitar", is_leaf=True)])
+        root = TagPath([SegmentTag("guitar", is_root=True)])
+        assert self.simplify(QP_And([self.rock, leaf])) == QP_And([self.rock, leaf])
+        assert self.simplify(QP_And([self.rock, root])) == QP_And([self.rock, root])
+
+    def test_mutual_implication_keeps_one(self):
+        qp = QP_And([self.rock, self.guitar])
+        assert simplify(qp, lambda x, y: True) == self.guitar
+
+    def test_without_implies_unchanged(self):
+        qp = QP_And([self.guitar, self.rock])
+        assert simplify(qp) == qp
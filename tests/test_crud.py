@@ -1,3 +1,4 @@
+import sys
 from pathlib import Path
 
 import pytest
@@ -274,6 +275,94 @@ class TestFileCRUD:
             assert Path(fetched["path"]).is_absolute()
 
 
+class TestDirectory:
+    @pytest.fixture
+    def files(self, conn):
+        paths = ["/music/a.mp3", "/music/live/b.mp3", "/music/live/c.mp3", "/d.txt"]
+        crud.file.get_or_create_many(conn, [Path(p) for p in paths])
+        return paths
+
+    def _paths(self, conn):
+        return sorted(r["path"] for r in crud.file.get_all(conn))
+
+    def test_paths_share_directories(self, conn, files):
+        rows = conn.execute("SELECT parent_id, name FROM directory ORDER BY id")
+
+        assert [tuple(r) for r in rows] == [(None, ""), (1, "music"), (2, "live")]
+        assert self._paths(conn) == sorted(files)
+
+    def test_get_id(self, conn, files):
+        cache: dict[str, int] = {}
+        live = crud.directory.get_id(conn, "/music/live", cache=cache)
+
+        assert crud.directory.get_path(conn, live) == "/music/live"
+        assert set(cache) == {"", "/music", "/music/live"}
+        assert crud.directory.get_id(conn, "/music/nope") is None
+
+    def test_create_across_move(self, conn, monkeypatch):
+        """Directories moved between chunks aren't reused under the old path."""
+        # crud.file is the CRUD object, which shadows its module
+        monkeypatch.setattr(sys.modules["tagumori.crud.file"], "JSON_CHUNK_SIZE", 1)
+        paths = [Path("/a/x"), Path("/a/y")]
+        rows = crud.file.iter_or_create_many(conn, paths, resolve=False)
+
+        next(rows)
+        crud.directory.move(conn, "/a", "/b")
+
+        assert next(rows)["path"] == "/a/y"
+        assert self._paths(conn) == ["/a/y", "/b/x"]
+
+    def test_move_updates_one_row(self, conn, files):
+        before = conn.total_changes
+
+        moved = crud.directory.move(conn, "/music", "/archive/music")
+
+        # the new parent, the move itself and its change stamp
+        assert conn.total_changes - before == 3
+        assert moved == 3
+        assert self._paths(conn) == [
+            "/archive/music/a.mp3",
+            "/archive/music/live/b.mp3",
+            "/archive/music/live/c.mp3",
+            "/d.txt",
+        ]
+
+    def test_move_merges_into_existing(self, conn, files):
+        crud.file.get_or_create_many(conn, [Path("/other/live/b.mp3")])
+
+        moved = crud.directory.move(conn, "/music", "/other")
+
+        # b.mp3 was taken, so it stays
+        assert moved == 2
+        assert self._paths(conn) == [
+            "/d.txt",
+            "/music/live/b.mp3",
+            "/other/a.mp3",
+            "/other/live/b.mp3",
+            "/other/live/c.mp3",
+        ]
+
+    def test_move_under_itself_fails(self, conn, files):
+        with pytest.raises(ValueError):
+            crud.directory.move(conn, "/music", "/music/live/music")
+
+    def test_emptied_directories_are_pruned(self, conn, files):
+        live = crud.file.get_many_by_path(conn, [Path(p) for p in files[1:3]])
+
+        crud.file.delete_many(conn, [r["id"] for r in live])
+
+        names = [r["name"] for r in conn.execute("SELECT name FROM directory")]
+        assert names == ["", "music"]
+
+    def test_move_marks_files_changed(self, conn, files):
+        since = crud.change.advance(conn)
+
+        crud.directory.move(conn, "/music/live", "/live")
+
+        rows = crud.file_tag.iter_with_files(conn, since)
+        assert sorted(r["path"] for r in rows) == ["/live/b.mp3", "/live/c.mp3"]
+
+
 class TestFileTag:
     @pytest.fixture
     def file_and_tag(self, conn):
@@ -417,6 +506,28 @@ class TestFileTag:
         rows = crud.file_tag.get_by_file_ids(conn, [file_id])
         assert rows[0]["name"] == "jazz"
 
+    def test_attach_many(self, conn):
+        file1 = crud.file.get_or_create(conn, Path("a.txt"))
+        file2 = crud.file.get_or_create(conn, Path("b.txt"))
+        genre = crud.tag.create(conn, "genre")
+        rock = crud.tag.create(conn, "rock")
+        tree = [(1, 0, 1, genre["id"]), (2, 1, 2, rock["id"])]
+
+        crud.file_tag.attach_many(conn, [file1["id"], file2["id"]], tree)
+
+        for file_id in [file1["id"], file2["id"]]:
+            rock_id = crud.file_tag.resolve_path(conn, file_id, ("genre", "rock"))
+            assert rock_id is not None
+
+    def test_attach_many_idempotent(self, conn, file_and_tag):
+        file_id, tag_id = file_and_tag
+        existing = crud.file_tag.attach(conn, file_id, tag_id)
+
+        crud.file_tag.attach_many(conn, [file_id], [(1, 0, 1, tag_id)])
+
+        rows = crud.file_tag.get_by_file_ids(conn, [file_id])
+        assert [r["id"] for r in rows] == [existing]
+
 
 class TestTagalong:
     @pytest.fixture
@@ -538,6 +649,170 @@ class TestTagalong:
         tag_names = {r["name"] for r in rows}
         assert tag_names == {"A"}
 
+    def _closure(self, conn):
+        q = """
+            SELECT s.name, t.name FROM tagalong_closure c
+            JOIN tag s ON s.id = c.tag_id
+            JOIN tag t ON t.id = c.tagalong_id
+        """
+        return {tuple(r) for r in conn.execute(q)}
+
+    def _chain(self, conn, *names):
+        tags = [crud.tag.get_or_create(conn, n)["id"] for n in names]
+        for source, target in zip(tags, tags[1:]):
+            crud.tagalong.create(conn, source, target)
+        return tags
+
+    def test_closure_follows_create(self, conn):
+        self._chain(conn, "A", "B", "C")
+
+        assert self._closure(conn) == {("A", "B"), ("B", "C"), ("A", "C")}
+
+    def test_closure_create_joins_chains(self, conn):
+        _, b = self._chain(conn, "A", "B")
+        c, _ = self._chain(conn, "C", "D")
+
+        crud.tagalong.create(conn, b, c)
+
+        assert ("A", "D") in self._closure(conn)
+        assert len(self._closure(conn)) == 6
+
+    def test_closure_follows_delete(self, conn):
+        a, b, _ = self._chain(conn, "A", "B", "C")
+
+        crud.tagalong.delete(conn, a, b)
+
+        assert self._closure(conn) == {("B", "C")}
+
+    def test_closure_delete_keeps_other_paths(self, conn):
+        a, b, c = self._chain(conn, "A", "B", "C")
+        crud.tagalong.create(conn, a, c)
+
+        crud.tagalong.delete(conn, b, c)
+
+        assert self._closure(conn) == {("A", "B"), ("A", "C")}
+
+    def test_closure_delete_breaks_cycle(self, conn):
+        a, _, c = self._chain(conn, "A", "B", "C")
+        crud.tagalong.create(conn, c, a)
+        assert len(self._closure(conn)) == 9
+
+        crud.tagalong.delete(conn, c, a)
+
+        assert self._closure(conn) == {("A", "B"), ("B", "C"), ("A", "C")}
+
+    def test_rebuild_closure(self, conn):
+        _, b, _ = self._chain(conn, "A", "B", "C")
+
+        crud.tag.delete(conn, b)
+        crud.tagalong.rebuild_closure(conn)
+
+        assert self._closure(conn) == set()
+
+    def test_auto_apply(self, conn):
+        a, _, _ = self._chain(conn, "A", "B", "C")
+        file_row = crud.file.get_or_create(conn, Path("test.txt"))
+        crud.tagalong.set_auto_apply(conn, True)
+
+        parent_id = crud.file_tag.attach(conn, file_row["id"], a)
+        crud.file_tag.attach(conn, file_row["id"], a, parent_id)
+
+        rows = crud.file_tag.get_by_file_ids(conn, [file_row["id"]])
+        assert len(rows) == 6
+        assert crud.tagalong.is_auto_apply(conn)
+
+    def test_auto_apply_off(self, conn):
+        a, _ = self._chain(conn, "A", "B")
+        file_row = crud.file.get_or_create(conn, Path("test.txt"))
+        crud.tagalong.set_auto_apply(conn, True)
+        crud.tagalong.set_auto_apply(conn, False)
+
+        crud.file_tag.attach(conn, file_row["id"], a)
+
+        rows = crud.file_tag.get_by_file_ids(conn, [file_row["id"]])
+        assert [r["name"] for r in rows] == ["A"]
+        assert not crud.tagalong.is_auto_apply(conn)
+
+    def test_apply_by_tag(self, conn):
+        a, _ = self._chain(conn, "A", "B")
+        c, _ = self._chain(conn, "C", "D")
+        file_row = crud.file.get_or_create(conn, Path("test.txt"))
+        crud.file_tag.attach(conn, file_row["id"], a)
+        crud.file_tag.attach(conn, file_row["id"], c)
+
+        crud.tagalong.apply(conn, tag_ids=[a])
+
+        rows = crud.file_tag.get_by_file_ids(conn, [file_row["id"]])
+        assert {r["name"] for r in rows} == {"A", "B", "C"}
+
+    def test_implying(self, conn):
+        a, b, _ = self._chain(conn, "A", "B", "C")
+        crud.tag.create(conn, "D")
+
+        assert sorted(crud.tagalong.implying(conn, [b])) == [a, b]
+
+    def _implied(self, conn, file_id):
+        q = """
+            SELECT t.name, s.name FROM file_tag ft
+            JOIN tag t ON t.id = ft.tag_id
+            LEFT JOIN tag s ON s.id = ft.implied_by
+            WHERE ft.file_id = ?
+        """
+        return {tuple(r) for r in conn.execute(q, (file_id,))}
+
+    def test_apply_records_provenance(self, conn):
+        a, _, _ = self._chain(conn, "A", "B", "C")
+        file_row = crud.file.get_or_create(conn, Path("test.txt"))
+        crud.file_tag.attach(conn, file_row["id"], a)
+
+        crud.tagalong.apply(conn)
+
+        implied = self._implied(conn, file_row["id"])
+        assert implied == {("A", None), ("B", "A"), ("C", "A")}
+
+    def test_direct_attach_clears_provenance(self, conn):
+        a, b = self._chain(conn, "A", "B")
+        file_row = crud.file.get_or_create(conn, Path("test.txt"))
+        crud.file_tag.attach(conn, file_row["id"], a)
+        crud.tagalong.apply(conn)
+
+        crud.file_tag.attach_many(conn, [file_row["id"]], [(1, 0, 1, b)])
+
+        assert self._implied(conn, file_row["id"]) == {("A", None), ("B", None)}
+
+    def test_delete_retracts_implied_tags(self, conn):
+        a, b, c = self._chain(conn, "A", "B", "C")
+        file_row = crud.file.get_or_create(conn, Path("test.txt"))
+        crud.file_tag.attach(conn, file_row["id"], a)
+        crud.tagalong.apply(conn)
+
+        retracted = crud.tagalong.delete(conn, b, c, retract_tags=True)
+
+        assert retracted == 1
+        assert self._implied(conn, file_row["id"]) == {("A", None), ("B", "A")}
+
+    def test_retract_keeps_tags_implied_by_siblings(self, conn):
+        a, c = self._chain(conn, "A", "C")
+        b, _ = self._chain(conn, "B", "C")
+        file_row = crud.file.get_or_create(conn, Path("test.txt"))
+        crud.file_tag.attach(conn, file_row["id"], a)
+        crud.file_tag.attach(conn, file_row["id"], b)
+        crud.tagalong.apply(conn, tag_ids=[a])
+
+        retracted = crud.tagalong.delete(conn, a, c, retract_tags=True)
+
+        assert retracted == 0
+        assert ("C", "B") in self._implied(conn, file_row["id"])
+
+    def test_delete_keeps_tags_by_default(self, conn):
+        a, b = self._chain(conn, "A", "B")
+        file_row = crud.file.get_or_create(conn, Path("test.txt"))
+        crud.file_tag.attach(conn, file_row["id"], a)
+        crud.tagalong.apply(conn)
+
+        crud.tagalong.delete(conn, a, b)
+
+        assert ("B", "A") in self._implied(conn, file_row["id"])
 
 class TestCascadeDeletes:
     """Test that foreign key cascades work correctly."""
@@ -635,6 +910,47 @@ class TestCascadeDeletes:
         assert len(rows) == 1
         assert rows[0]["name"] == "genre"
 
+    def test_delete_many_files_cascades(self, conn):
+        files = crud.file.get_or_create_many(conn, [Path(f"{i}.txt") for i in range(3)])
+        ids = [f["id"] for f in files]
+        tag_row = crud.tag.create(conn, "rock")
+        for id_ in ids:
+            crud.file_tag.attach(conn, id_, tag_row["id"])
+
+        deleted = crud.file.delete_many(conn, ids[:2])
+
+        assert deleted == 2
+        rows = conn.execute("SELECT file_id FROM file_tag").fetchall()
+        assert [r["file_id"] for r in rows] == [ids[2]]
+
+    def test_drop_for_files(self, conn):
+        file_row = crud.file.get_or_create(conn, Path("test.txt"))
+        rock = crud.tag.create(conn, "rock")
+        parent_id = crud.file_tag.attach(conn, file_row["id"], rock["id"])
+        crud.file_tag.attach(conn, file_row["id"], rock["id"], parent_id)
+
+        deleted = crud.file_tag.drop_for_files(conn, [file_row["id"]])
+
+        assert deleted == 1
+        assert conn.execute("SELECT * FROM file_tag").fetchall() == []
+        assert crud.file.get(conn, file_row["id"]) is not None
+
+    def test_detach_tags_in_chunks(self, conn):
+        files = crud.file.get_or_create_many(conn, [Path(f"{i}.txt") for i in range(5)])
+        genre = crud.tag.create(conn, "genre")
+        rock = crud.tag.create(conn, "rock")
+        for f in files:
+            parent_id = crud.file_tag.attach(conn, f["id"], genre["id"])
+            crud.file_tag.attach(conn, f["id"], rock["id"], parent_id)
+
+        counts = []
+        while count := crud.file_tag.detach_tags(conn, [genre["id"]], 2):
+            counts.append(count)
+
+        assert counts == [2, 2, 1]
+        # children went with their parents
+        assert conn.execute("SELECT * FROM file_tag").fetchall() == []
+
 
 class TestFileTagPaths:
     """Tests for resolve_path."""
@@ -710,3 +1026,59 @@ class TestFileTagPaths:
         result = crud.file_tag.resolve_path(conn, file_id, ())
 
         assert result is None
+
+
+class TestLargeInputs:
+    """Inputs larger than SQLite's host parameter limit are chunked."""
+
+    N = 12_000
+
+    @pytest.fixture
+    def file_ids(self, conn):
+        paths = (Path(f"/bulk/{i}") for i in range(self.N))
+        return [r["id"] for r in crud.file.get_or_create_many(conn, paths)]
+
+    def test_get_or_create_many(self, conn, file_ids):
+        assert len(set(file_ids)) == self.N
+
+    def test_get_many(self, conn, file_ids):
+        rows = crud.file.get_many(conn, file_ids)
+
+        assert {r["id"] for r in rows} == set(file_ids)
+
+    def test_get_many_by_path(self, conn, file_ids):
+        paths = [Path(f"/bulk/{i}") for i in range(self.N)]
+
+        rows = crud.file.get_many_by_path(conn, paths)
+
+        assert len(rows) == self.N
+
+    def test_get_or_create_many_tags(self, conn):
+        names = [f"tag{i}" for i in range(2_000)]
+
+        rows = crud.tag.get_or_create_many(conn, names)
+
+        assert len(rows) == 2_000
+        assert len(crud.tag.get_many_by_name(conn, names)) == 2_000
+
+    def test_get_by_file_ids(self, conn, file_ids):
+        rock = crud.tag.create(conn, "rock")
+        crud.file_tag.attach_many(conn, file_ids, [(1, 0, 1, rock["id"])])
+
+        rows = crud.file_tag.get_by_file_ids(conn, file_ids)
+
+        assert len(rows) == self.N
+        assert [r["file_id"] for r in rows] == sorted(file_ids)
+
+    def test_tagalong_apply(self, conn, file_ids):
+        rock = crud.tag.create(conn, "rock")
+        guitar = crud.tag.create(conn, "guitar")
+        crud.tagalong.create(conn, rock["id"], guitar["id"])
+        crud.file_tag.attach_many(conn, file_ids, [(1, 0, 1, rock["id"])])
+
+        crud.tagalong.apply(conn, file_ids)
+
+        (count,) = conn.execute(
+            "SELECT COUNT(*) FROM file_tag WHERE tag_id = ?", (guitar["id"],)
+        ).fetchone()
+        assert count == self.N
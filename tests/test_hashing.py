@@ -0,0 +1,35 @@
+from tagumori import hashing
+
+
+def test_partial_hash_only_reads_ends(tmp_path):
+    size = hashing.PARTIAL_SIZE * 3
+    a, b = tmp_path / "a", tmp_path / "b"
+    data = bytearray(size)
+    a.write_bytes(data)
+    data[size // 2] = 1
+    b.write_bytes(data)
+
+    assert hashing.partial_hash(str(a)) == hashing.partial_hash(str(b))
+    assert hashing.full_hash(str(a)) != hashing.full_hash(str(b))
+
+
+def test_small_and_empty_files(tmp_path):
+    empty, small = tmp_path / "empty", tmp_path / "small"
+    empty.touch()
+    small.write_bytes(b"abc")
+
+    assert hashing.full_hash(str(empty)) != hashing.full_hash(str(small))
+    assert hashing.fingerprint(str(small))[0] == 3
+    assert hashing.fingerprint(str(tmp_path / "missing")) is None
+
+
+def test_map_paths_keeps_order(tmp_path):
+    paths = []
+    for i in range(5):
+        (tmp_path / str(i)).write_text(str(i))
+        paths.append(str(tmp_path / str(i)))
+
+    result = list(hashing.map_paths(hashing.safe_full_hash, paths, workers=2))
+
+    assert [p for p, _ in result] == paths
+    assert result[0][1] == hashing.full_hash(paths[0])
@@ -2,6 +2,7 @@ import sqlite3
 
 import pytest
 
+from tagumori import crud
 from tagumori.db.init import SCHEMA_PATH
 from tagumori.db.migrations import LATEST_VERSION, migrate
 
@@ -75,3 +76,54 @@ class TestMigrate:
         row = v2_conn.execute("SELECT * FROM query WHERE name = 'existing'").fetchone()
         assert row is not None
         assert row["ignore_tag_case"] is None or row["ignore_tag_case"] == 0
+
+    def test_migrate_stamps_changed_files(self, v2_conn):
+        migrate(v2_conn)
+        v2_conn.execute("INSERT INTO directory(id, name) VALUES (1, '')")
+        v2_conn.execute("INSERT INTO file(directory_id, name) VALUES (1, 'a'), (1, 'b')")
+        v2_conn.execute("INSERT INTO tag(name) VALUES ('rock')")
+        v2_conn.execute("UPDATE change_counter SET value = 5")
+
+        v2_conn.execute("INSERT INTO file_tag(file_id, tag_id) VALUES (2, 1)")
+
+        rows = v2_conn.execute("SELECT name, changed FROM file ORDER BY id").fetchall()
+        assert [tuple(r) for r in rows] == [("a", 1), ("b", 5)]
+
+    def test_migrate_splits_paths(self, v2_conn):
+        paths = ["/music/a.mp3", "/music/live/b.mp3", "/c.txt"]
+        v2_conn.executemany("INSERT INTO file(path) VALUES (?)", [(p,) for p in paths])
+        v2_conn.execute("INSERT INTO tag(name) VALUES ('rock')")
+        v2_conn.execute("INSERT INTO file_tag(file_id, tag_id) VALUES (2, 1)")
+
+        migrate(v2_conn)
+
+        assert [r["path"] for r in crud.file.get_all(v2_conn)] == paths
+        dirs = v2_conn.execute("SELECT parent_id, name FROM directory ORDER BY id")
+        assert [tuple(r) for r in dirs] == [(None, ""), (1, "music"), (2, "live")]
+        # tags survive the file table being rebuilt
+        assert v2_conn.execute("SELECT file_id FROM file_tag").fetchone()[0] == 2
+        assert v2_conn.execute("PRAGMA foreign_keys").fetchone()[0] == 1
+
+    def test_migrate_relative_paths(self, v2_conn):
+        paths = ["a.txt", "rel/b.txt", "/c.txt"]
+        v2_conn.executemany("INSERT INTO file(path) VALUES (?)", [(p,) for p in paths])
+
+        migrate(v2_conn)
+
+        # there's no relative directory to keep them in, so they go under root
+        assert [r["path"] for r in crud.file.get_all(v2_conn)] == [
+            "/a.txt",
+            "/rel/b.txt",
+            "/c.txt",
+        ]
+        dirs = v2_conn.execute("SELECT parent_id, name FROM directory ORDER BY id")
+        assert [tuple(r) for r in dirs] == [(None, ""), (1, "rel")]
+
+    def test_migrate_builds_tagalong_closure(self, v2_conn):
+        v2_conn.executemany("INSERT INTO tag(name) VALUES (?)", [("a",), ("b",), ("c",)])
+        v2_conn.executemany("INSERT INTO tagalong VALUES (?, ?)", [(1, 2), (2, 3)])
+
+        migrate(v2_conn)
+
+        rows = v2_conn.execute("SELECT * FROM tagalong_closure ORDER BY 1, 2").fetchall()
+        assert [tuple(r) for r in rows] == [(1, 2), (1, 3), (2, 3)]
@@ -1,4 +1,10 @@
-from tagumori import service
+import os
+
+from tagumori import crud, service
+
+
+def _tags(conn, file):
+    return str(service.get_files_with_tags(conn, [file])[file.resolve()]["ast"])
 
 
 class TestSearchFiles:
@@ -69,3 +75,458 @@ class TestSearchFiles:
 
         assert len(result) == 1
         assert result[0] == file.resolve()
+
+
+class TestAddTags:
+    def test_nested_tree_on_many_files(self, conn, tmp_path):
+        files = [tmp_path / f"{i}.txt" for i in range(3)]
+
+        service.add_tags_to_files(
+            conn, files, ["genre[rock[classic],jazz]", "mood"], apply_tagalongs=False
+        )
+
+        for file in files:
+            assert _tags(conn, file) == "genre[jazz,rock[classic]],mood"
+
+    def test_idempotent(self, conn, tmp_path):
+        file = tmp_path / "file.txt"
+
+        service.add_tags_to_files(conn, [file], ["genre[rock]"], False)
+        service.add_tags_to_files(conn, [file], ["genre[rock]"], False)
+
+        (count,) = conn.execute("SELECT COUNT(*) FROM file_tag").fetchone()
+        assert count == 2
+
+    def test_extends_existing_tree(self, conn, tmp_path):
+        file = tmp_path / "file.txt"
+
+        service.add_tags_to_files(conn, [file], ["genre[rock]"], False)
+        service.add_tags_to_files(conn, [file], ["genre[jazz[fusion]]"], False)
+
+        assert _tags(conn, file) == "genre[jazz[fusion],rock]"
+
+    def test_same_name_siblings_are_merged(self, conn, tmp_path):
+        file = tmp_path / "file.txt"
+
+        service.add_tags_to_files(conn, [file], ["a[b]", "a[c]"], False)
+
+        assert _tags(conn, file) == "a[b,c]"
+
+    def test_same_tag_at_different_depths(self, conn, tmp_path):
+        file = tmp_path / "file.txt"
+
+        service.add_tags_to_files(conn, [file], ["a[a[a]]"], False)
+
+        assert _tags(conn, file) == "a[a[a]]"
+
+
+class TestRemoveTags:
+    def test_removes_leaf_of_path(self, conn, tmp_path):
+        file = tmp_path / "file.txt"
+        service.add_tags_to_files(conn, [file], ["genre[rock,jazz]"], False)
+
+        removed = service.remove_tags_from_files(conn, [file], ["genre[rock]"])
+
+        assert removed == 1
+        assert _tags(conn, file) == "genre[jazz]"
+
+    def test_removes_subtree(self, conn, tmp_path):
+        file = tmp_path / "file.txt"
+        service.add_tags_to_files(conn, [file], ["genre[rock]", "mood"], False)
+
+        service.remove_tags_from_files(conn, [file], ["genre"])
+
+        assert _tags(conn, file) == "mood"
+
+    def test_many_files_and_paths(self, conn, tmp_path):
+        files = [tmp_path / f"{i}.txt" for i in range(3)]
+        service.add_tags_to_files(conn, files, ["a[b]", "c", "d"], False)
+
+        removed = service.remove_tags_from_files(conn, files, ["a[b]", "c"])
+
+        assert removed == 6
+        for file in files:
+            assert _tags(conn, file) == "a,d"
+
+    def test_path_must_match_from_root(self, conn, tmp_path):
+        file = tmp_path / "file.txt"
+        service.add_tags_to_files(conn, [file], ["genre[rock]"], False)
+
+        removed = service.remove_tags_from_files(conn, [file], ["rock"])
+
+        assert removed == 0
+        assert _tags(conn, file) == "genre[rock]"
+
+    def test_unknown_tag_is_not_created(self, conn, tmp_path):
+        file = tmp_path / "file.txt"
+        service.add_tags_to_files(conn, [file], ["rock"], False)
+
+        removed = service.remove_tags_from_files(conn, [file], ["jazz"])
+
+        assert removed == 0
+        assert crud.tag.get_by_name(conn, "jazz") is None
+
+
+class TestSetTags:
+    def _ids(self, conn):
+        q = "SELECT tag.name, file_tag.id FROM file_tag JOIN tag ON tag.id = tag_id"
+        return dict(conn.execute(q).fetchall())
+
+    def test_replaces_tags(self, conn, tmp_path):
+        file = tmp_path / "file.txt"
+        service.add_tags_to_files(conn, [file], ["rock", "genre[pop]"], False)
+
+        service.set_tags_on_files(conn, [file], ["jazz", "genre[blues]"], False)
+
+        assert _tags(conn, file) == "genre[blues],jazz"
+
+    def test_only_delta_is_applied(self, conn, tmp_path):
+        file = tmp_path / "file.txt"
+        service.add_tags_to_files(conn, [file], ["genre[rock,pop]", "mood"], False)
+        before = self._ids(conn)
+
+        service.set_tags_on_files(conn, [file], ["genre[rock[classic]]"], False)
+
+        after = self._ids(conn)
+        # genre and rock keep their rows, pop and mood are gone, classic is new
+        assert after["genre"] == before["genre"]
+        assert after["rock"] == before["rock"]
+        assert after.keys() == {"genre", "rock", "classic"}
+        assert _tags(conn, file) == "genre[rock[classic]]"
+
+    def test_different_trees_converge(self, conn, tmp_path):
+        a, b = tmp_path / "a.txt", tmp_path / "b.txt"
+        service.add_tags_to_files(conn, [a], ["x[y]"], False)
+        service.add_tags_to_files(conn, [b], ["y[x]", "z"], False)
+
+        service.set_tags_on_files(conn, [a, b], ["x[z]", "y"], False)
+
+        assert _tags(conn, a) == "x[z],y"
+        assert _tags(conn, b) == "x[z],y"
+
+    def test_other_files_untouched(self, conn, tmp_path):
+        a, b = tmp_path / "a.txt", tmp_path / "b.txt"
+        service.add_tags_to_files(conn, [a, b], ["rock"], False)
+
+        service.set_tags_on_files(conn, [a], ["jazz"], False)
+
+        assert _tags(conn, b) == "rock"
+
+
+class TestFilesWithTags:
+    def test_input_order_kept_and_untracked_skipped(self, conn, tmp_path):
+        a, b, c = (tmp_path / name for name in "abc")
+        service.add_tags_to_files(conn, [a, b], ["rock"], False)
+
+        result = service.iter_files_with_tags(conn, [b, c, a])
+
+        assert [path for path, _ in result] == [b.resolve(), a.resolve()]
+
+    def test_chunks(self, conn, tmp_path, monkeypatch):
+        monkeypatch.setattr(service, "CHUNK_SIZE", 2)
+        files = [tmp_path / f"{i}.txt" for i in range(5)]
+        service.add_tags_to_files(conn, files, ["genre[rock]"], False)
+
+        result = dict(service.iter_files_with_tags(conn, files))
+
+        assert len(result) == 5
+        assert all(str(data["ast"]) == "genre[rock]" for data in result.values())
+
+    def test_virtual_tagalongs_shown(self, conn, tmp_path):
+        file = tmp_path / "a"
+        service.add_tags_to_files(conn, [file], ["artist[AC/DC,rock]"], False)
+        ids = [t["id"] for t in crud.tag.get_or_create_many(conn, ["AC/DC", "rock"])]
+        crud.tagalong.create(conn, *ids)
+        crud.tagalong.create(conn, ids[1], crud.tag.create(conn, "music")["id"])
+        crud.tagalong.set_virtual(conn, True)
+
+        [(_, data)] = service.iter_files_with_tags(conn, [file])
+
+        # rock is already there, music comes in twice but shows once
+        assert str(data["ast"]) == "artist[AC/DC,rock,music]"
+
+
+class TestAddTagRecords:
+    def test_different_trees_per_file(self, conn, tmp_path):
+        a, b, c = (tmp_path / name for name in "abc")
+
+        service.add_tag_records(
+            conn,
+            [(a, ["genre[rock[classic]]"]), (b, ["genre[jazz]", "x"]), (c, [])],
+            apply_tagalongs=False,
+        )
+
+        result = service.get_files_with_tags(conn, [a, b, c])
+        assert str(result[a.resolve()]["ast"]) == "genre[rock[classic]]"
+        assert str(result[b.resolve()]["ast"]) == "genre[jazz],x"
+        assert c.resolve() in result
+
+    def test_merges_with_existing_tags(self, conn, tmp_path):
+        file = tmp_path / "file.txt"
+        service.add_tags_to_files(conn, [file], ["genre[rock]"], False)
+
+        service.add_tag_records(conn, [(file, ["genre[rock[70s]]"])], False)
+
+        result = service.get_files_with_tags(conn, [file])
+        assert str(result[file.resolve()]["ast"]) == "genre[rock[70s]]"
+
+    def test_import_records_batches(self, conn, tmp_path):
+        records = [(tmp_path / f"{i}.txt", ["rock"]) for i in range(5)]
+
+        counts = list(service.import_records(conn, records, False, batch_size=2))
+
+        assert counts == [2, 2, 1]
+        assert len(service.execute_query(conn, ["rock"], [])) == 5
+
+
+class TestBulkDelete:
+    def test_drop_file_tags_in_batches(self, conn, tmp_path):
+        files = [tmp_path / f"{i}.txt" for i in range(5)]
+        service.add_tags_to_files(conn, files, ["genre[rock]"], False)
+        file_ids = [f["id"] for f in crud.file.get_many_by_path(conn, files)]
+
+        batches = list(service.iter_drop_file_tags(conn, file_ids, batch_size=2))
+
+        assert batches == [2, 2, 1]
+        assert crud.file.get_all(conn) == []
+        assert conn.execute("SELECT * FROM file_tag").fetchall() == []
+
+    def test_drop_file_tags_retain_file(self, conn, tmp_path):
+        file = tmp_path / "file.txt"
+        service.add_tags_to_files(conn, [file], ["rock"], False)
+
+        service.drop_file_tags(conn, [file], retain_file=True)
+
+        assert crud.file.get_by_path(conn, file) is not None
+        assert conn.execute("SELECT * FROM file_tag").fetchall() == []
+
+    def test_delete_tags(self, conn, tmp_path):
+        files = [tmp_path / f"{i}.txt" for i in range(3)]
+        service.add_tags_to_files(conn, files, ["genre[rock]", "mood"], False)
+        genre = crud.tag.get_by_name(conn, "genre")
+
+        batches = list(service.iter_delete_tags(conn, [genre["id"]], batch_size=2))
+
+        assert batches == [2, 1]
+        assert crud.tag.get_by_name(conn, "genre") is None
+        # tags of deleted subtrees remain, just unused
+        assert crud.tag.get_by_name(conn, "rock") is not None
+        for path, data in service.iter_files_with_tags(conn, files):
+            assert str(data["ast"]) == "mood"
+
+    def test_delete_tags_with_tagalongs(self, conn, tmp_path):
+        implied, implying = tmp_path / "implied.txt", tmp_path / "implying.txt"
+        a, b, c, d = crud.tag.get_or_create_many(conn, ["a", "b", "c", "d"])
+        crud.tagalong.create(conn, a["id"], b["id"])
+        crud.tagalong.create(conn, b["id"], c["id"])
+        crud.tagalong.create(conn, c["id"], d["id"])
+        service.add_tags_to_files(conn, [implied], ["b"])
+        service.add_tags_to_files(conn, [implying], ["a"])
+
+        batches = list(service.iter_delete_tags(conn, [b["id"]], batch_size=2))
+
+        # both b nodes, then the c and d nodes b implied
+        assert batches == [2, 2]
+        [(_, data)] = service.iter_files_with_tags(conn, [implying])
+        assert str(data["ast"]) == "a,c,d"
+        # pairs through b are gone, the one not involving it stays
+        closure = conn.execute("SELECT tag_id, tagalong_id FROM tagalong_closure")
+        assert [tuple(row) for row in closure] == [(c["id"], d["id"])]
+
+
+class TestReplaceTags:
+    def _add(self, conn, file, tags):
+        service.add_tags_to_files(conn, [file], tags, False)
+
+    def test_simple_rename(self, conn, tmp_path):
+        file = tmp_path / "file.txt"
+        self._add(conn, file, ["genre[rock]"])
+
+        merged = service.replace_tags(conn, ["rock"], "jazz")
+
+        assert merged == 0
+        assert _tags(conn, file) == "genre[jazz]"
+
+    def test_auto_apply(self, conn, tmp_path):
+        file = tmp_path / "file.txt"
+        self._add(conn, file, ["genre[rock]"])
+        jazz, bebop = crud.tag.get_or_create_many(conn, ["jazz", "bebop"])
+        crud.tagalong.create(conn, jazz["id"], bebop["id"])
+        crud.tagalong.set_auto_apply(conn, True)
+
+        service.replace_tags(conn, ["rock"], "jazz")
+
+        assert _tags(conn, file) == "genre[bebop,jazz]"
+
+    def test_collision_at_root(self, conn, tmp_path):
+        file = tmp_path / "file.txt"
+        self._add(conn, file, ["rock", "jazz"])
+
+        merged = service.replace_tags(conn, ["rock"], "jazz")
+
+        assert merged == 1
+        assert _tags(conn, file) == "jazz"
+
+    def test_colliding_subtrees_are_merged(self, conn, tmp_path):
+        file = tmp_path / "file.txt"
+        self._add(conn, file, ["a[x[1],y]", "b[x[2],z]"])
+
+        service.replace_tags(conn, ["a"], "b")
+
+        assert _tags(conn, file) == "b[x[1,2],y,z]"
+
+    def test_many_to_one(self, conn, tmp_path):
+        file = tmp_path / "file.txt"
+        self._add(conn, file, ["genre[rock[x],roll[y],jazz]"])
+
+        merged = service.replace_tags(conn, ["rock", "roll", "jazz"], "music")
+
+        assert merged == 2
+        assert _tags(conn, file) == "genre[music[x,y]]"
+
+    def test_nested_sources(self, conn, tmp_path):
+        file = tmp_path / "file.txt"
+        self._add(conn, file, ["a[b[c]]", "b[a[d]]"])
+
+        service.replace_tags(conn, ["a", "b"], "t")
+
+        assert _tags(conn, file) == "t[t[c,d]]"
+
+    def test_only_files_with_sources_change(self, conn, tmp_path):
+        a, b = tmp_path / "a.txt", tmp_path / "b.txt"
+        self._add(conn, a, ["rock", "jazz"])
+        self._add(conn, b, ["jazz[x]"])
+
+        service.replace_tags(conn, ["rock"], "jazz")
+
+        assert _tags(conn, b) == "jazz[x]"
+
+    def test_remove(self, conn, tmp_path):
+        file = tmp_path / "file.txt"
+        self._add(conn, file, ["rock"])
+
+        service.replace_tags(conn, ["rock", "jazz"], "jazz", remove=True)
+
+        assert crud.tag.get_by_name(conn, "rock") is None
+        assert _tags(conn, file) == "jazz"
+
+
+class TestRelocateFiles:
+    def test_many_in_one_walk(self, conn, tmp_path):
+        files = [tmp_path / f"{i}.txt" for i in range(3)]
+        for f in files:
+            f.touch()
+        service.add_tags_to_files(conn, files, ["rock"], False)
+
+        dest = tmp_path / "moved" / "deeper"
+        dest.mkdir(parents=True)
+        for f in files[:2]:
+            f.rename(dest / f.name)
+        files[2].unlink()
+
+        records = crud.file.get_many_by_path(conn, files)
+        missing = service.relocate_files(conn, records, tmp_path)
+
+        assert [r["path"] for r in missing] == [str(files[2].resolve())]
+        for f in files[:2]:
+            assert crud.file.get_by_path(conn, dest / f.name) is not None
+
+    def test_files_vanishing_mid_walk_are_skipped(self, conn, tmp_path, monkeypatch):
+        # a missing file, so the whole tree is walked
+        file = tmp_path / "file.txt"
+        file.touch()
+        service.add_tags_to_files(conn, [file], ["rock"], False)
+        file.unlink()
+        (tmp_path / "gone.txt").touch()
+        walk = service.iter_files
+
+        def vanishing(root):
+            for entry in walk(root):
+                if entry.name == "gone.txt":
+                    os.unlink(entry.path)
+                yield entry
+
+        monkeypatch.setattr(service, "iter_files", vanishing)
+        records = crud.file.get_many_by_path(conn, [file])
+
+        assert service.relocate_files(conn, records, tmp_path) == records
+
+    def test_inode_lookup_uses_index(self, conn):
+        plan = conn.execute(
+            "EXPLAIN QUERY PLAN SELECT * FROM file WHERE inode = ?", (1,)
+        ).fetchall()
+        assert "idx_file_inode_device" in plan[0]["detail"]
+
+
+class TestRefreshInodes:
+    def test_only_files_under_directory(self, conn, tmp_path):
+        files = [tmp_path / "in" / "a.txt", tmp_path / "in" / "deeper" / "b.txt"]
+        files.append(tmp_path / "out.txt")
+        for f in files:
+            f.parent.mkdir(parents=True, exist_ok=True)
+            f.touch()
+        records = crud.file.get_or_create_many(conn, files)
+        crud.file.update_inodes(conn, ((r["id"], None, None) for r in records))
+
+        refreshed = service.refresh_inodes_under(conn, tmp_path / "in", workers=2)
+
+        assert refreshed == 2
+        inodes = [r["inode"] for r in crud.file.get_many_by_path(conn, files)]
+        assert inodes == [f.stat().st_ino for f in files[:2]] + [None]
+
+
+class TestFingerprints:
+    def _files(self, conn, tmp_path, contents):
+        files = []
+        for i, content in enumerate(contents):
+            f = tmp_path / f"{i}.bin"
+            f.write_bytes(content)
+            files.append(f)
+        service.add_tags_to_files(conn, files, ["rock"], False)
+        return files
+
+    def test_hash_files(self, conn, tmp_path):
+        self._files(conn, tmp_path, [b"a", b"b", b""])
+
+        assert sum(service.iter_hash_files(conn, batch_size=2)) == 3
+        assert sum(service.iter_hash_files(conn)) == 0
+        assert sum(service.iter_hash_files(conn, rehash=True)) == 3
+
+    def test_hash_files_once_while_storing(self, conn, tmp_path):
+        """Hashes stored between batches don't upset the pending ones."""
+        self._files(conn, tmp_path, [bytes([i]) for i in range(50)])
+
+        assert sum(service.iter_hash_files(conn, workers=1, batch_size=1)) == 50
+        assert (
+            conn.execute("SELECT COUNT(*) FROM file WHERE hash IS NULL").fetchone()[0]
+            == 0
+        )
+
+    def test_relocate_by_content(self, conn, tmp_path):
+        [a, _] = self._files(conn, tmp_path, [b"a" * 100, b"b" * 100])
+        sum(service.iter_hash_files(conn))
+
+        # copied elsewhere and deleted, like a move across filesystems
+        dest = tmp_path / "elsewhere"
+        dest.mkdir()
+        (dest / "copy.bin").write_bytes(a.read_bytes())
+        (dest / "other.bin").write_bytes(b"c" * 100)
+        a.unlink()
+
+        records = crud.file.get_many_by_path(conn, [a])
+        assert service.relocate_files(conn, records, tmp_path) == []
+        assert crud.file.get_by_path(conn, dest / "copy.bin") is not None
+
+    def test_dupes(self, conn, tmp_path):
+        big = b"x" * (1 << 18)
+        contents = [b"same", b"same", b"diff", big, big[:-1] + b"y", b"", b""]
+        files = self._files(conn, tmp_path, contents)
+
+        groups = list(service.iter_dupes(conn))
+
+        assert groups == [[str(files[0].resolve()), str(files[1].resolve())]]
+
+        # fingerprints of candidates are kept
+        assert crud.file.get_by_path(conn, files[0])["hash"] is not None
+        assert crud.file.get_by_path(conn, files[2])["hash"] is None
+        assert list(service.iter_dupes(conn)) == groups
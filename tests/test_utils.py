@@ -1,4 +1,17 @@
-from tagumori.utils import compile_pattern
+import io
+import json
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import pytest
+
+from tagumori.utils import (
+    compile_pattern,
+    iter_files,
+    iter_json_members,
+    iter_tree,
+    map_ahead,
+)
 
 
 def test_compile_pattern_basic():
@@ -35,3 +48,94 @@ def test_compile_pattern_regex():
 def test_compile_pattern_empty_returns_none():
     assert compile_pattern("", ignore_case=False) is None
     assert compile_pattern("", ignore_case=True) is None
+
+
+def test_iter_json_members_streams_arrays():
+    data = {"entries": [{"name": "a"}, {"name": "b" * 50}], "x": 1, "empty": []}
+    f = io.BytesIO(json.dumps(data).encode())
+
+    # tiny chunks force values to span buffer refills
+    members = list(iter_json_members(f, chunk_size=7))
+
+    assert members == [
+        ("entries", {"name": "a"}),
+        ("entries", {"name": "b" * 50}),
+        ("x", 1),
+    ]
+
+
+def test_iter_json_members_bad_input():
+    f = io.BytesIO(b'{"entries": [1, 2')
+
+    with pytest.raises(ValueError):
+        list(iter_json_members(f))
+
+
+def test_iter_json_members_truncated():
+    data = {"entries": [{"name": "a"}, {"name": "b" * 50}]}
+    f = io.BytesIO(json.dumps(data).encode()[:-20])
+
+    members = iter_json_members(f, chunk_size=7)
+
+    assert next(members) == ("entries", {"name": "a"})
+    with pytest.raises(ValueError):
+        next(members)
+
+
+def test_iter_json_members_stops_early():
+    # neither a malformed item nor one that's too large reads the rest
+    rest = b", " + b'{"name": "b"}, ' * 1000 + b"{}]}"
+    for head, max_size in [(b"{x}", 1 << 26), (b'{"name": "' + b"a" * 100, 50)]:
+        f = io.BytesIO(b'{"entries": [' + head + rest)
+
+        with pytest.raises(ValueError):
+            list(iter_json_members(f, chunk_size=16, max_size=max_size))
+        assert f.tell() < 500
+
+
+def test_iter_files(tmp_path):
+    (tmp_path / "a" / "b").mkdir(parents=True)
+    for name in ["x", "a/y", "a/b/z"]:
+        (tmp_path / name).touch()
+    (tmp_path / "link").symlink_to(tmp_path / "a", target_is_directory=True)
+
+    found = sorted(Path(e.path).relative_to(tmp_path) for e in iter_files(tmp_path))
+
+    # the symlinked directory isn't walked into
+    assert found == [Path("a/b/z"), Path("a/y"), Path("x")]
+
+
+@pytest.mark.parametrize(
+    "include, exclude, expected",
+    [
+        ((), (), ["a.mp3", "b.txt", "live/.git/c.mp3", "live/d.mp3"]),
+        (("*.mp3",), (), ["a.mp3", "live/.git/c.mp3", "live/d.mp3"]),
+        (("*.mp3",), (".git",), ["a.mp3", "live/d.mp3"]),
+        ((), ("live/*",), ["a.mp3", "b.txt"]),
+        (("live/*",), ("*.txt",), ["live/.git/c.mp3", "live/d.mp3"]),
+    ],
+)
+def test_iter_tree_globs(tmp_path, include, exclude, expected):
+    (tmp_path / "live" / ".git").mkdir(parents=True)
+    for name in ["a.mp3", "b.txt", "live/.git/c.mp3", "live/d.mp3"]:
+        (tmp_path / name).touch()
+
+    found = iter_tree(tmp_path, include, exclude)
+
+    assert sorted(p.relative_to(tmp_path).as_posix() for p in found) == expected
+
+
+def test_map_ahead_is_lazy_and_ordered():
+    consumed = []
+
+    def items():
+        for i in range(10):
+            consumed.append(i)
+            yield i
+
+    with ThreadPoolExecutor(4) as pool:
+        results = map_ahead(pool, lambda x: x * 2, items(), ahead=3)
+        assert next(results) == (0, 0)
+        # only a window's worth has been pulled from the input
+        assert len(consumed) == 3
+        assert list(results) == [(i, i * 2) for i in range(1, 10)]
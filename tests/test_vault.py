@@ -0,0 +1,110 @@
+import pytest
+
+from tagumori import Vault, crud
+
+
+@pytest.fixture
+def vault(tmp_path):
+    with Vault.create(tmp_path / "vault.db") as vault:
+        yield vault
+
+
+@pytest.fixture
+def files(tmp_path):
+    paths = [tmp_path / "a.mp3", tmp_path / "b.mp3", tmp_path / "c.mp3"]
+    for p in paths:
+        p.write_text("")
+    return paths
+
+
+class TestVault:
+    def test_missing_vault_raises(self, tmp_path):
+        with pytest.raises(FileNotFoundError):
+            Vault(tmp_path / "nope.db")
+
+    def test_add_and_query(self, vault, files):
+        a, b, c = files
+        vault.add([a, c], ["genre[rock]"])
+        vault.add([b], ["genre[jazz]"])
+
+        result = vault.compile("genre[rock]").paths()
+
+        assert list(result) == [a.resolve(), c.resolve()]
+
+    def test_changes_are_committed(self, vault, files):
+        vault.add(files, ["rock"])
+
+        with Vault(vault.path) as other:
+            assert len(list(other.compile("rock").ids())) == 3
+
+    def test_compile_is_cached(self, vault):
+        assert vault.compile("rock") is vault.compile("rock")
+        assert vault.compile("rock") is not vault.compile("rock", ignore_tag_case=True)
+
+    def test_prepared_query_sees_later_changes(self, vault, files):
+        a, b, _ = files
+        query = vault.compile("rock")
+        vault.add([a], ["rock"])
+
+        assert list(query.paths()) == [a.resolve()]
+
+        vault.add([b], ["rock"])
+
+        assert list(query.paths()) == [a.resolve(), b.resolve()]
+
+    def test_ignore_tag_case(self, vault, files):
+        vault.add(files[:1], ["Rock"])
+
+        assert list(vault.compile("rock").ids()) == []
+        assert len(list(vault.compile("rock", ignore_tag_case=True).ids())) == 1
+
+    def test_empty_query_matches_all(self, vault, files):
+        vault.add(files, ["rock"])
+
+        assert list(vault.compile("").paths()) == [f.resolve() for f in files]
+
+    def test_iter_yields_records(self, vault, files):
+        vault.add(files, ["rock"])
+
+        records = list(vault.compile("rock").iter())
+
+        assert [r["path"] for r in records] == [str(f.resolve()) for f in files]
+
+    def test_results_are_lazy(self, vault, files, monkeypatch):
+        vault.add(files, ["rock"])
+        monkeypatch.setattr("tagumori.vault.FETCH_SIZE", 1)
+        fetched = []
+        get_many = crud.file.get_many
+
+        def spy(conn, ids):
+            fetched.append(ids)
+            return get_many(conn, ids)
+
+        monkeypatch.setattr(crud.file, "get_many", spy)
+
+        result = vault.compile("rock").paths()
+
+        assert next(result) == files[0].resolve()
+        assert fetched == [[1]]
+        assert next(result) == files[1].resolve()
+        assert fetched == [[1], [2]]
+
+    def test_ids_are_streamed(self, vault, files, monkeypatch):
+        vault.add(files, ["rock"])
+
+        def collect(*args):
+            raise AssertionError("matches were collected up front")
+
+        monkeypatch.setattr("tagumori.query.executor.execute", collect)
+        ids = vault.compile("rock").ids()
+
+        assert next(ids) == 1
+        assert list(ids) == [2, 3]
+
+    def test_remove_and_set(self, vault, files):
+        a, *_ = files
+        vault.add([a], ["rock", "jazz"])
+        vault.remove([a], ["rock"])
+        vault.set([a], ["blues"])
+
+        assert str(vault.tags([a])[a.resolve()]["ast"]) == "blues"
@@ -0,0 +1,118 @@
+import sys
+
+import pytest
+
+from tagumori import crud, service
+from tagumori.watch import Changes, InotifyWatcher, PollingWatcher
+
+
+@pytest.fixture
+def tree(conn, tmp_path):
+    """tmp_path/music/{a,b}.mp3 and tmp_path/music/live/c.mp3, all tracked."""
+    root = tmp_path.resolve()
+    (root / "music" / "live").mkdir(parents=True)
+    files = [root / "music" / "a.mp3", root / "music" / "b.mp3"]
+    files.append(root / "music" / "live" / "c.mp3")
+    for f in files:
+        f.touch()
+    crud.file.get_or_create_many(conn, files)
+    return root
+
+
+def _paths(conn):
+    return sorted(r["path"] for r in crud.file.get_all(conn))
+
+
+WATCHERS = [PollingWatcher]
+if sys.platform.startswith("linux"):
+    WATCHERS.append(InotifyWatcher)
+
+
+def _changes(watcher) -> Changes:
+    if isinstance(watcher, PollingWatcher):
+        return watcher.poll()
+    return watcher.to_changes(watcher._read(1.0))
+
+
+@pytest.mark.parametrize("watcher_cls", WATCHERS)
+class TestWatchers:
+    def test_directory_move_is_a_prefix_move(self, conn, tree, watcher_cls):
+        w = watcher_cls([tree])
+        (tree / "music").rename(tree / "songs")
+
+        changes = _changes(w)
+        w.close()
+
+        assert changes.moves == [(str(tree / "music"), str(tree / "songs"))]
+        assert service.sync_changes(conn, changes) == (3, 0, 0)
+        assert _paths(conn) == [
+            str(tree / "songs" / "a.mp3"),
+            str(tree / "songs" / "b.mp3"),
+            str(tree / "songs" / "live" / "c.mp3"),
+        ]
+
+    def test_file_rename_move_and_delete(self, conn, tree, watcher_cls):
+        w = watcher_cls([tree])
+        music = tree / "music"
+        (music / "a.mp3").rename(music / "renamed.mp3")
+        (music / "b.mp3").rename(tree / "b.mp3")
+        (music / "live" / "c.mp3").unlink()
+
+        changes = _changes(w)
+        w.close()
+
+        assert service.sync_changes(conn, changes) == (2, 0, 1)
+        assert _paths(conn) == [
+            str(tree / "b.mp3"),
+            str(music / "live" / "c.mp3"),
+            str(music / "renamed.mp3"),
+        ]
+
+    def test_moved_in_from_unwatched_dir(self, conn, tree, watcher_cls):
+        inbox = tree / "inbox"
+        inbox.mkdir()
+        w = watcher_cls([inbox])
+        (tree / "music").rename(inbox / "music")
+
+        changes = _changes(w)
+        w.close()
+
+        moved, _, _ = service.sync_changes(conn, changes)
+        assert moved == 3
+        assert all(p.startswith(str(inbox)) for p in _paths(conn))
+
+
+def test_replaced_file_refreshed(conn, tree):
+    # like an editor's atomic save
+    a = tree / "music" / "a.mp3"
+    tmp = tree / "a.tmp"
+    tmp.write_text("new")
+    tmp.rename(a)
+
+    changes = Changes(dirs={str(a.parent)})
+    assert service.sync_changes(conn, changes) == (0, 1, 0)
+    assert crud.file.get_by_path(conn, a)["inode"] == a.stat().st_ino
+
+
+def test_move_prefix_leaves_siblings(conn, tree):
+    (tree / "music2").mkdir()
+    (tree / "music2" / "x.mp3").touch()
+    crud.file.get_or_create(conn, tree / "music2" / "x.mp3")
+
+    assert crud.file.move_prefix(conn, str(tree / "music"), str(tree / "m")) == 3
+    assert str(tree / "music2" / "x.mp3") in _paths(conn)
+
+
+def test_bad_move_is_skipped(conn, tree):
+    music = str(tree / "music")
+    changes = Changes(
+        moves=[(music, music + "/live/music"), (music + "/live", music + "/concerts")]
+    )
+
+    with pytest.raises(ValueError):
+        service.sync_changes(conn, changes)
+
+    errors = []
+    assert service.sync_changes(conn, changes, errors) == (1, 0, 0)
+    assert len(errors) == 1 and errors[0].startswith(music + " -> ")
+    assert _paths(conn)[-1] == music + "/concerts/c.mp3"